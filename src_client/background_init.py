@@ -16,11 +16,11 @@ def load_embedding_model():
     def _load_embedding_model_and_start_loading_doc():
         try:
             logging.debug("预加载: load_embedding_model()")
-            from domain.kb_domain.serv.VectorModel.VectorLoader import EmbeddingLoader
+            from domain.kb_domain.serv import EmbeddingModelServ
             logging.debug("预加载: import EmbeddingLoader 完成")
-            client_global.model_name_or_path = frozen_support.get_vector_model_path()
-            client_global.embedding_model = EmbeddingLoader(model_name_or_path=client_global.model_name_or_path)
-            logging.debug("预加载: Embedding 模型加载完成")
+            # 加载当前使用的模型，配置中切换的新模型由后台任务重新生成向量后再启用
+            EmbeddingModelServ.load_active_model()
+            logging.debug(f"预加载: Embedding 模型加载完成 {client_global.embedding_model_name}")
             from domain.kb_domain.task import task_scan_and_load
             client_global.task_scan_and_load = task_scan_and_load.TaskScanAndLoad()
             client_global.task_scan_and_load.start()
@@ -3,5 +3,7 @@ embedding_model = None
 web_port = None
 task_scan_and_load = None
 model_name_or_path = None
+# 当前使用的向量模型（embedding_model 表中 state 为 active 的模型名）
+embedding_model_name = None
 ai_base_url = None
 ai_api_key = None
\ No newline at end of file
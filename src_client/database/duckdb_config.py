@@ -1,7 +1,15 @@
+import os
+
 import frozen_support
 database_file = frozen_support.get_user_database_path()
 duckdb_config = {
     'database': database_file,
+    # ANN 向量索引文件，与数据库文件放在同一目录
+    'ann_index_file': os.path.splitext(database_file)[0] + '.ann.npz',
+    # 按顶级知识库保存的向量矩阵目录（np.memmap 映射），与数据库文件放在同一目录
+    'vector_matrix_dir': os.path.splitext(database_file)[0] + '.vectors',
+    # 向量维度（bge-small-zh-v1.5），document_chunk.chunk_vector 为 FLOAT[vector_dim]
+    'vector_dim': 512,
     'kb_table': 'knowledge_base',
     'file_table': 'document',
 }
@@ -0,0 +1,280 @@
+import logging
+
+from database.duckdb_config import duckdb_config
+from util import TextTokenUtil
+
+# -----------------------------
+# 数据库结构升级
+# 每个版本按顺序执行一次，已执行的版本号记录在 schema_version 表中。
+# 旧版本的 default.duck 在启动时会自动升级到最新结构。
+# -----------------------------
+
+# 向量相似度函数，以宏的形式保存在数据库中，所有连接（包括 direct_exesql 的只读连接）都可以直接使用。
+# 均由 DuckDB 原生的列表/数组函数批量计算，不再逐行调用 Python。
+# 返回角度相似度（Angular Similarity）：1 - arccos(cos) / π，范围 [0.0, 1.0]
+FUNCTIONS = [
+    # 余弦值转换为角度相似度
+    "CREATE OR REPLACE MACRO angular_similarity(cos_val) AS "
+    "1.0 - acos(greatest(least(cos_val, 1.0), -1.0)) / pi()",
+    # 任意向量的角度相似度
+    "CREATE OR REPLACE MACRO cosine_similarity(a, b) AS "
+    "angular_similarity(list_cosine_similarity(a, b))",
+    # 单位向量（定长 FLOAT[n] 数组）的角度相似度，只需计算内积
+    "CREATE OR REPLACE MACRO unit_cosine_similarity(a, b) AS "
+    "angular_similarity(array_inner_product(a, b))",
+    # 分片文本：分片只保存在 document.file_content 中的位置 [chunk_start, chunk_end)（从 0 开始，按字符计），
+    # 检索时再截取；早期入库、在原文中找不到的分片仍保存在 chunk_text 中
+    "CREATE OR REPLACE MACRO chunk_text_of(chunk_text, file_content, chunk_start, chunk_end) AS "
+    "coalesce(chunk_text, substring(file_content, chunk_start + 1, chunk_end - chunk_start))",
+]
+
+# 单位化 DOUBLE[][] 向量列表的 SQL 表达式
+_NORMALIZE_VECTORS = "list_transform({col}, v -> list_transform(v, x -> x / greatest(sqrt(list_inner_product(v, v)), 1e-12)))"
+
+_VECTOR_TYPE = f"FLOAT[{duckdb_config['vector_dim']}]"
+
+
+def _build_chunk_terms(conn, batch_size: int = 500):
+    """
+    为已入库的分片生成词项倒排索引（按文档分批）
+    """
+    doc_ids = [row[0] for row in conn.execute("SELECT DISTINCT document_id FROM document_chunk").fetchall()]
+    for i in range(0, len(doc_ids), batch_size):
+        rows = conn.execute("""
+            SELECT document_id, chunk_index, chunk_text FROM document_chunk
+            WHERE list_contains(?, document_id)
+            ORDER BY document_id, chunk_index
+        """, (doc_ids[i:i + batch_size],)).fetchall()
+        chunks_by_doc = {}
+        for document_id, chunk_index, chunk_text in rows:
+            chunks_by_doc.setdefault(document_id, []).append(chunk_text or '')
+        for document_id, chunks in chunks_by_doc.items():
+            term_rows, term_cnts = TextTokenUtil.build_term_rows(document_id, chunks)
+            conn.execute("""
+                INSERT INTO chunk_term (term_id, document_id, chunk_index, tf)
+                SELECT UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS INTEGER[])), UNNEST(CAST(? AS INTEGER[]))
+            """, (term_rows['term_id'], term_rows['document_id'], term_rows['chunk_index'], term_rows['tf']))
+            conn.execute("""
+                UPDATE document_chunk SET term_cnt = s.term_cnt
+                FROM (SELECT UNNEST(CAST(? AS INTEGER[])) AS chunk_index, UNNEST(CAST(? AS INTEGER[])) AS term_cnt) s
+                WHERE document_chunk.document_id = ? AND document_chunk.chunk_index = s.chunk_index
+            """, (list(range(len(term_cnts))), term_cnts, document_id))
+
+
+def _fill_chunk_hashes(conn, batch_size: int = 500):
+    """
+    为已入库的分片计算内容哈希（按文档分批）
+    """
+    doc_ids = [row[0] for row in conn.execute("SELECT DISTINCT document_id FROM document_chunk").fetchall()]
+    for i in range(0, len(doc_ids), batch_size):
+        rows = conn.execute("""
+            SELECT document_id, chunk_index, chunk_text FROM document_chunk
+            WHERE list_contains(?, document_id)
+        """, (doc_ids[i:i + batch_size],)).fetchall()
+        conn.execute("""
+            UPDATE document_chunk SET chunk_hash = s.chunk_hash
+            FROM (SELECT UNNEST(CAST(? AS BIGINT[])) AS document_id, UNNEST(CAST(? AS INTEGER[])) AS chunk_index,
+                         UNNEST(CAST(? AS BIGINT[])) AS chunk_hash) s
+            WHERE document_chunk.document_id = s.document_id AND document_chunk.chunk_index = s.chunk_index
+        """, ([r[0] for r in rows], [r[1] for r in rows], [TextTokenUtil.text_hash(r[2]) for r in rows]))
+
+
+MIGRATIONS = [
+    (1, '已入库的向量单位化', [
+        f"UPDATE document SET file_content_chunks_vector = {_NORMALIZE_VECTORS.format(col='file_content_chunks_vector')} "
+        f"WHERE file_content_chunks_vector IS NOT NULL",
+        f"UPDATE document SET file_name_vector = {_NORMALIZE_VECTORS.format(col='file_name_vector')} "
+        f"WHERE file_name_vector IS NOT NULL",
+    ]),
+    (2, '分片拆分到 document_chunk 表，向量改为定长 FLOAT 数组', [
+        f"""
+        CREATE TABLE document_chunk (
+            document_id BIGINT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            chunk_text VARCHAR,
+            chunk_vector {_VECTOR_TYPE},
+            PRIMARY KEY (document_id, chunk_index)
+        )
+        """,
+        # 原 max_chunk_cnt 之后的分片没有向量，chunk_vector 为 NULL
+        f"""
+        INSERT INTO document_chunk (document_id, chunk_index, chunk_text, chunk_vector)
+        SELECT document_id, idx - 1, file_content_chunks[idx], CAST(file_content_chunks_vector[idx] AS {_VECTOR_TYPE})
+        FROM (
+            SELECT document_id, file_content_chunks, file_content_chunks_vector,
+                   UNNEST(generate_series(1, len(file_content_chunks))) AS idx
+            FROM document
+            WHERE file_content_chunks IS NOT NULL
+        )
+        """,
+        f"ALTER TABLE document ALTER file_name_vector TYPE {_VECTOR_TYPE} "
+        f"USING CAST(file_name_vector[1] AS {_VECTOR_TYPE})",
+        "ALTER TABLE document DROP COLUMN file_content_chunks",
+        "ALTER TABLE document DROP COLUMN file_content_chunks_vector",
+    ]),
+    (3, '知识库目录树闭包表，子树过滤改为单个谓词', [
+        # ID 以 VARCHAR 保存，与 document.knowledge_base_id、knowledge_base.up_id 的类型一致
+        """
+        CREATE TABLE knowledge_base_closure (
+            ancestor_id VARCHAR NOT NULL,
+            descendant_id VARCHAR NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        )
+        """,
+        "CREATE INDEX idx_kb_closure_ancestor ON knowledge_base_closure (ancestor_id)",
+        "CREATE INDEX idx_kb_closure_descendant ON knowledge_base_closure (descendant_id)",
+        """
+        INSERT INTO knowledge_base_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+            SELECT CAST(knowledge_base_id AS VARCHAR), CAST(knowledge_base_id AS VARCHAR), 0
+            FROM knowledge_base
+            UNION ALL
+            SELECT t.ancestor_id, CAST(k.knowledge_base_id AS VARCHAR), t.depth + 1
+            FROM tree t
+            JOIN knowledge_base k ON k.up_id = t.descendant_id
+        )
+        SELECT ancestor_id, descendant_id, depth FROM tree
+        """,
+    ]),
+    (4, '分片词项倒排索引（中文二元组 + 英文数字词，BM25 检索）', [
+        # term_cnt 为分片的词项总数（BM25 的文档长度）
+        "ALTER TABLE document_chunk ADD COLUMN term_cnt INTEGER",
+        """
+        CREATE TABLE chunk_term (
+            term_id BIGINT NOT NULL,
+            document_id BIGINT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            tf INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_chunk_term_term ON chunk_term (term_id)",
+        "CREATE INDEX idx_chunk_term_document ON chunk_term (document_id)",
+        _build_chunk_terms,
+    ]),
+    (5, '按内容缓存分片向量（模型ID + 分片文本哈希），文档修改后未变化的分片不再重新编码', [
+        "ALTER TABLE document_chunk ADD COLUMN chunk_hash BIGINT",
+        "CREATE INDEX idx_document_chunk_hash ON document_chunk (chunk_hash)",
+        f"""
+        CREATE TABLE embedding_cache (
+            model_id VARCHAR NOT NULL,
+            text_hash BIGINT NOT NULL,
+            vector {_VECTOR_TYPE} NOT NULL,
+            create_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            PRIMARY KEY (model_id, text_hash)
+        )
+        """,
+        _fill_chunk_hashes,
+    ]),
+    (6, '向量模型登记表：记录生成向量的模型、维度和池化方式，切换模型时在暂存表中重新生成向量后一次性切换', [
+        """
+        CREATE TABLE embedding_model (
+            model_name VARCHAR PRIMARY KEY,
+            dim INTEGER NOT NULL,
+            pooling VARCHAR NOT NULL,
+            state VARCHAR NOT NULL,
+            create_time TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            activate_time TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        # 已入库的向量均由内置的 bge-small-zh-v1.5 生成
+        f"""
+        INSERT INTO embedding_model (model_name, dim, pooling, state, activate_time)
+        VALUES ('BAAI/bge-small-zh-v1.5', {duckdb_config['vector_dim']}, 'mean', 'active', now())
+        """,
+        "ALTER TABLE document ADD COLUMN embedding_model VARCHAR",
+        """
+        UPDATE document SET embedding_model = 'BAAI/bge-small-zh-v1.5'
+        WHERE file_name_vector IS NOT NULL
+           OR document_id IN (SELECT document_id FROM document_chunk WHERE chunk_vector IS NOT NULL)
+        """,
+        # 新模型的向量先写入暂存表（维度可以与当前模型不同），分片内容变化后（chunk_hash 不同）需要重新生成
+        """
+        CREATE TABLE reembed_chunk (
+            model_name VARCHAR NOT NULL,
+            document_id BIGINT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            chunk_hash BIGINT,
+            chunk_vector FLOAT[] NOT NULL,
+            PRIMARY KEY (model_name, document_id, chunk_index)
+        )
+        """,
+        """
+        CREATE TABLE reembed_document (
+            model_name VARCHAR NOT NULL,
+            document_id BIGINT NOT NULL,
+            file_name VARCHAR,
+            file_name_vector FLOAT[] NOT NULL,
+            PRIMARY KEY (model_name, document_id)
+        )
+        """,
+    ]),
+    (7, '分片只保存在 document.file_content 中的位置（chunk_start、chunk_end），不再重复保存分片文本', [
+        "ALTER TABLE document_chunk ADD COLUMN chunk_start INTEGER",
+        "ALTER TABLE document_chunk ADD COLUMN chunk_end INTEGER",
+        # 已入库的分片能在原文中找到的改为保存位置；添加重叠时由前一分片末尾加空格拼接的分片找不到，保留文本
+        """
+        UPDATE document_chunk
+        SET chunk_start = s.pos - 1, chunk_end = s.pos - 1 + length(s.chunk_text), chunk_text = NULL
+        FROM (
+            SELECT c.document_id, c.chunk_index, c.chunk_text, instr(d.file_content, c.chunk_text) AS pos
+            FROM document_chunk c
+            JOIN document d ON d.document_id = c.document_id
+            WHERE c.chunk_text IS NOT NULL AND c.chunk_text <> ''
+        ) s
+        WHERE document_chunk.document_id = s.document_id AND document_chunk.chunk_index = s.chunk_index
+          AND s.pos > 0
+        """,
+    ]),
+    (8, '分片所在的页、幻灯片、工作表或章节（JSON，如 {"type": "page", "page": 3}），检索结果中标注出处', [
+        "ALTER TABLE document_chunk ADD COLUMN chunk_position VARCHAR",
+    ]),
+]
+
+
+def create_functions(conn):
+    for sql in FUNCTIONS:
+        conn.execute(sql)
+
+
+def load_vector_dim(conn):
+    """
+    向量维度以当前使用的模型为准（切换到不同维度的模型后 chunk_vector 等列的类型随之改变）
+    """
+    row = conn.execute("SELECT dim FROM embedding_model WHERE state = 'active'").fetchone()
+    if row:
+        duckdb_config['vector_dim'] = int(row[0])
+
+
+def migrate(conn):
+    """
+    执行尚未执行的数据库升级
+
+    Args:
+        conn: DuckDB 写连接
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR,
+            create_time TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """)
+    current_version = conn.execute("SELECT coalesce(max(version), 0) FROM schema_version").fetchone()[0]
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+        logging.info(f"数据库升级到版本 {version}: {description}")
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            logging.error(f"数据库升级到版本 {version} 失败", exc_info=True)
+            raise
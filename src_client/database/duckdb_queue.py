@@ -4,10 +4,8 @@ import threading
 from enum import Enum
 from typing import Any, Optional, List
 
-# 假设已有 duckdb_config
-import numpy as np
-
 from database.duckdb_config import duckdb_config
+from database import duckdb_migrate
 import duckdb
 
 
@@ -18,8 +16,13 @@ class TaskStatus(Enum):
     CANCELLED = "cancelled"
 
 
+# 事务控制任务
+TXN_BEGIN = 'begin'
+TXN_END = 'end'
+
+
 class SqlTask:
-    def __init__(self, task_id: int, sql: str, params=None, is_many=False):
+    def __init__(self, task_id: int, sql: str, params=None, is_many=False, fetch=False, txn=None):
         self.task_id = task_id
         self.sql = sql
         self.params = params
@@ -28,6 +31,11 @@ class SqlTask:
         self.event = threading.Event()
         self.created_at = time.time()
         self.is_many = is_many
+        # 是否返回查询结果（事务中的读查询也在写连接上执行）
+        self.fetch = fetch
+        self.txn = txn
+        # 提交任务的线程，事务进行中只执行开启事务的线程提交的任务
+        self.owner = threading.get_ident()
 
 
 class DuckDBQueue:
@@ -37,8 +45,12 @@ class DuckDBQueue:
         self.worker_thread = None
         self.task_id_counter = 0
         self.lock = threading.Lock()
+        # 提交任务、事务结束时唤醒写入线程（不再轮询等待）
+        self.task_added = threading.Condition(self.lock)
         self.default_timeout = default_timeout
         self.conn = None  # 单连接
+        # 开启了事务的线程（begin_transaction），提交或回滚前其他线程的写入排队等待
+        self.txn_owner = None
 
     def _get_next_id(self):
         with self.lock:
@@ -50,9 +62,9 @@ class DuckDBQueue:
             return
         self.is_running = True
         self.conn = duckdb.connect(database=duckdb_config['database'])
-        self.conn.create_function('cosine_similarity', cosine_similarity,
-                                  ['DOUBLE[]', 'DOUBLE[]'],
-                                  'DOUBLE')
+        duckdb_migrate.migrate(self.conn)
+        duckdb_migrate.load_vector_dim(self.conn)
+        duckdb_migrate.create_functions(self.conn)
         self.worker_thread = threading.Thread(target=self._process_loop, daemon=True)
         self.worker_thread.start()
         logging.info("DuckDB 队列启动")
@@ -72,14 +84,31 @@ class DuckDBQueue:
             self.conn.close()
         logging.info("DuckDB 队列已停止")
 
-    def submit_task(self, sql: str, params=None, timeout=None, is_many=False):
+    def in_transaction(self) -> bool:
+        """当前线程是否持有事务"""
+        return self.txn_owner is not None and self.txn_owner == threading.get_ident()
+
+    def begin_transaction(self, timeout=None):
+        """
+        开启由当前线程独占的事务：提交或回滚之前，写连接只执行当前线程提交的语句
+        """
+        self.submit_task("BEGIN TRANSACTION", timeout=timeout, txn=TXN_BEGIN)
+
+    def end_transaction(self, commit=True, timeout=None):
+        """
+        提交或回滚当前线程的事务（提交失败时 DuckDB 已回滚事务），之后其他线程的任务继续执行
+        """
+        self.submit_task("COMMIT" if commit else "ROLLBACK", timeout=timeout, txn=TXN_END)
+
+    def submit_task(self, sql: str, params=None, timeout=None, is_many=False, fetch=False, txn=None):
         task_id = self._get_next_id()
-        task = SqlTask(task_id, sql, params, is_many)
+        task = SqlTask(task_id, sql, params, is_many, fetch, txn)
 
         with self.lock:
             if not self.is_running:
                 raise Exception("队列未运行")
             self.tasks.append(task)
+            self.task_added.notify()
 
         wait_timeout = timeout if timeout is not None else self.default_timeout
         finished = task.event.wait(timeout=wait_timeout)
@@ -104,7 +133,6 @@ class DuckDBQueue:
         while self.is_running:
             task = self._pop_next_task()
             if task is None:
-                time.sleep(0.01)  # 避免忙等
                 continue
 
             # 开始执行前再次检查是否已取消
@@ -118,8 +146,11 @@ class DuckDBQueue:
     def _pop_next_task(self) -> Optional[SqlTask]:
         with self.lock:
             for i, task in enumerate(self.tasks):
-                if task.status == TaskStatus.PENDING:
+                # 事务进行中其他线程的任务等待事务结束
+                if task.status == TaskStatus.PENDING and (self.txn_owner is None or task.owner == self.txn_owner):
                     return self.tasks.pop(i)  # 移除并返回
+            # 没有可执行的任务时等待提交（超时后再检查一次，停止时及时退出）
+            self.task_added.wait(timeout=0.1)
             return None
 
     def _execute_task(self, task: SqlTask):
@@ -129,7 +160,11 @@ class DuckDBQueue:
             else:
                 cursor = self.conn.execute(task.sql, task.params)
             upper_sql = task.sql.strip().upper()
-            if (upper_sql.startswith("SELECT") or
+            if task.txn == TXN_BEGIN:
+                self.txn_owner = task.owner
+            elif task.txn == TXN_END:
+                self.txn_owner = None
+            if (task.fetch or upper_sql.startswith("SELECT") or
                     upper_sql.startswith("PRAGMA") or
                     "RETURNING" in upper_sql):
                 rows = cursor.fetchall()
@@ -147,36 +182,12 @@ class DuckDBQueue:
 
         except Exception as e:
             logging.error(f"任务 {task.task_id} 执行失败: {str(e)}")
+            # 回滚失败（事务已经结束）时同样释放事务
+            if task.txn == TXN_END:
+                self.txn_owner = None
             task.result = {
                 'success': False,
                 'error': str(e),
                 'data': None
             }
             task.status = TaskStatus.DONE
-
-# 定义余弦相似度函数
-def cosine_similarity(a: list[float], b: list[float]) -> float:
-    """
-    计算 a, b 两个向量的角度相似度（Angular Similarity）。
-    返回值范围 [0.0, 1.0]，0 表示正交／无关，1 表示完全相同方向。
-    """
-    eps = 1e-8
-    # 转成双精度 numpy 数组
-    a_np = np.asarray(a, dtype=np.float64)
-    b_np = np.asarray(b, dtype=np.float64)
-
-    # 计算范数，防止为 0
-    norm_a = np.linalg.norm(a_np)
-    norm_b = np.linalg.norm(b_np)
-    if norm_a < eps or norm_b < eps:
-        return 0.0
-
-    # 计算原始余弦值，并 clamp 到 [-1, 1]
-    cos_val = np.dot(a_np, b_np) / (norm_a * norm_b)
-    cos_val = max(min(cos_val, 1.0), -1.0)
-
-    # 转成角度相似度：angle = arccos(cos) ∈ [0, π], 再归一化
-    angle = np.arccos(cos_val)
-    sim = 1.0 - angle / np.pi
-
-    return float(sim)
\ No newline at end of file
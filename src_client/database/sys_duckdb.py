@@ -1,9 +1,12 @@
 import logging
 import time
+from contextlib import contextmanager
+from typing import List
 
 from database.duckdb_config import duckdb_config
 from database.duckdb_queue import DuckDBQueue
 import duckdb
+import numpy as np
 
 # 全局实例
 duckdb_queue = DuckDBQueue(default_timeout=30)
@@ -19,7 +22,72 @@ def is_read_query(sql: str) -> bool:
     write_keywords = {"INSERT", "UPDATE", "DELETE", "CREATE", "DROP", "ALTER", "REPLACE", "MERGE"}
     return not any(kw in upper_sql for kw in write_keywords)
 
+def array_param(values) -> str:
+    """
+    数组参数转为列表字面量字符串，SQL 中仍写作 CAST(? AS T[])。
+    Python 列表参数逐个元素转换，512 维向量绑定一次约 150ms，字符串参数由 DuckDB 解析只需数毫秒；
+    浮点数使用 repr，转换前后数值不变。
+    """
+    return '[' + ','.join(map(repr, values)) + ']'
+
+
+def matrix_param(vectors) -> str:
+    """
+    多个向量转为嵌套列表字面量字符串，SQL 中写作 CAST(? AS FLOAT[维度][]) 或 CAST(? AS FLOAT[][])
+    """
+    return '[' + ','.join(array_param(np.asarray(v, dtype=np.float32).tolist()) for v in vectors) + ']'
+
+
+def vector_type() -> str:
+    """
+    向量列的类型 FLOAT[维度]，维度随当前使用的向量模型变化（见 duckdb_migrate.load_vector_dim）
+    """
+    return f"FLOAT[{duckdb_config['vector_dim']}]"
+
+
+@contextmanager
+def transaction(timeout=None):
+    """
+    当前线程独占的写事务：with 块中当前线程的语句（包括读查询，能读到本事务未提交的修改）都在写连接上执行，
+    结束时一次提交，块中抛出异常时回滚；事务进行中其他线程的写入排队等待，读查询不受影响（读到提交前的数据）；
+    当前线程已在事务中时直接在该事务中执行，由外层事务提交或回滚
+    """
+    if duckdb_queue.in_transaction():
+        yield
+        return
+    duckdb_queue.begin_transaction(timeout)
+    try:
+        yield
+    except BaseException:
+        try:
+            duckdb_queue.end_transaction(commit=False, timeout=timeout)
+        except Exception as e:
+            logging.error(f"事务回滚失败: {e}")
+        raise
+    duckdb_queue.end_transaction(commit=True, timeout=timeout)
+
+
+def exesql_transaction(statements: List[str], timeout=None):
+    """
+    在写连接上以一个事务执行多条不带参数的语句，任一语句失败时整体回滚；
+    当前线程已在 transaction() 中时直接在该事务中执行，由外层事务提交或回滚
+    """
+    if duckdb_queue.in_transaction():
+        exesql(";\n".join(statements), timeout=timeout)
+        return
+    sql = ";\n".join(["BEGIN TRANSACTION"] + list(statements) + ["COMMIT"])
+    try:
+        exesql(sql, timeout=timeout)
+    except Exception:
+        try:
+            exesql("ROLLBACK")
+        except Exception:
+            pass
+        raise
+
+
 def direct_exesql(sql, params):
+    # 相似度函数以宏的形式保存在数据库中（见 duckdb_migrate.FUNCTIONS），只读连接无需再注册
     conn = duckdb.connect(database=duckdb_config['database'])
     try:
         cursor = conn.execute(sql, params)
@@ -39,7 +107,10 @@ def exesql(sql: str, params=None, timeout=None,is_many_insert=False ):
     logging.debug('duckdb sql %f: %s' % (_time_begin, sql))
     logging.debug('duckdb sql %f: params:%s' % (_time_begin, str(params)))
     try:
-        if is_read_query(sql):
+        if is_read_query(sql) and duckdb_queue.in_transaction():
+            # 事务中的读查询在写连接上执行，能读到本事务未提交的修改
+            rts = duckdb_queue.submit_task(sql, params, timeout, fetch=True)
+        elif is_read_query(sql):
             rts = direct_exesql(sql, params)
         else:
             rts = duckdb_queue.submit_task(sql, params, timeout, is_many_insert)
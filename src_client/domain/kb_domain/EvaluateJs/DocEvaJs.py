@@ -14,6 +14,12 @@ def update_doc_state(doc_id, state):
     return
 
 
+def update_doc_index_progress(doc_id, vector_cnt, chunk_cnt):
+    # 大文档后台补齐分片向量的进度，全部完成后恢复为“完成”
+    state = '完成' if vector_cnt >= chunk_cnt else f'索引中 {vector_cnt}/{chunk_cnt}'
+    update_doc_state(doc_id, state)
+
+
 def add_doc(item):
     param = "'" + json.dumps(item) + "'"
     js_code = f"document.getElementById('本地文档AI助手').contentWindow.loadAddDocDom({param})"
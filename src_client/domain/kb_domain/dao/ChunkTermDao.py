@@ -0,0 +1,63 @@
+from typing import List, Dict, Any, Optional
+
+from database.sys_duckdb import array_param, exesql
+from util import TextTokenUtil
+
+
+# -----------------------------
+# 替换文档全部分片的词项（分片入库时调用）
+# -----------------------------
+def replace(document_id, chunks: Optional[List[str]]):
+    """
+    删除文档原有词项后写入新的词项，并更新分片的词项总数
+
+    Args:
+        document_id: 文档ID
+        chunks: 分片文本列表
+    """
+    delete_by_document(document_id)
+    if not chunks:
+        return
+    insert(document_id, chunks, list(range(len(chunks))))
+
+
+# -----------------------------
+# 写入部分分片的词项（分片按内容复用时只写入新增、修改的分片）
+# -----------------------------
+def insert(document_id, chunks: List[str], chunk_indices: List[int]):
+    """
+    写入分片的词项，并更新这些分片的词项总数
+
+    Args:
+        document_id: 文档ID
+        chunks: 分片文本列表
+        chunk_indices: 与 chunks 一一对应的分片下标
+    """
+    rows, term_cnts = TextTokenUtil.build_term_rows(document_id, chunks, chunk_indices)
+    sql = """
+        INSERT INTO chunk_term (term_id, document_id, chunk_index, tf)
+        SELECT UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS INTEGER[])), UNNEST(CAST(? AS INTEGER[]))
+    """
+    exesql(sql, tuple(array_param(rows[key]) for key in ('term_id', 'document_id', 'chunk_index', 'tf')))
+    sql = """
+        UPDATE document_chunk SET term_cnt = s.term_cnt
+        FROM (SELECT UNNEST(CAST(? AS INTEGER[])) AS chunk_index, UNNEST(CAST(? AS INTEGER[])) AS term_cnt) s
+        WHERE document_chunk.document_id = ? AND document_chunk.chunk_index = s.chunk_index
+    """
+    exesql(sql, (array_param(chunk_indices), array_param(term_cnts), document_id))
+
+
+# -----------------------------
+# 删除文档的全部词项
+# -----------------------------
+def delete_by_document(document_id):
+    sql = "DELETE FROM chunk_term WHERE document_id = ?"
+    exesql(sql, (document_id,))
+
+
+# -----------------------------
+# 查询语句的词项及其在查询中的次数（作为 DocumentDao.search_docs 的 BM25 参数）
+# -----------------------------
+def query_terms(query: str) -> Dict[str, Any]:
+    counts = TextTokenUtil.term_counts(query)
+    return {'term_id': list(counts.keys()), 'qtf': list(counts.values())}
@@ -0,0 +1,274 @@
+from typing import List, Dict, Any, Optional
+
+from database.sys_duckdb import array_param, exesql, matrix_param, transaction, vector_type
+from domain.kb_domain.dao import ChunkTermDao
+from util import TextTokenUtil
+
+
+# -----------------------------
+# 替换文档的全部分片
+# -----------------------------
+def replace(document_id, chunks: Optional[List[str]], vectors=None, spans=None, positions=None) -> Dict[str, int]:
+    """
+    写入文档的新分片。给出 spans 时按内容（chunk_hash）与原有分片对应：内容相同的分片保留原来的行（向量、词项），
+    只更新下标和位置，其余原有分片删除，只写入新增、修改的分片；不给出 spans 时删除原有分片后全部重新写入
+
+    Args:
+        document_id: 文档ID
+        chunks: 分片文本列表
+        vectors: 分片向量（已单位化），数量可以少于分片数，缺少的分片向量为 NULL
+        spans: 分片在 document.file_content 中的位置 [(start, end)]，给出时只保存位置，不保存分片文本
+        positions: 分片所在的页、幻灯片、工作表或章节（JSON 字符串，见 DocLoadServ.chunk_positions），可以为 None
+
+    Returns:
+        {'chunk_cnt': 分片数, 'reused_cnt': 保留原有行的分片数, 'vector_cnt': 写入后已向量化的分片数}
+    """
+    if not chunks:
+        delete_by_document(document_id)
+        return {'chunk_cnt': 0, 'reused_cnt': 0, 'vector_cnt': 0}
+    vector_cnt = 0 if vectors is None else min(len(vectors), len(chunks))
+    if positions is None:
+        positions = [None] * len(chunks)
+    if spans is not None:
+        return _replace_changed(document_id, chunks, vectors, vector_cnt, spans, positions)
+
+    delete_by_document(document_id)
+    params = []
+    for i, chunk in enumerate(chunks):
+        vector = [float(x) for x in vectors[i]] if i < vector_cnt else None
+        params.append((document_id, i, chunk, vector, TextTokenUtil.text_hash(chunk), positions[i]))
+    sql = """
+        INSERT INTO document_chunk (document_id, chunk_index, chunk_text, chunk_vector, chunk_hash, chunk_position)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    exesql(sql, params, is_many_insert=True)
+    # 同步更新词项倒排索引
+    ChunkTermDao.replace(document_id, chunks)
+    return {'chunk_cnt': len(chunks), 'reused_cnt': 0, 'vector_cnt': vector_cnt}
+
+
+def _replace_changed(document_id, chunks: List[str], vectors, vector_cnt: int, spans, positions) -> Dict[str, int]:
+    chunk_hashes = [TextTokenUtil.text_hash(chunk) for chunk in chunks]
+    # 内容相同的原有分片按出现顺序一一对应
+    old_indices: Dict[int, List[int]] = {}
+    vectorized = set()
+    for row in get_chunk_hashes(document_id):
+        old_indices.setdefault(row['chunk_hash'], []).append(row['chunk_index'])
+        if row['has_vector']:
+            vectorized.add(row['chunk_index'])
+    for indices in old_indices.values():
+        indices.reverse()
+    moved_old, moved_new, fresh = [], [], []
+    for i, chunk_hash in enumerate(chunk_hashes):
+        indices = old_indices.get(chunk_hash)
+        if indices:
+            moved_old.append(indices.pop())
+            moved_new.append(i)
+        else:
+            fresh.append(i)
+
+    _move_chunks(document_id, moved_old, moved_new, [spans[i] for i in moved_new], [positions[i] for i in moved_new])
+    if fresh:
+        sql = """
+            INSERT INTO document_chunk (document_id, chunk_index, chunk_start, chunk_end, chunk_hash, chunk_position)
+            SELECT ?, UNNEST(CAST(? AS INTEGER[])), UNNEST(CAST(? AS INTEGER[])), UNNEST(CAST(? AS INTEGER[])),
+                   UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS VARCHAR[]))
+        """
+        exesql(sql, (document_id, array_param(fresh), array_param([spans[i][0] for i in fresh]),
+                     array_param([spans[i][1] for i in fresh]), array_param([chunk_hashes[i] for i in fresh]),
+                     [positions[i] for i in fresh]))
+        ChunkTermDao.insert(document_id, [chunks[i] for i in fresh], fresh)
+
+    # 写入本次编码的向量：新增、修改的分片，以及原来还没有向量的分片
+    kept = {new for old, new in zip(moved_old, moved_new) if old in vectorized}
+    write = [i for i in range(vector_cnt) if i not in kept]
+    update_vectors(document_id, write, [vectors[i] for i in write])
+    return {'chunk_cnt': len(chunks), 'reused_cnt': len(moved_new), 'vector_cnt': len(kept.union(range(vector_cnt)))}
+
+
+def _move_chunks(document_id, old_indices: List[int], new_indices: List[int], spans, positions):
+    """
+    在一个事务中把保留的分片（及其词项）移到新下标、更新位置和所在内容块，并删除其余原有分片。
+    保留的分片先移到负下标，删除其余分片后再移回，移动过程中不会与其他分片的主键冲突
+    """
+    old_list = array_param(old_indices)
+    moved = """(
+        SELECT UNNEST(CAST(? AS INTEGER[])) AS old_index, UNNEST(CAST(? AS INTEGER[])) AS new_index,
+               UNNEST(CAST(? AS INTEGER[])) AS chunk_start, UNNEST(CAST(? AS INTEGER[])) AS chunk_end,
+               UNNEST(CAST(? AS VARCHAR[])) AS chunk_position
+    ) m"""
+    moved_params = (old_list, array_param(new_indices), array_param([span[0] for span in spans]),
+                    array_param([span[1] for span in spans]), list(positions))
+    with transaction():
+        exesql("DELETE FROM chunk_term WHERE document_id = ? AND NOT list_contains(CAST(? AS INTEGER[]), chunk_index)",
+               (document_id, old_list))
+        exesql(f"""
+            UPDATE chunk_term SET chunk_index = m.new_index FROM {moved}
+            WHERE chunk_term.document_id = ? AND chunk_term.chunk_index = m.old_index
+        """, moved_params + (document_id,))
+        exesql(f"""
+            UPDATE document_chunk
+            SET chunk_index = -1 - m.new_index, chunk_text = NULL, chunk_start = m.chunk_start, chunk_end = m.chunk_end,
+                chunk_position = m.chunk_position
+            FROM {moved}
+            WHERE document_chunk.document_id = ? AND document_chunk.chunk_index = m.old_index
+        """, moved_params + (document_id,))
+        exesql("DELETE FROM document_chunk WHERE document_id = ? AND chunk_index >= 0", (document_id,))
+        exesql("UPDATE document_chunk SET chunk_index = -1 - chunk_index WHERE document_id = ? AND chunk_index < 0",
+               (document_id,))
+
+
+# -----------------------------
+# 查询文档原有分片的内容哈希（按内容复用分片）
+# -----------------------------
+def get_chunk_hashes(document_id) -> List[Dict[str, Any]]:
+    sql = """
+        SELECT chunk_index, chunk_hash, chunk_vector IS NOT NULL AS has_vector
+        FROM document_chunk WHERE document_id = ?
+    """
+    rows = exesql(sql, (document_id,))
+    return rows
+
+
+# -----------------------------
+# 删除文档的全部分片
+# -----------------------------
+def delete_by_document(document_id):
+    ChunkTermDao.delete_by_document(document_id)
+    sql = "DELETE FROM document_chunk WHERE document_id = ?"
+    exesql(sql, (document_id,))
+
+
+# -----------------------------
+# 查询已完成向量化的文档ID（用于同步 ANN 索引）
+# -----------------------------
+def get_vectorized_doc_ids() -> List[int]:
+    sql = "SELECT DISTINCT document_id FROM document_chunk WHERE chunk_vector IS NOT NULL"
+    rows = exesql(sql)
+    return [row['document_id'] for row in rows]
+
+
+# -----------------------------
+# 查询已完成向量化的文档及其所属的顶级知识库（用于同步向量矩阵）
+# -----------------------------
+def get_vectorized_docs() -> List[Dict[str, Any]]:
+    sql = """
+        SELECT d.document_id, d.knowledge_base_id, r.root_id
+        FROM document d
+        JOIN (
+            SELECT descendant_id, arg_max(ancestor_id, depth) AS root_id
+            FROM knowledge_base_closure
+            GROUP BY descendant_id
+        ) r ON r.descendant_id = d.knowledge_base_id
+        WHERE d.document_id IN (SELECT document_id FROM document_chunk WHERE chunk_vector IS NOT NULL)
+    """
+    rows = exesql(sql)
+    return rows
+
+
+# -----------------------------
+# 查询文档的分片向量（用于同步 ANN 索引）
+# -----------------------------
+def get_vectors(document_id) -> List[Dict[str, Any]]:
+    sql = """
+        SELECT c.chunk_index, c.chunk_vector, d.knowledge_base_id
+        FROM document_chunk c
+        JOIN document d ON d.document_id = c.document_id
+        WHERE c.document_id = ?
+          AND c.chunk_vector IS NOT NULL
+        ORDER BY c.chunk_index
+    """
+    rows = exesql(sql, (document_id,))
+    return rows
+
+
+# -----------------------------
+# 批量查询多个文档的分片向量（同步索引时按批读取，避免逐个文档查询）
+# -----------------------------
+def get_vectors_by_docs(document_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Returns:
+        文档ID -> 分片列表（chunk_index, chunk_vector, knowledge_base_id），按 chunk_index 排序
+    """
+    if not document_ids:
+        return {}
+    sql = """
+        SELECT c.document_id, c.chunk_index, c.chunk_vector, d.knowledge_base_id
+        FROM document_chunk c
+        JOIN document d ON d.document_id = c.document_id
+        WHERE c.document_id IN (SELECT UNNEST(CAST(? AS BIGINT[])))
+          AND c.chunk_vector IS NOT NULL
+        ORDER BY c.document_id, c.chunk_index
+    """
+    rows = exesql(sql, (array_param([int(x) for x in document_ids]),))
+    docs: Dict[int, List[Dict[str, Any]]] = {}
+    for row in rows:
+        docs.setdefault(int(row['document_id']), []).append(row)
+    return docs
+
+
+# -----------------------------
+# 查询还有分片未向量化的文档（大文档入库时只向量化前面的分片，其余由后台补齐）
+# -----------------------------
+def get_backfill_doc_ids() -> List[int]:
+    sql = """
+        SELECT document_id FROM document_chunk
+        WHERE chunk_vector IS NULL
+        GROUP BY document_id
+        ORDER BY document_id
+    """
+    rows = exesql(sql)
+    return [row['document_id'] for row in rows]
+
+
+# -----------------------------
+# 查询文档未向量化的分片（按 chunk_index 顺序）
+# -----------------------------
+def get_unvectorized_chunks(document_id, limit: int) -> List[Dict[str, Any]]:
+    sql = """
+        SELECT c.chunk_index, chunk_text_of(c.chunk_text, d.file_content, c.chunk_start, c.chunk_end) AS chunk_text
+        FROM document_chunk c
+        JOIN document d ON d.document_id = c.document_id
+        WHERE c.document_id = ? AND c.chunk_vector IS NULL
+        ORDER BY c.chunk_index
+        LIMIT ?
+    """
+    rows = exesql(sql, (document_id, limit))
+    return rows
+
+
+# -----------------------------
+# 写入部分分片的向量（后台补齐）
+# -----------------------------
+def update_vectors(document_id, chunk_indices: List[int], vectors):
+    """
+    Args:
+        document_id: 文档ID
+        chunk_indices: 分片下标
+        vectors: 与 chunk_indices 一一对应的向量（已单位化）
+    """
+    if not chunk_indices:
+        return
+    sql = f"""
+        UPDATE document_chunk SET chunk_vector = s.chunk_vector
+        FROM (SELECT UNNEST(CAST(? AS INTEGER[])) AS chunk_index,
+                     UNNEST(CAST(? AS {vector_type()}[])) AS chunk_vector) s
+        WHERE document_chunk.document_id = ? AND document_chunk.chunk_index = s.chunk_index
+    """
+    exesql(sql, (array_param(chunk_indices), matrix_param(vectors), document_id))
+
+
+# -----------------------------
+# 查询文档的向量化进度
+# -----------------------------
+def get_vector_progress(document_id) -> Dict[str, int]:
+    """
+    Returns:
+        {'chunk_cnt': 分片数, 'vector_cnt': 已向量化的分片数}
+    """
+    sql = """
+        SELECT count(*) AS chunk_cnt, count(chunk_vector) AS vector_cnt
+        FROM document_chunk WHERE document_id = ?
+    """
+    rows = exesql(sql, (document_id,))
+    return {'chunk_cnt': int(rows[0]['chunk_cnt']), 'vector_cnt': int(rows[0]['vector_cnt'])}
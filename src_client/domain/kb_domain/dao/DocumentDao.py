@@ -1,8 +1,20 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 import numpy as np
 
-from database.sys_duckdb import exesql
+from database.sys_duckdb import array_param, exesql, vector_type
+from domain.kb_domain.dao import KnowledgeBaseDao
+
+
+def _unit_vector(vector) -> str:
+    """
+    向量单位化，入库的向量均已单位化，查询向量单位化后只需计算内积（返回数组参数字符串）
+    """
+    v = np.asarray(vector, dtype=np.float64)
+    norm = np.linalg.norm(v)
+    if norm > 1e-12:
+        v = v / norm
+    return array_param(v.tolist())
 
 
 # -----------------------------
@@ -54,6 +66,8 @@ def insert_many(data_list: List[Dict[str, Any]]):
 # 删除文档
 # -----------------------------
 def delete(document_id):
+    exesql("DELETE FROM chunk_term WHERE document_id = ?", (document_id,))
+    exesql("DELETE FROM document_chunk WHERE document_id = ?", (document_id,))
     sql = "DELETE FROM document WHERE document_id = ?"
     exesql(sql, (document_id,))
 
@@ -70,7 +84,8 @@ def update(document_id, data: Dict[str, Any]):
 
     set_clause = ", ".join([f"{k} = ?" for k in data.keys()])
     sql = f"UPDATE document SET {set_clause} WHERE document_id = ?"
-    params = tuple(data.values()) + (document_id,)
+    # 列表（文件名向量）按字面量字符串绑定，赋值时由 DuckDB 转换为列的类型（见 array_param）
+    params = tuple(array_param(v) if isinstance(v, list) else v for v in data.values()) + (document_id,)
     exesql(sql, params)
 
 
@@ -108,13 +123,41 @@ def get_all(filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
 # -----------------------------
 def get_wait_load_num(kb_id=None) -> Dict[str, str]:
     where = ' where '
+    params = ()
     if kb_id:
-        where += f" knowlegde_base_id = '{kb_id}' "
+        # 包含所有下级知识库
+        where += f" {KnowledgeBaseDao.subtree_clause('knowledge_base_id')} and "
+        params = (str(kb_id),)
     sql = f"SELECT count(*) as num FROM document {where} (kb_load_state like '%待加载%' or kb_load_state = '已删除') "
-    rows = exesql(sql)
+    rows = exesql(sql, params)
     return rows[0]
 
 
+# -----------------------------
+# 查询知识库及其所有下级知识库中的文档
+# -----------------------------
+def get_all_in_kb_tree(kb_id) -> List[Dict[str, Any]]:
+    sql = f"SELECT document_id FROM document WHERE {KnowledgeBaseDao.subtree_clause('knowledge_base_id')}"
+    rows = exesql(sql, (str(kb_id),))
+    return [dict(row) for row in rows]
+
+
+# -----------------------------
+# 删除知识库及其所有下级知识库中的文档和分片
+# -----------------------------
+def delete_by_kb_tree(kb_id):
+    params = (str(kb_id),)
+    for table in ('chunk_term', 'document_chunk'):
+        sql = f"""
+            DELETE FROM {table} WHERE document_id IN (
+                SELECT document_id FROM document WHERE {KnowledgeBaseDao.subtree_clause('knowledge_base_id')}
+            )
+        """
+        exesql(sql, params)
+    sql = f"DELETE FROM document WHERE {KnowledgeBaseDao.subtree_clause('knowledge_base_id')}"
+    exesql(sql, params)
+
+
 # -----------------------------
 # 查询文件基础信息（可加条件）
 # -----------------------------
@@ -148,49 +191,43 @@ def get_fileinfo_list(filters: Optional[Dict[str, Any]] = None) -> List[Dict[str
 # 根据查询分片的下标取出对应的文本内容
 # -----------------------------
 def get_doc_by_chunk_index(document_id, chunk_index_list) -> Dict[str, Any]:
-    sql = f"""
+    """
+    取出文档信息，file_content 为指定分片按 chunk_index_list 顺序拼接的文本
+    """
+    sql = """
         SELECT 
-            document_id,
-            document_uuid,
-            knowledge_base_id,
-            file_name,
-            knowledge_name,
-            file_type,
-            metadata,
-            location_path,
-            file_summary,
-            array_to_string(
-                list_transform(
-                    {chunk_index_list},
-                    idx -> file_content_chunks[idx + 1]
-                ),
-                ''
+            d.document_id,
+            d.document_uuid,
+            d.knowledge_base_id,
+            d.file_name,
+            d.knowledge_name,
+            d.file_type,
+            d.metadata,
+            d.location_path,
+            d.file_summary,
+            (
+                SELECT string_agg(chunk_text_of(c.chunk_text, d.file_content, c.chunk_start, c.chunk_end), ''
+                                  ORDER BY list_position(?, c.chunk_index))
+                FROM document_chunk c
+                WHERE c.document_id = d.document_id
+                  AND list_contains(?, c.chunk_index)
             ) AS file_content,
-            file_name_vector,
-            file_size,
-            file_timestamp,
-            kb_load_state,
-            markdown,
-            extend_attrs,
-            order_no,
-            create_time
-        FROM document
-        WHERE document_id = {document_id}
+            d.file_name_vector,
+            d.file_size,
+            d.file_timestamp,
+            d.kb_load_state,
+            d.markdown,
+            d.extend_attrs,
+            d.order_no,
+            d.create_time
+        FROM document d
+        WHERE d.document_id = ?
     """
-
-    rows = exesql(sql)
+    chunk_index_list = [int(x) for x in chunk_index_list]
+    rows = exesql(sql, (chunk_index_list, chunk_index_list, document_id))
     return rows[0]
 
 
-def get_all_kb_ids(kb_id):
-    kbs = [kb_id]
-    sql = f"select knowledge_base_id from knowledge_base where up_id = '{kb_id}'"
-    rows = exesql(sql)
-    for row in rows:
-        kbs.extend(get_all_kb_ids(row['knowledge_base_id']))
-    return kbs
-
-
 # -----------------------------
 # 获取切片的余弦值（可加条件）
 # -----------------------------
@@ -200,57 +237,35 @@ def get_chunk_cosine(
         filters: Optional[Dict[str, Any]] = None,
         top_k: int = 90
 ) -> List[Dict[str, Any]]:
+    # query_vector 单位化后作为参数传入
+    params = [_unit_vector(query_vector[0])]
+
     # 构建 WHERE 子句和参数
-    where_clause = " WHERE 1=1 AND "
-    params = []
+    where_clause = " WHERE c.chunk_vector IS NOT NULL "
 
     if filters:
         for k, v in filters.items():
             if v is not None and v != '':
-                where_clause += f" AND {k} = ?"
+                where_clause += f" AND d.{k} = ?"
                 params.append(v)
 
     # 输入知识库需要查询所有下级知识库
     if knowledge_base_id is not None and knowledge_base_id != '':
-        kb_ids = get_all_kb_ids(knowledge_base_id)
-        where_clause += " knowledge_base_id in " + "[" + ",".join(f"'{x}'" for x in kb_ids) + "]"
+        where_clause += f" AND {KnowledgeBaseDao.subtree_clause('d.knowledge_base_id')}"
+        params.append(str(knowledge_base_id))
 
-    # query_vector 作为参数传入
-    params.append(query_vector[0])
     params.append(top_k)
 
     sql = f"""
-    WITH chunks AS (
-        SELECT
-            document_id,
-            file_name,
-            location_path,
-            UNNEST(file_name_vector) AS chunk_vector,
-            UNNEST(generate_series(0, len(file_content_chunks_vector) - 1)) AS chunk_index
-        FROM document
-        {where_clause}
-        AND file_content_chunks_vector IS NOT NULL
-        AND len(file_content_chunks_vector) > 0
-    ),
-    similarities AS (
-        SELECT
-            document_id,
-            file_name,
-            location_path,
-            chunk_index,
-            chunk_vector,
-            cosine_similarity(chunk_vector, CAST(? AS FLOAT[])) AS cosine_similarity
-        FROM chunks
-        WHERE chunk_vector IS NOT NULL
-    )
     SELECT
-        document_id,
-        file_name,
-        location_path,
-        chunk_index,
-        chunk_vector,
-        cosine_similarity
-    FROM similarities
+        c.document_id,
+        d.file_name,
+        d.location_path,
+        c.chunk_index,
+        unit_cosine_similarity(c.chunk_vector, CAST(? AS {vector_type()})) AS cosine_similarity
+    FROM document_chunk c
+    JOIN document d ON d.document_id = c.document_id
+    {where_clause}
     ORDER BY cosine_similarity DESC
     LIMIT ?;
     """
@@ -259,66 +274,169 @@ def get_chunk_cosine(
     return [dict(row) for row in rows]
 
 
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
 # -----------------------------
-# 获取文件名的余弦值（可加条件）
+# 一次查询完成检索：分片余弦值、分片 BM25 分数、文件名余弦值及命中分片的文本
 # -----------------------------
-def get_file_name_cosine(
+def search_docs(
         query_vector,
-        knowledge_base_id = None,
-        filters: Optional[Dict[str, Any]] = None,
-        top_k: int = 90
-) -> List[Dict[str, Any]]:
-    # 构建 WHERE 子句和参数
-    where_clause = " WHERE 1=1 AND "
-    params = []
-
-    if filters:
-        for k, v in filters.items():
-            if v is not None and v != '':
-                where_clause += f" AND {k} = ?"
-                params.append(v)
-
+        knowledge_base_id=None,
+        top_k: int = 90,
+        chunk_hits: Optional[List[Dict[str, Any]]] = None,
+        query_terms: Optional[Dict[str, Any]] = None,
+        lexical_top_k: int = 30
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    在同一条 SQL 中对分片（向量 + BM25）和文件名打分，并取出命中分片的文本（不返回向量）
+
+    Args:
+        query_vector: 查询向量
+        knowledge_base_id: 知识库ID，包含所有下级知识库
+        top_k: 分片、文件名各取前 top_k 个
+        chunk_hits: 已由向量矩阵/ANN 索引算好的分片命中列表 [{'document_id', 'chunk_index', 'cosine_similarity'}]，
+                    为 None 时由数据库扫描分片
+        query_terms: 查询词项 {'term_id': [...], 'qtf': [...]}（ChunkTermDao.query_terms），为 None 时不做词项检索
+        lexical_top_k: BM25 取前 lexical_top_k 个分片，与向量命中的分片合并
+
+    Returns:
+        chunk_cosine_list: [{'document_id', 'file_name', 'location_path', 'chunk_index', 'cosine_similarity', 'bm25', 'chunk_text',
+                             'chunk_position'}]，chunk_position 为分片所在的页、幻灯片、工作表或章节（JSON，可以为 NULL）
+                           仅由词项命中的分片，其余弦值由分片向量现算（无向量时为 0.5，即正交）
+        file_name_cosine_list: [{'document_id', 'file_name', 'location_path', 'cosine_similarity'}]
+    """
     # 输入知识库需要查询所有下级知识库
+    kb_clause = ""
+    kb_params = []
     if knowledge_base_id is not None and knowledge_base_id != '':
-        kb_ids = get_all_kb_ids(knowledge_base_id)
-        where_clause += " knowledge_base_id in " + "[" + ",".join(f"'{x}'" for x in kb_ids) + "]"
-
-    # query_vector 作为参数传入
-    params.append(query_vector[0])
+        kb_clause = f" AND {KnowledgeBaseDao.subtree_clause('d.knowledge_base_id')}"
+        kb_params = [str(knowledge_base_id)]
+
+    # query_vector 单位化后作为参数传入
+    params = [_unit_vector(query_vector[0])]
+    if chunk_hits is None:
+        chunk_cte = f"""
+        chunk_hits AS (
+            SELECT c.document_id, c.chunk_index,
+                   unit_cosine_similarity(c.chunk_vector, q.v) AS cosine_similarity
+            FROM document_chunk c
+            JOIN document d ON d.document_id = c.document_id
+            CROSS JOIN q
+            WHERE c.chunk_vector IS NOT NULL {kb_clause}
+            ORDER BY cosine_similarity DESC
+            LIMIT ?
+        )"""
+        params.extend(kb_params)
+        params.append(top_k)
+    else:
+        chunk_cte = """
+        chunk_hits AS (
+            SELECT UNNEST(CAST(? AS BIGINT[])) AS document_id,
+                   UNNEST(CAST(? AS INTEGER[])) AS chunk_index,
+                   UNNEST(CAST(? AS DOUBLE[])) AS cosine_similarity
+        )"""
+        params.append(array_param([int(h['document_id']) for h in chunk_hits]))
+        params.append(array_param([int(h['chunk_index']) for h in chunk_hits]))
+        params.append(array_param([float(h['cosine_similarity']) for h in chunk_hits]))
+
+    if query_terms and query_terms['term_id']:
+        # BM25：idf = ln(1 + (N - df + 0.5) / (df + 0.5))，文档长度为分片的词项总数
+        lexical_cte = f"""
+        qt AS (
+            SELECT UNNEST(CAST(? AS BIGINT[])) AS term_id, UNNEST(CAST(? AS INTEGER[])) AS qtf
+        ),
+        corpus AS (
+            SELECT count(term_cnt) AS n, greatest(avg(term_cnt), 1) AS avgdl FROM document_chunk
+        ),
+        term_df AS (
+            SELECT t.term_id, count(*) AS df
+            FROM chunk_term t
+            WHERE t.term_id IN (SELECT term_id FROM qt)
+            GROUP BY t.term_id
+        ),
+        lexical_hits AS (
+            SELECT t.document_id, t.chunk_index,
+                   sum(qt.qtf * ln(1 + (corpus.n - term_df.df + 0.5) / (term_df.df + 0.5))
+                       * t.tf * ({BM25_K1} + 1)
+                       / (t.tf + {BM25_K1} * (1 - {BM25_B} + {BM25_B} * c.term_cnt / corpus.avgdl))) AS bm25
+            FROM chunk_term t
+            JOIN qt ON qt.term_id = t.term_id
+            JOIN term_df ON term_df.term_id = t.term_id
+            JOIN document_chunk c ON c.document_id = t.document_id AND c.chunk_index = t.chunk_index
+            JOIN document d ON d.document_id = t.document_id
+            CROSS JOIN corpus
+            WHERE 1 = 1 {kb_clause}
+            GROUP BY t.document_id, t.chunk_index
+            ORDER BY bm25 DESC
+            LIMIT ?
+        )"""
+        params.append(array_param([int(x) for x in query_terms['term_id']]))
+        params.append(array_param([int(x) for x in query_terms['qtf']]))
+        params.extend(kb_params)
+        params.append(lexical_top_k)
+    else:
+        lexical_cte = """
+        lexical_hits AS (
+            SELECT CAST(NULL AS BIGINT) AS document_id, CAST(NULL AS INTEGER) AS chunk_index, CAST(NULL AS DOUBLE) AS bm25
+            WHERE false
+        )"""
+    params.extend(kb_params)
     params.append(top_k)
 
     sql = f"""
-    WITH chunks AS (
-        SELECT
-            document_id,
-            file_name,
-            location_path,
-            UNNEST(file_name_vector) AS chunk_vector,
-            UNNEST(generate_series(0, len(file_name_vector) - 1)) AS chunk_index
-        FROM document
-        {where_clause}
-        AND file_name_vector IS NOT NULL
-        AND len(file_name_vector) > 0
+    WITH q AS (
+        SELECT CAST(? AS {vector_type()}) AS v
     ),
-    similarities AS (
-        SELECT
-            document_id,
-            file_name,
-            location_path,
-            cosine_similarity(chunk_vector, CAST(? AS FLOAT[])) AS cosine_similarity
-        FROM chunks
-        WHERE chunk_vector IS NOT NULL
+    {chunk_cte},
+    {lexical_cte},
+    chunk_keys AS (
+        SELECT document_id, chunk_index FROM chunk_hits
+        UNION
+        SELECT document_id, chunk_index FROM lexical_hits
+    ),
+    name_hits AS (
+        SELECT d.document_id,
+               unit_cosine_similarity(d.file_name_vector, q.v) AS cosine_similarity
+        FROM document d
+        CROSS JOIN q
+        WHERE d.file_name_vector IS NOT NULL {kb_clause}
+        ORDER BY cosine_similarity DESC
+        LIMIT ?
     )
-    SELECT
-        document_id,
-        file_name,
-        location_path,
-        cosine_similarity
-    FROM similarities
-    ORDER BY cosine_similarity DESC
-    LIMIT ?;
+    SELECT 'chunk' AS hit_type, k.document_id, d.file_name, d.location_path, k.chunk_index,
+           coalesce(h.cosine_similarity, unit_cosine_similarity(c.chunk_vector, q.v), 0.5) AS cosine_similarity,
+           coalesce(l.bm25, 0.0) AS bm25,
+           chunk_text_of(c.chunk_text, d.file_content, c.chunk_start, c.chunk_end) AS chunk_text,
+           c.chunk_position
+    FROM chunk_keys k
+    JOIN document d ON d.document_id = k.document_id
+    JOIN document_chunk c ON c.document_id = k.document_id AND c.chunk_index = k.chunk_index
+    CROSS JOIN q
+    LEFT JOIN chunk_hits h ON h.document_id = k.document_id AND h.chunk_index = k.chunk_index
+    LEFT JOIN lexical_hits l ON l.document_id = k.document_id AND l.chunk_index = k.chunk_index
+    UNION ALL
+    SELECT 'file_name' AS hit_type, h.document_id, d.file_name, d.location_path,
+           NULL AS chunk_index, h.cosine_similarity, NULL AS bm25, NULL AS chunk_text, NULL AS chunk_position
+    FROM name_hits h
+    JOIN document d ON d.document_id = h.document_id
     """
 
     rows = exesql(sql, params)
-    return [dict(row) for row in rows]
-
+    chunk_cosine_list = []
+    file_name_cosine_list = []
+    for row in rows:
+        hit_type = row.pop('hit_type')
+        if hit_type == 'chunk':
+            chunk_cosine_list.append(row)
+        else:
+            row.pop('chunk_index')
+            row.pop('bm25')
+            row.pop('chunk_text')
+            row.pop('chunk_position')
+            file_name_cosine_list.append(row)
+    chunk_cosine_list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
+    file_name_cosine_list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
+    return chunk_cosine_list, file_name_cosine_list
@@ -0,0 +1,64 @@
+from typing import List, Dict
+
+import numpy as np
+
+from database.sys_duckdb import array_param, exesql, matrix_param, vector_type
+
+
+# -----------------------------
+# 按分片文本哈希查询已缓存的向量
+# -----------------------------
+def get_vectors(model_id: str, text_hashes: List[int]) -> Dict[int, np.ndarray]:
+    """
+    Args:
+        model_id: 向量模型ID（不同模型、后端、量化方式的向量不能混用）
+        text_hashes: 分片文本哈希（TextTokenUtil.text_hash）
+
+    Returns:
+        文本哈希 -> 向量（已单位化），未缓存的哈希不在结果中
+    """
+    if not text_hashes:
+        return {}
+    sql = """
+        SELECT text_hash, vector FROM embedding_cache
+        WHERE model_id = ? AND list_contains(CAST(? AS BIGINT[]), text_hash)
+    """
+    rows = exesql(sql, (model_id, array_param(set(text_hashes))))
+    return {row['text_hash']: np.asarray(row['vector'], dtype=np.float32) for row in rows}
+
+
+# -----------------------------
+# 写入向量缓存（已存在的不覆盖）
+# -----------------------------
+def put_vectors(model_id: str, text_hashes: List[int], vectors):
+    """
+    Args:
+        model_id: 向量模型ID
+        text_hashes: 分片文本哈希
+        vectors: 与 text_hashes 一一对应的向量（已单位化）
+    """
+    if not text_hashes:
+        return
+    sql = f"""
+        INSERT INTO embedding_cache (model_id, text_hash, vector)
+        SELECT ?, UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS {vector_type()}[]))
+        ON CONFLICT DO NOTHING
+    """
+    exesql(sql, (model_id, array_param(text_hashes), matrix_param(vectors)))
+
+
+# -----------------------------
+# 清理不再被任何分片引用的缓存
+# -----------------------------
+def gc() -> int:
+    """
+    Returns:
+        删除的缓存条数
+    """
+    sql = """
+        DELETE FROM embedding_cache
+        WHERE text_hash NOT IN (SELECT chunk_hash FROM document_chunk WHERE chunk_hash IS NOT NULL)
+        RETURNING text_hash
+    """
+    rows = exesql(sql)
+    return len(rows) if rows else 0
@@ -0,0 +1,191 @@
+from typing import List, Dict, Any, Optional
+
+from database.sys_duckdb import array_param, exesql, exesql_transaction, matrix_param
+
+# 模型状态：当前使用 / 正在重新生成向量 / 已停用
+STATE_ACTIVE = 'active'
+STATE_MIGRATING = 'migrating'
+STATE_RETIRED = 'retired'
+
+
+def _sql_str(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# -----------------------------
+# 模型登记
+# -----------------------------
+def get_active() -> Optional[Dict[str, Any]]:
+    sql = "SELECT * FROM embedding_model WHERE state = ?"
+    rows = exesql(sql, (STATE_ACTIVE,))
+    return rows[0] if rows else None
+
+
+def get_migrating() -> List[Dict[str, Any]]:
+    sql = "SELECT * FROM embedding_model WHERE state = ? ORDER BY create_time"
+    rows = exesql(sql, (STATE_MIGRATING,))
+    return rows
+
+
+def register(model_name: str, dim: int, pooling: str):
+    """
+    登记要切换到的模型（state 为 migrating），已登记过的模型更新维度和池化方式
+    """
+    sql = """
+        INSERT INTO embedding_model (model_name, dim, pooling, state) VALUES (?, ?, ?, ?)
+        ON CONFLICT (model_name) DO UPDATE SET dim = excluded.dim, pooling = excluded.pooling, state = excluded.state
+    """
+    exesql(sql, (model_name, dim, pooling, STATE_MIGRATING))
+
+
+def cancel_migration(model_name: str):
+    """
+    放弃切换（配置改回当前模型或改为其他模型），删除已暂存的向量
+    """
+    exesql("DELETE FROM reembed_chunk WHERE model_name = ?", (model_name,))
+    exesql("DELETE FROM reembed_document WHERE model_name = ?", (model_name,))
+    exesql("UPDATE embedding_model SET state = ? WHERE model_name = ?", (STATE_RETIRED, model_name))
+
+
+# -----------------------------
+# 暂存新模型的向量
+# -----------------------------
+def get_pending_chunks(model_name: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    查询还没有新模型向量的分片（分片内容变化后 chunk_hash 不同，需要重新生成）
+    """
+    sql = """
+        SELECT c.document_id, c.chunk_index, c.chunk_hash,
+               chunk_text_of(c.chunk_text, d.file_content, c.chunk_start, c.chunk_end) AS chunk_text
+        FROM document_chunk c
+        JOIN document d ON d.document_id = c.document_id
+        ANTI JOIN (SELECT * FROM reembed_chunk WHERE model_name = ?) r
+          ON r.document_id = c.document_id AND r.chunk_index = c.chunk_index
+         AND r.chunk_hash IS NOT DISTINCT FROM c.chunk_hash
+        ORDER BY c.document_id, c.chunk_index
+        LIMIT ?
+    """
+    rows = exesql(sql, (model_name, limit))
+    return rows
+
+
+def get_pending_names(model_name: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    查询还没有新模型文件名向量的文档
+    """
+    sql = """
+        SELECT d.document_id, d.file_name
+        FROM document d
+        ANTI JOIN (SELECT * FROM reembed_document WHERE model_name = ?) r
+          ON r.document_id = d.document_id AND r.file_name IS NOT DISTINCT FROM d.file_name
+        WHERE d.file_name_vector IS NOT NULL
+        ORDER BY d.document_id
+        LIMIT ?
+    """
+    rows = exesql(sql, (model_name, limit))
+    return rows
+
+
+def stage_chunks(model_name: str, rows: List[Dict[str, Any]], vectors):
+    sql = """
+        INSERT OR REPLACE INTO reembed_chunk (model_name, document_id, chunk_index, chunk_hash, chunk_vector)
+        SELECT ?, UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS INTEGER[])), UNNEST(CAST(? AS BIGINT[])),
+               UNNEST(CAST(? AS FLOAT[][]))
+    """
+    exesql(sql, (model_name,
+                 array_param([int(row['document_id']) for row in rows]),
+                 array_param([int(row['chunk_index']) for row in rows]),
+                 '[' + ','.join('NULL' if row['chunk_hash'] is None else str(int(row['chunk_hash'])) for row in rows) + ']',
+                 matrix_param(vectors)))
+
+
+def stage_names(model_name: str, rows: List[Dict[str, Any]], vectors):
+    sql = """
+        INSERT OR REPLACE INTO reembed_document (model_name, document_id, file_name, file_name_vector)
+        SELECT ?, UNNEST(CAST(? AS BIGINT[])), UNNEST(CAST(? AS VARCHAR[])), UNNEST(CAST(? AS FLOAT[][]))
+    """
+    exesql(sql, (model_name,
+                 array_param([int(row['document_id']) for row in rows]),
+                 [row['file_name'] for row in rows],
+                 matrix_param(vectors)))
+
+
+def get_progress(model_name: str) -> Dict[str, int]:
+    """
+    Returns:
+        {'chunk_cnt': 分片数, 'staged_cnt': 已生成新模型向量的分片数}
+    """
+    sql = """
+        SELECT count(*) AS chunk_cnt, count(r.document_id) AS staged_cnt
+        FROM document_chunk c
+        LEFT JOIN (SELECT * FROM reembed_chunk WHERE model_name = ?) r
+          ON r.document_id = c.document_id AND r.chunk_index = c.chunk_index
+         AND r.chunk_hash IS NOT DISTINCT FROM c.chunk_hash
+    """
+    rows = exesql(sql, (model_name,))
+    return {'chunk_cnt': int(rows[0]['chunk_cnt']), 'staged_cnt': int(rows[0]['staged_cnt'])}
+
+
+# -----------------------------
+# 切换：用暂存的向量一次性替换全部向量
+# -----------------------------
+def cutover(model_name: str, dim: int, current_dim: int, cache_model_id: str):
+    """
+    在一个事务中用暂存表的向量替换 document_chunk.chunk_vector 和 document.file_name_vector，
+    维度不同时先修改向量列的类型；没有暂存向量的分片置为 NULL，由后台补齐任务用新模型生成，不会混用两个模型的向量。
+    新向量同时写入向量缓存，切换后重新加载的文档不用再编码
+
+    Args:
+        model_name: 新模型
+        dim: 新模型的向量维度
+        current_dim: 当前向量列的维度
+        cache_model_id: 新模型在向量缓存中的模型ID（EmbeddingLoader.model_id）
+    """
+    name = _sql_str(model_name)
+    vector_type = f"FLOAT[{int(dim)}]"
+    statements = []
+    if int(dim) != int(current_dim):
+        # 有索引依赖的列不能直接修改类型
+        statements += [
+            "DROP INDEX idx_document_chunk_hash",
+            f"ALTER TABLE document_chunk ALTER chunk_vector TYPE {vector_type} USING NULL",
+            "CREATE INDEX idx_document_chunk_hash ON document_chunk (chunk_hash)",
+            f"ALTER TABLE document ALTER file_name_vector TYPE {vector_type} USING NULL",
+            # 旧模型的缓存由下面按 model_id 删除（同一事务中先 DELETE 再修改列类型会在提交时冲突）
+            f"ALTER TABLE embedding_cache ALTER vector TYPE {vector_type} USING NULL",
+        ]
+    else:
+        statements += [
+            "UPDATE document_chunk SET chunk_vector = NULL",
+            "UPDATE document SET file_name_vector = NULL",
+        ]
+    statements += [
+        f"""
+        UPDATE document_chunk SET chunk_vector = CAST(r.chunk_vector AS {vector_type})
+        FROM reembed_chunk r
+        WHERE r.model_name = {name} AND r.document_id = document_chunk.document_id
+          AND r.chunk_index = document_chunk.chunk_index AND r.chunk_hash IS NOT DISTINCT FROM document_chunk.chunk_hash
+        """,
+        f"""
+        UPDATE document SET file_name_vector = CAST(r.file_name_vector AS {vector_type})
+        FROM reembed_document r
+        WHERE r.model_name = {name} AND r.document_id = document.document_id
+        """,
+        f"""
+        UPDATE document SET embedding_model = {name}
+        WHERE file_name_vector IS NOT NULL
+           OR document_id IN (SELECT document_id FROM document_chunk WHERE chunk_vector IS NOT NULL)
+        """,
+        f"DELETE FROM embedding_cache WHERE model_id <> {_sql_str(cache_model_id)}",
+        f"""
+        INSERT OR IGNORE INTO embedding_cache (model_id, text_hash, vector)
+        SELECT {_sql_str(cache_model_id)}, chunk_hash, CAST(any_value(chunk_vector) AS {vector_type})
+        FROM reembed_chunk WHERE model_name = {name} AND chunk_hash IS NOT NULL
+        GROUP BY chunk_hash
+        """,
+        f"UPDATE embedding_model SET state = '{STATE_RETIRED}' WHERE state = '{STATE_ACTIVE}'",
+        f"UPDATE embedding_model SET state = '{STATE_ACTIVE}', activate_time = now() WHERE model_name = {name}",
+        f"DELETE FROM reembed_chunk WHERE model_name = {name}",
+        f"DELETE FROM reembed_document WHERE model_name = {name}",
+    ]
+    exesql_transaction(statements, timeout=600)
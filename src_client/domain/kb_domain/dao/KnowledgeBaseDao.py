@@ -1,6 +1,21 @@
+import json
 from typing import Dict, Any, List, Optional
 from database.sys_duckdb import exesql
 
+# 子树过滤谓词：column 所在的知识库属于指定知识库（含自身）的子树，参数为知识库ID
+# 检索、待加载数量统计、删除均使用同一个谓词
+SUBTREE_PREDICATE = "{column} IN (SELECT descendant_id FROM knowledge_base_closure WHERE ancestor_id = ?)"
+
+
+def subtree_clause(column: str) -> str:
+    """
+    返回子树过滤条件，调用方需追加参数 str(knowledge_base_id)
+
+    Args:
+        column: VARCHAR 类型的知识库ID列，如 d.knowledge_base_id
+    """
+    return SUBTREE_PREDICATE.format(column=column)
+
 
 # -----------------------------
 # 新增知识库
@@ -16,6 +31,7 @@ def insert(data: Dict[str, Any]):
     sql = f"INSERT INTO knowledge_base ({field_names}) VALUES ({placeholders})"
     params = tuple(data.values())
     exesql(sql, params)
+    insert_closure(data['knowledge_base_id'], data.get('up_id'))
 
 
 # -----------------------------
@@ -24,6 +40,65 @@ def insert(data: Dict[str, Any]):
 def delete(knowledge_base_id):
     sql = "DELETE FROM knowledge_base WHERE knowledge_base_id = ?"
     exesql(sql, (knowledge_base_id,))
+    sql = "DELETE FROM knowledge_base_closure WHERE descendant_id = ? OR ancestor_id = ?"
+    exesql(sql, (str(knowledge_base_id), str(knowledge_base_id)))
+
+
+# -----------------------------
+# 删除知识库及其所有下级知识库
+# -----------------------------
+def delete_tree(knowledge_base_id):
+    params = (str(knowledge_base_id),)
+    sql = f"DELETE FROM knowledge_base WHERE {subtree_clause('CAST(knowledge_base_id AS VARCHAR)')}"
+    exesql(sql, params)
+    sql = f"DELETE FROM knowledge_base_closure WHERE {subtree_clause('descendant_id')}"
+    exesql(sql, params)
+
+
+# -----------------------------
+# 维护闭包表：新增知识库时写入自身及所有上级知识库的关系
+# -----------------------------
+def insert_closure(knowledge_base_id, up_id=None):
+    _id = str(knowledge_base_id)
+    sql = """
+        INSERT INTO knowledge_base_closure (ancestor_id, descendant_id, depth)
+        SELECT ?, ?, 0
+        UNION ALL
+        SELECT ancestor_id, ?, depth + 1 FROM knowledge_base_closure WHERE descendant_id = ?
+    """
+    exesql(sql, (_id, _id, _id, str(up_id)))
+
+
+# -----------------------------
+# 查询知识库所属的顶级知识库ID
+# -----------------------------
+def get_root_id(knowledge_base_id) -> Optional[str]:
+    sql = """
+        SELECT ancestor_id FROM knowledge_base_closure
+        WHERE descendant_id = ?
+        ORDER BY depth DESC
+        LIMIT 1
+    """
+    rows = exesql(sql, (str(knowledge_base_id),))
+    return rows[0]['ancestor_id'] if rows else None
+
+
+# -----------------------------
+# 查询知识库及其所有上级知识库的ID
+# -----------------------------
+def get_ancestor_ids(knowledge_base_id) -> List[str]:
+    sql = "SELECT ancestor_id FROM knowledge_base_closure WHERE descendant_id = ?"
+    rows = exesql(sql, (str(knowledge_base_id),))
+    return [row['ancestor_id'] for row in rows]
+
+
+# -----------------------------
+# 查询知识库及其所有下级知识库的ID
+# -----------------------------
+def get_subtree_ids(knowledge_base_id) -> List[str]:
+    sql = "SELECT descendant_id FROM knowledge_base_closure WHERE ancestor_id = ?"
+    rows = exesql(sql, (str(knowledge_base_id),))
+    return [row['descendant_id'] for row in rows]
 
 
 # -----------------------------
@@ -51,6 +126,28 @@ def get_by_id(knowledge_base_id) -> Optional[Dict[str, Any]]:
     return rows[0] if rows else None
 
 
+# -----------------------------
+# 查询扩展属性（extend_attrs 中保存的 JSON）
+# -----------------------------
+def get_extend_attrs(knowledge_base_id) -> Dict[str, Any]:
+    kb = get_by_id(knowledge_base_id)
+    if kb is None or not kb.get('extend_attrs'):
+        return {}
+    try:
+        return json.loads(kb['extend_attrs'])
+    except ValueError:
+        return {}
+
+
+# -----------------------------
+# 更新扩展属性（与原有属性合并）
+# -----------------------------
+def update_extend_attrs(knowledge_base_id, attrs: Dict[str, Any]):
+    extend_attrs = get_extend_attrs(knowledge_base_id)
+    extend_attrs.update(attrs)
+    update(knowledge_base_id, {'extend_attrs': json.dumps(extend_attrs, ensure_ascii=False)})
+
+
 # -----------------------------
 # 查询全部（可带过滤条件）
 # -----------------------------
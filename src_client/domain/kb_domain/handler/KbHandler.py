@@ -14,6 +14,7 @@ from domain.kb_domain.dao import KnowledgeBaseDao
 from domain.kb_domain.dao import DocumentDao
 from domain.kb_domain.dao import ViewKbDocDao
 
+from domain.kb_domain.serv import SearchCacheServ, VectorIndexServ
 from domain.kb_domain.serv.KBServ import get_kb_change, kb_delete_all, update_wait_load_num
 from util import IDUtil
 
@@ -277,6 +278,47 @@ class ApiRemoveKBHandler(BaseApiHandler):
             return
 
 
+# 知识库向量量化设置：传入 quantization（none / int8 / binary / pca）时切换，返回节省的内存及召回率
+class ApiKbQuantizationHandler(BaseApiHandler):
+    need_login = False
+
+    def myget(self):
+        knowledge_base_id = self.get_argument("kb_id", None)
+        quantization = self.get_argument("quantization", None)
+        try:
+            if quantization:
+                report = VectorIndexServ.set_quantization(knowledge_base_id, quantization)
+            else:
+                report = VectorIndexServ.quantization_report(knowledge_base_id)
+            self.write({
+                'success': True,
+                'code': 0,
+                'msg': None,
+                'data': report
+            })
+        except Exception as e:
+            logging.error(f"知识库向量量化失败：{e}", exc_info=True)
+            self.write({
+                'success': False,
+                'code': 1,
+                'msg': str(e),
+                'data': None
+            })
+
+
+# 检索缓存命中率
+class ApiSearchCacheStatsHandler(BaseApiHandler):
+    need_login = False
+
+    def myget(self):
+        self.write({
+            'success': True,
+            'code': 0,
+            'msg': None,
+            'data': SearchCacheServ.get_stats()
+        })
+
+
 urls = [
     ('/api/knowledge/addKb', ApiAddKbHandler),
     # ('/api/knowledge/removeDoc', ApiRemoveDocHandler),
@@ -287,5 +329,7 @@ urls = [
     ('/api/knowledge/getWaitDocNum', ApiWaitDocNumHandler),
     ('/api/knowledge/startKbLoading', ApiStartKbLoadingHandler),
     ('/api/knowledge/stopKbLoading', ApiStopKbLoadingHandler),
-    ('/api/knowledge/removeKB', ApiRemoveKBHandler)
+    ('/api/knowledge/removeKB', ApiRemoveKBHandler),
+    ('/api/knowledge/quantization', ApiKbQuantizationHandler),
+    ('/api/knowledge/searchCacheStats', ApiSearchCacheStatsHandler)
 ]
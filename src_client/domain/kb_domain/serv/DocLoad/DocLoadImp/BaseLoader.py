@@ -1,6 +1,22 @@
-from typing import Any, List
+from typing import Any, Dict, List
 import logging
 
+# 内容块类型：_load_impl 可以返回带类型和位置的内容块（make_block），分片不跨越内容块，分片保存所在位置
+BLOCK_TEXT = 'text'  # 无结构文本
+BLOCK_PAGE = 'page'  # PDF、OFD 的一页，位置 {'page': 页码}
+BLOCK_SLIDE = 'slide'  # 一张幻灯片，位置 {'slide': 序号}
+BLOCK_SHEET = 'sheet'  # Excel 工作表，位置 {'sheet': 工作表名}
+BLOCK_SECTION = 'section'  # Word 中一个标题下的内容，位置 {'heading': 标题}（第一个标题之前的内容没有标题）
+
+
+def make_block(text: str, block_type: str = BLOCK_TEXT, **position) -> Dict[str, Any]:
+    """
+    内容块 {'type', 'text', 'position'}，position 中值为 None 的项不保存
+    """
+    return {'type': block_type, 'text': text,
+            'position': {key: value for key, value in position.items() if value is not None}}
+
+
 class BaseLoader:
     """所有加载器的基类"""
 
@@ -9,7 +25,9 @@ class BaseLoader:
         self.rtn = {
             'file_path': file_path,
             'load_status': False,
-            'file_content': []
+            'file_content': [],
+            # 内容块，与 file_content 一一对应；_load_impl 返回纯文本时类型为 text
+            'blocks': []
         }
 
     def load(self) -> Any:
@@ -20,7 +38,9 @@ class BaseLoader:
             result = self._load_impl()
             # 如果子类返回内容，则填充 file_content
             if result is not None and result != []:
-                self.rtn['file_content'] = result if isinstance(result, list) else [result]
+                items = result if isinstance(result, list) else [result]
+                self.rtn['blocks'] = [item if isinstance(item, dict) else make_block(item) for item in items]
+                self.rtn['file_content'] = [block['text'] for block in self.rtn['blocks']]
                 self.rtn['load_status'] = True
             else:
                 logging.debug(f"{type(self)}读取文件{self.file_path}失败")
@@ -32,8 +52,8 @@ class BaseLoader:
             self.rtn['file_content'] = [f"加载失败: {e}"]
         return self.rtn
 
-    def _load_impl(self) -> List[str]:
+    def _load_impl(self) -> List[Any]:
         """
-        子类真正实现加载逻辑
+        子类真正实现加载逻辑，返回文本列表或内容块（make_block）列表
         """
         raise NotImplementedError("子类必须实现 _load_impl() 方法")
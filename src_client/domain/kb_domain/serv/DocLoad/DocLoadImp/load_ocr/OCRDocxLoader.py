@@ -1,6 +1,7 @@
 from typing import List
 
 from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.DocxTextLoader import SectionBuilder, is_heading
 import numpy as np
 from rapidocr_onnxruntime import RapidOCR
 
@@ -22,7 +23,7 @@ class OCRDocxLoader(BaseLoader):
             from io import BytesIO
             ocr = RapidOCR()
             doc = Document(filepath)
-            resp = ""
+            section = SectionBuilder()
 
             def iter_block_items(parent):
                 from docx.document import Document
@@ -41,7 +42,9 @@ class OCRDocxLoader(BaseLoader):
 
             for i, block in enumerate(iter_block_items(doc)):
                 if isinstance(block, Paragraph):
-                    resp += block.text.strip() + "\n"
+                    if is_heading(block):
+                        section.start(block.text.strip())
+                    section.text += block.text.strip() + "\n"
                     images = block._element.xpath('.//pic:pic')  # 获取所有图片
                     for image in images:
                         for img_id in image.xpath('.//a:blip/@r:embed'):  # 获取图片id
@@ -51,13 +54,13 @@ class OCRDocxLoader(BaseLoader):
                                 result, _ = ocr(np.array(image))
                                 if result:
                                     ocr_result = [line[1] for line in result]
-                                    resp += "\n".join(ocr_result)
+                                    section.text += "\n".join(ocr_result)
                 elif isinstance(block, Table):
                     for row in block.rows:
                         for cell in row.cells:
                             for paragraph in cell.paragraphs:
-                                resp += paragraph.text.strip() + "\n"
-            return resp
+                                section.text += paragraph.text.strip() + "\n"
+            section.flush()
+            return section.blocks
 
-        text = doc2text(self.file_path)
-        return [text]
+        return doc2text(self.file_path) or ['']
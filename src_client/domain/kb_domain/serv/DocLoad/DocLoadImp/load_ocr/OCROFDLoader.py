@@ -1,4 +1,4 @@
-from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader, BLOCK_PAGE, make_block
 import base64
 import os
 from typing import List
@@ -17,9 +17,13 @@ class OCROFDLoader(BaseLoader):
             ofdb64 = str(base64.b64encode(f.read()), "utf-8")
         ofd = OFD()  # 初始化OFD 工具类
         ofd.read(ofdb64, save_xml=False, xml_name=f"{file_prefix}_xml")  # 读取ofdb64
-        text = ''
+        # 每页一个内容块
+        blocks = []
         for page in ofd.data:
             for page_info in page['page_info'].values():
+                text = ''
                 for _text in page_info['text_list']:
                     text += str(_text['text']) + ' \n'
-        return [text]
+                if text.strip():
+                    blocks.append(make_block(text, BLOCK_PAGE, page=len(blocks) + 1))
+        return blocks or ['']
@@ -1,4 +1,4 @@
-from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader, BLOCK_PAGE, make_block
 # pip install opencv-python
 import cv2
 import numpy as np
@@ -25,15 +25,15 @@ class OCRPDFLoader(BaseLoader):
             rotated_img = cv2.warpAffine(img, M, (new_w, new_h))
             return rotated_img
 
-        def pdf2text(filepath: str) -> str:
+        def pdf2text(filepath: str) -> list:
             """
-            直接将 PDF 页面渲染为图像并进行 OCR 识别
+            直接将 PDF 页面渲染为图像并进行 OCR 识别，每页一个内容块（入库时按页识别重复的页眉、页脚）
             """
             # pip install pyMuPDF
             import fitz  # pyMuPDF里面的fitz包，不要与pip install fitz混淆
             ocr = get_ocr()
             doc = fitz.open(stream=open(filepath, "rb").read(), filetype="pdf")
-            resp = ""
+            resp = []
 
             for i, page in enumerate(doc):
                 # 提高 DPI 使 OCR 更准确
@@ -52,12 +52,13 @@ class OCRPDFLoader(BaseLoader):
                 result, _ = ocr(img)
                 if result:
                     ocr_result = [line[1] for line in result]
-                    text_page = "\n".join(ocr_result)
-                    resp += f"{text_page}"
+                    text_page = "\n".join(ocr_result).strip()
+                    if text_page:
+                        resp.append(make_block(text_page, BLOCK_PAGE, page=i + 1))
 
-            return resp.strip()
+            return resp
 
-        text = pdf2text(self.file_path)
-        return [text]
+        pages = pdf2text(self.file_path)
+        return pages or [""]
 
 
@@ -1,6 +1,6 @@
 from typing import List
 
-from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader, BLOCK_SLIDE, make_block
 
 
 class OCRPPTLoader(BaseLoader):
@@ -19,6 +19,7 @@ class OCRPPTLoader(BaseLoader):
             ocr = RapidOCR()
             prs = Presentation(filepath)
             resp = ""
+            blocks = []
 
             def extract_text(shape):
                 nonlocal resp
@@ -38,13 +39,15 @@ class OCRPPTLoader(BaseLoader):
                 elif shape.shape_type == 6:  # 6 表示组合
                     for child_shape in shape.shapes:
                         extract_text(child_shape)
-            # 遍历所有幻灯片
+            # 遍历所有幻灯片，每张幻灯片一个内容块
             for slide_number, slide in enumerate(prs.slides, start=1):
+                resp = ""
                 sorted_shapes = sorted(slide.shapes,
                                        key=lambda x: (x.top, x.left))  # 从上到下、从左到右遍历
                 for shape in sorted_shapes:
                     extract_text(shape)
-            return resp
+                if resp.strip():
+                    blocks.append(make_block(resp, BLOCK_SLIDE, slide=slide_number))
+            return blocks
 
-        text = ppt2text(self.file_path)
-        return [text]
+        return ppt2text(self.file_path) or ['']
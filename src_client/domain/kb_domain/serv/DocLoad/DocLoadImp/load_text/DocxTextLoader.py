@@ -1,20 +1,51 @@
-from typing import List
+from typing import List, Optional
 
-from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader, BLOCK_SECTION, make_block
+
+# 标题段落的样式名前缀（英文版和中文版 Word）
+HEADING_STYLES = ('Heading', 'Title', '标题')
+
+
+def is_heading(paragraph) -> bool:
+    try:
+        style_name = paragraph.style.name if paragraph.style is not None else ''
+    except Exception:
+        style_name = ''
+    return bool(style_name) and style_name.startswith(HEADING_STYLES) and bool(paragraph.text.strip())
+
+
+class SectionBuilder:
+    """
+    按标题段落把正文分成章节内容块，标题之前的内容是没有 heading 的章节
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.heading: Optional[str] = None
+        self.text = ""
+
+    def start(self, heading: str):
+        self.flush()
+        self.heading = heading
+
+    def flush(self):
+        if self.text.strip():
+            self.blocks.append(make_block(self.text, BLOCK_SECTION, heading=self.heading))
+        self.text = ""
 
 
 class DocxTextLoader(BaseLoader):
     def __init__(self, file_path: str):
         super().__init__(file_path)
 
-    def _load_impl(self) -> List[str]:
-        def doc2text(filepath: str) -> str:
+    def _load_impl(self) -> List:
+        def doc2text(filepath: str) -> List:
             from docx import Document
             from docx.text.paragraph import Paragraph
             from docx.table import Table
 
             doc = Document(filepath)
-            text = ""
+            section = SectionBuilder()
 
             def iter_block_items(parent):
                 """遍历段落和表格"""
@@ -31,17 +62,20 @@ class DocxTextLoader(BaseLoader):
 
             for block in iter_block_items(doc):
                 if isinstance(block, Paragraph):
+                    if is_heading(block):
+                        section.start(block.text.strip())
                     if block.text.strip():
-                        text += block.text.strip() + "\n"
+                        section.text += block.text.strip() + "\n"
                 elif isinstance(block, Table):
                     for row in block.rows:
                         for cell in row.cells:
                             for paragraph in cell.paragraphs:
                                 if paragraph.text.strip():
-                                    text += paragraph.text.strip() + "\n"
+                                    section.text += paragraph.text.strip() + "\n"
 
-            return text
+            section.flush()
+            return section.blocks
 
-        return [doc2text(self.file_path)]
+        return doc2text(self.file_path) or ['']
 
 
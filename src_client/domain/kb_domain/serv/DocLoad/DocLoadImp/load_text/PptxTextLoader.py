@@ -1,16 +1,17 @@
 from typing import List
 from pptx import Presentation
-from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader, BLOCK_SLIDE, make_block
 
 
 class PptxTextLoader(BaseLoader):
     def __init__(self, file_path: str):
         super().__init__(file_path)
 
-    def _load_impl(self) -> List[str]:
-        def ppt2text(filepath: str) -> str:
+    def _load_impl(self) -> List:
+        def ppt2text(filepath: str) -> List:
             prs = Presentation(filepath)
             text = ""
+            blocks = []
 
             def extract_text(shape):
                 nonlocal text
@@ -30,14 +31,17 @@ class PptxTextLoader(BaseLoader):
                     for child in shape.shapes:
                         extract_text(child)
 
-            # 遍历每一页幻灯片
-            for slide in prs.slides:
+            # 遍历每一页幻灯片，每页一个内容块
+            for slide_number, slide in enumerate(prs.slides, start=1):
+                text = ""
                 sorted_shapes = sorted(slide.shapes, key=lambda s: (s.top, s.left))
                 for shape in sorted_shapes:
                     extract_text(shape)
+                if text.strip():
+                    blocks.append(make_block(text, BLOCK_SLIDE, slide=slide_number))
 
-            return text
+            return blocks
 
-        return [ppt2text(self.file_path)]
+        return ppt2text(self.file_path) or ['']
 
 
@@ -1,6 +1,6 @@
 from typing import Any
 
-from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader, BLOCK_PAGE, make_block
 
 # pip install PyPDF2
 import PyPDF2
@@ -9,7 +9,7 @@ import PyPDF2
 class PyPDFLoader(BaseLoader):
     """
     PyPDFLoader - 使用PyPDF2库读取PDF文件内容
-    从PDF中提取文本内容
+    从PDF中提取文本内容，每页一个内容块
     """
 
     def _load_impl(self) -> Any:
@@ -24,6 +24,6 @@ class PyPDFLoader(BaseLoader):
             for page_num, page in enumerate(pdf_reader.pages):
                 text = page.extract_text()
                 if text.strip():  # 只添加非空页面内容
-                    content_list.append(f"{text.strip()}")
+                    content_list.append(make_block(text.strip(), BLOCK_PAGE, page=page_num + 1))
 
         return content_list
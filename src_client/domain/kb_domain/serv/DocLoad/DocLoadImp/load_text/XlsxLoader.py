@@ -1,11 +1,11 @@
 from typing import List
-from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader, BLOCK_SHEET, make_block
 
 
 class XlsxLoader(BaseLoader):
     def _load_impl(self) -> List:
         """
-        使用openpyxl读取.xlsx文件
+        使用openpyxl读取.xlsx文件，每个工作表一个内容块（每行一行文本）
         """
         try:
             from openpyxl import load_workbook
@@ -21,6 +21,7 @@ class XlsxLoader(BaseLoader):
             # 遍历所有工作表
             for sheet_name in workbook.sheetnames:
                 sheet = workbook[sheet_name]
+                rows = []
 
                 # 遍历所有行
                 for row in sheet.iter_rows(values_only=True):
@@ -28,7 +29,10 @@ class XlsxLoader(BaseLoader):
                     row_text = ' '.join(str(cell).strip() for cell in row if cell is not None and str(cell).strip())
 
                     if row_text:
-                        content_list.append(row_text)
+                        rows.append(row_text)
+
+                if rows:
+                    content_list.append(make_block('\n'.join(rows), BLOCK_SHEET, sheet=sheet_name))
 
             workbook.close()
 
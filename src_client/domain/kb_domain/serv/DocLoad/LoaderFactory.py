@@ -1,12 +1,136 @@
 import os
 import inspect
-from typing import Type, List
+import importlib
+import re
+import threading
+import time
+import zipfile
+from typing import Type, List, Dict, Any, Optional, Tuple
 
 from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BaseLoader
 import logging
 
+_IMPL = 'domain.kb_domain.serv.DocLoad.DocLoadImp'
+
+# 文件头（magic bytes）与实际格式，扩展名与文件头不符时按文件头选择 Loader
+_MAGIC_RULES = [
+    (b'%PDF-', '.pdf'),
+    (b'{\\rtf', '.rtf'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+    (b'II*\x00', '.tiff'),
+    (b'MM\x00*', '.tiff'),
+    (b'8BPS', '.psd'),
+]
+_ZIP_MAGIC = b'PK\x03\x04'
+_OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+# OLE 复合文档（旧版 Office、WPS、Outlook 邮件）无法只凭文件头区分，扩展名是其中之一时按扩展名，
+# 否则按扩展名对应的新版格式改用旧版格式的 Loader
+_OLE_EXTS = {'.doc', '.xls', '.wps', '.msg'}
+_OLE_FALLBACK = {'.docx': '.doc', '.xlsx': '.xls'}
+_IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp', '.heic', '.psd', '.gif', '.tiff', '.raw'}
+# 读取的文件头长度
+MAGIC_SIZE = 16
+
+# 按成功率调整 Loader 顺序：格式 + Loader 尝试次数达到 ADAPT_MIN_ATTEMPTS 后才参与排序，
+# 成功率低于 ADAPT_SKIP_RATE 的 Loader 移到最后（仍作为最后的回退）
+ADAPT_MIN_ATTEMPTS = 20
+ADAPT_SKIP_RATE = 0.05
+# 检测 PDF 是否有文本层时检查的页数（在全文中均匀抽取）
+PDF_PROBE_PAGES = 5
+# 显示文字的操作符 Tj、TJ、'、"（BT 文本对象可能只设置字体，不显示文字）
+_PDF_TEXT_RE = re.compile(rb'(?<![A-Za-z/])T[jJ](?![A-Za-z])|[)>\]]\s*[\'"]')
+
+
+def detect_format(filepath: str) -> str:
+    """
+    按文件头识别实际格式，返回对应的扩展名；无法识别（纯文本类格式等）时返回文件扩展名
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    try:
+        with open(filepath, 'rb') as f:
+            head = f.read(MAGIC_SIZE)
+    except OSError:
+        return ext
+    for magic, fmt in _MAGIC_RULES:
+        if head.startswith(magic):
+            # 同为图片时扩展名更准确（如 .jpeg、.heic），都使用 OCRIMGLoader
+            return ext if fmt in _IMAGE_EXTS and ext in _IMAGE_EXTS else fmt
+    if head[8:12] == b'WEBP' and head.startswith(b'RIFF'):
+        return ext if ext in _IMAGE_EXTS else '.webp'
+    if head.startswith(_OLE_MAGIC):
+        return ext if ext in _OLE_EXTS else _OLE_FALLBACK.get(ext, ext)
+    if head.startswith(_ZIP_MAGIC):
+        return _detect_zip_format(filepath) or ext
+    return ext
+
+
+def _detect_zip_format(filepath: str) -> Optional[str]:
+    """
+    zip 容器格式（docx / xlsx / pptx / ofd / epub / odt）按包内的文件区分，只读取中央目录
+    """
+    try:
+        with zipfile.ZipFile(filepath) as zf:
+            names = zf.namelist()
+            mimetype = zf.read('mimetype').decode('ascii', 'ignore').strip() if 'mimetype' in names else ''
+    except Exception:
+        return None
+    if mimetype == 'application/epub+zip':
+        return '.epub'
+    if mimetype == 'application/vnd.oasis.opendocument.text':
+        return '.odt'
+    for prefix, fmt in (('word/', '.docx'), ('ppt/', '.pptx'), ('xl/', '.xlsx')):
+        if any(name.startswith(prefix) for name in names):
+            return fmt
+    if 'OFD.xml' in names:
+        return '.ofd'
+    return None
+
+
+def _probe_pdf(filepath: str) -> List[str]:
+    """
+    检测 PDF 是否有文本层：抽取的页面都没有文本对象（只有扫描图片）时直接使用 OCR，不再先用 PyPDF2 读取全文。
+    只检查页面资源和内容流中显示文字的操作符，不解码文字
+
+    Returns:
+        优先尝试的 Loader 名称，无法判断时为空
+    """
+    try:
+        import PyPDF2
+        reader = PyPDF2.PdfReader(filepath)
+        page_cnt = len(reader.pages)
+        if page_cnt == 0:
+            return []
+        step = max(1, page_cnt // PDF_PROBE_PAGES)
+        has_image = False
+        for page_index in range(0, page_cnt, step)[:PDF_PROBE_PAGES]:
+            page = reader.pages[page_index]
+            resources = page.get('/Resources')
+            resources = resources.get_object() if resources is not None else {}
+            # 没有文字的页面也可能声明了字体资源，再看内容流中有没有显示文字
+            if '/Font' in resources:
+                contents = page.get_contents()
+                if contents is not None and _PDF_TEXT_RE.search(contents.get_data()):
+                    return []
+            xobjects = resources.get('/XObject')
+            for xobject in (xobjects.get_object().values() if xobjects is not None else []):
+                xobject = xobject.get_object()
+                if xobject.get('/Subtype') == '/Image':
+                    has_image = True
+                elif xobject.get('/Subtype') == '/Form':
+                    # 表单对象中可能有文字，无法简单判断
+                    return []
+        return ['OCRPDFLoader'] if has_image else []
+    except Exception as e:
+        logging.debug(f"PDF 文本层检测失败 {filepath}: {e}")
+        return []
+
+
 class LoaderFactory:
-    """根据扩展名选择对应的 Loader，并支持多级回退"""
+    """根据文件头和扩展名选择对应的 Loader，并支持多级回退（按各 Loader 的成功率调整顺序）"""
 
     # 字典定义: 主 Loader + 备用 Loader 列表
     _LOADER_RULES = [
@@ -46,158 +170,193 @@ class LoaderFactory:
         ext: loaders for exts, loaders in _LOADER_RULES for ext in exts
     }
 
+    # Loader 名称 -> 所在模块（类名与名称相同），首次使用时导入
+    _LOADER_MODULES: Dict[str, str] = {
+        'UnstructuredHTMLLoader': f'{_IMPL}.UnstructuredHTMLLoader',
+        'MHTMLLoader': f'{_IMPL}.load_text.MHTMLLoader',
+        'UnstructuredMarkdownLoader': f'{_IMPL}.UnstructuredMarkdownLoader',
+        'MarkdownTextLoader': f'{_IMPL}.load_text.MarkdownTextLoader',
+        'JSONLoader': f'{_IMPL}.load_text.JSONLoader',
+        'JSONLinesLoader': f'{_IMPL}.load_text.JSONLinesLoader',
+        'DocxTextLoader': f'{_IMPL}.load_text.DocxTextLoader',
+        'PptxTextLoader': f'{_IMPL}.load_text.PptxTextLoader',
+        'CSVLoader': f'{_IMPL}.load_text.CSVLoader',
+        'CsvTextLoader': f'{_IMPL}.load_text.CsvTextLoader',
+        'OCRPDFLoader': f'{_IMPL}.load_ocr.OCRPDFLoader',
+        'PyPDFLoader': f'{_IMPL}.load_text.PyPDFLoader',
+        'OCROFDLoader': f'{_IMPL}.load_ocr.OCROFDLoader',
+        'DOCLoader': f'{_IMPL}.DocUseMsWordLoader',
+        'AntiDocLoader': f'{_IMPL}.load_text.AntiDocLoader',
+        'OCRDocLoader': f'{_IMPL}.load_ocr.OCRDocLoader',
+        'OCRDocxLoader': f'{_IMPL}.load_ocr.OCRDocxLoader',
+        'WPSLoader': f'{_IMPL}.load_text.WPSLoader',
+        'OCRPPTLoader': f'{_IMPL}.load_ocr.OCRPPTLoader',
+        'OCRIMGLoader': f'{_IMPL}.load_ocr.OCRIMGLoader',
+        'UnstructuredEmailLoader': f'{_IMPL}.UnstructuredEmailLoader',
+        'UnstructuredEPubLoader': f'{_IMPL}.UnstructuredEPubLoader',
+        'UnstructuredExcelLoader': f'{_IMPL}.unused.UnstructuredExcelLoader',
+        'NotebookLoader': f'{_IMPL}.load_text.NotebookLoader',
+        'UnstructuredODTLoader': f'{_IMPL}.UnstructuredODTLoader',
+        'PythonLoader': f'{_IMPL}.load_text.PythonLoader',
+        'UnstructuredRSTLoader': f'{_IMPL}.UnstructuredRSTLoader',
+        'UnstructuredRTFLoader': f'{_IMPL}.UnstructuredRTFLoader',
+        'SRTLoader': f'{_IMPL}.load_text.SRTLoader',
+        'TomlLoader': f'{_IMPL}.load_text.TomlLoader',
+        'UnstructuredTSVLoader': f'{_IMPL}.UnstructuredTSVLoader',
+        'UnstructuredXMLLoader': f'{_IMPL}.UnstructuredXMLLoader',
+        'EverNoteLoader': f'{_IMPL}.load_text.EverNoteLoader',
+        'XlsLoader': f'{_IMPL}.load_text.XlsLoader',
+        'XlsxLoader': f'{_IMPL}.load_text.XlsxLoader',
+        'UnstructuredFileLoader': f'{_IMPL}.UnstructuredFileLoader',
+    }
+
+    # 格式 -> 读取前的检测，返回优先尝试的 Loader
+    _PROBES = {'.pdf': _probe_pdf}
+
+    # 缓存：Loader 名称 -> (类, __init__ 参数名集合, 文件路径参数名)
+    _constructors: Dict[str, Tuple[Type[BaseLoader], frozenset, str]] = {}
+    # 各格式各 Loader 的尝试统计 (格式, Loader) -> {'attempts', 'success', 'seconds'}
+    _stats: Dict[Tuple[str, str], Dict[str, float]] = {}
+    _lock = threading.Lock()
+
     @classmethod
     def _get_loader_class(cls, name: str) -> Type[BaseLoader]:
         """
         延迟导入 Loader 类，根据名称返回 Loader 类对象
         """
-        if name == "UnstructuredHTMLLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredHTMLLoader import UnstructuredHTMLLoader
-            return UnstructuredHTMLLoader
-        elif name == "MHTMLLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.MHTMLLoader import MHTMLLoader
-            return MHTMLLoader
-        elif name == "UnstructuredMarkdownLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredMarkdownLoader import UnstructuredMarkdownLoader
-            return UnstructuredMarkdownLoader
-        elif name == "MarkdownTextLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.MarkdownTextLoader import MarkdownTextLoader
-            return MarkdownTextLoader
-        elif name == "JSONLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.JSONLoader import JSONLoader
-            return JSONLoader
-        elif name == "JSONLinesLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.JSONLinesLoader import JSONLinesLoader
-            return JSONLinesLoader
-        elif name == "DocxTextLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.DocxTextLoader import DocxTextLoader
-            return DocxTextLoader
-        elif name == "PptxTextLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.PptxTextLoader import PptxTextLoader
-            return PptxTextLoader
-        elif name == "CSVLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.CSVLoader import CSVLoader
-            return CSVLoader
-        elif name == "CsvTextLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.CsvTextLoader import CsvTextLoader
-            return CsvTextLoader
-        elif name == "OCRPDFLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_ocr.OCRPDFLoader import OCRPDFLoader
-            return OCRPDFLoader
-        elif name == "PyPDFLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.PyPDFLoader import PyPDFLoader
-            return PyPDFLoader
-        elif name == "OCROFDLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_ocr.OCROFDLoader import OCROFDLoader
-            return OCROFDLoader
-        elif name == "DOCLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.DocUseMsWordLoader import DOCLoader
-            return DOCLoader
-        elif name == "AntiDocLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.AntiDocLoader import AntiDocLoader
-            return AntiDocLoader
-        elif name == "OCRDocLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_ocr.OCRDocLoader import OCRDocLoader
-            return OCRDocLoader
-        elif name == "OCRDocxLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_ocr.OCRDocxLoader import OCRDocxLoader
-            return OCRDocxLoader
-        elif name == "WPSLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.WPSLoader import WPSLoader
-            return WPSLoader
-        elif name == "OCRPPTLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_ocr.OCRPPTLoader import OCRPPTLoader
-            return OCRPPTLoader
-        elif name == "OCRIMGLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_ocr.OCRIMGLoader import OCRIMGLoader
-            return OCRIMGLoader
-        elif name == "UnstructuredEmailLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredEmailLoader import UnstructuredEmailLoader
-            return UnstructuredEmailLoader
-        elif name == "UnstructuredEPubLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredEPubLoader import UnstructuredEPubLoader
-            return UnstructuredEPubLoader
-        elif name == "UnstructuredExcelLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.unused.UnstructuredExcelLoader import UnstructuredExcelLoader
-            return UnstructuredExcelLoader
-        elif name == "NotebookLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.NotebookLoader import NotebookLoader
-            return NotebookLoader
-        elif name == "UnstructuredODTLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredODTLoader import UnstructuredODTLoader
-            return UnstructuredODTLoader
-        elif name == "PythonLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.PythonLoader import PythonLoader
-            return PythonLoader
-        elif name == "UnstructuredRSTLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredRSTLoader import UnstructuredRSTLoader
-            return UnstructuredRSTLoader
-        elif name == "UnstructuredRTFLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredRTFLoader import UnstructuredRTFLoader
-            return UnstructuredRTFLoader
-        elif name == "SRTLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.SRTLoader import SRTLoader
-            return SRTLoader
-        elif name == "TomlLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.TomlLoader import TomlLoader
-            return TomlLoader
-        elif name == "UnstructuredTSVLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredTSVLoader import UnstructuredTSVLoader
-            return UnstructuredTSVLoader
-        elif name == "UnstructuredXMLLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredXMLLoader import UnstructuredXMLLoader
-            return UnstructuredXMLLoader
-        elif name == "EverNoteLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.EverNoteLoader import EverNoteLoader
-            return EverNoteLoader
-        elif name == "XlsLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.XlsLoader import XlsLoader
-            return XlsLoader
-        elif name == "XlsxLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.load_text.XlsxLoader import XlsxLoader
-            return XlsxLoader
-        elif name == "UnstructuredFileLoader":
-            from domain.kb_domain.serv.DocLoad.DocLoadImp.UnstructuredFileLoader import UnstructuredFileLoader
-            return UnstructuredFileLoader
-        else:
-            raise ValueError(f"未知 Loader 名称: {name}")
+        return cls._get_constructor(name)[0]
+
+    @classmethod
+    def _get_constructor(cls, name: str) -> Tuple[Type[BaseLoader], frozenset, str]:
+        constructor = cls._constructors.get(name)
+        if constructor is None:
+            module = cls._LOADER_MODULES.get(name)
+            if module is None:
+                raise ValueError(f"未知 Loader 名称: {name}")
+            loader_cls = getattr(importlib.import_module(module), name)
+            valid_params = frozenset(inspect.signature(loader_cls.__init__).parameters.keys())
+            # 文件路径兼容 file_path / filepath / path
+            path_param = next((p for p in ('file_path', 'filepath') if p in valid_params), 'path')
+            constructor = cls._constructors[name] = (loader_cls, valid_params, path_param)
+        return constructor
 
     @classmethod
     def _create_loader(cls, loader_name: str, filepath: str, **kwargs) -> BaseLoader:
         """
         根据 Loader 名称创建实例，自动匹配 __init__ 参数
         """
-        loader_cls = cls._get_loader_class(loader_name)
-        sig = inspect.signature(loader_cls.__init__)
-        valid_params = sig.parameters.keys()
-
+        loader_cls, valid_params, path_param = cls._get_constructor(loader_name)
         filtered_args = {k: v for k, v in kwargs.items() if k in valid_params}
-
-        # 文件路径兼容 file_path / filepath / path
-        if "file_path" in valid_params:
-            filtered_args["file_path"] = filepath
-        elif "filepath" in valid_params:
-            filtered_args["filepath"] = filepath
-        else:
-            filtered_args["path"] = filepath
-
+        filtered_args[path_param] = filepath
         return loader_cls(**filtered_args)
 
     @classmethod
-    def from_file(cls, filepath: str, **kwargs) -> BaseLoader:
+    def get_loader_names(cls, filepath: str) -> Tuple[str, List[str]]:
+        """
+        按尝试顺序返回文件可用的 Loader
+
+        Returns:
+            (格式, Loader 名称列表)：格式为文件头识别出的扩展名
+        """
+        fmt = detect_format(filepath)
         ext = os.path.splitext(filepath)[1].lower()
-        loader_names = cls.LOADER_MAP.get(ext, ["UnstructuredFileLoader"])
+        if fmt != ext:
+            logging.debug(f"文件 {filepath} 按文件头识别为 {fmt}")
+        loader_names = cls._ordered(fmt, cls.LOADER_MAP.get(fmt, ["UnstructuredFileLoader"]))
+        probe = cls._PROBES.get(fmt)
+        if probe is not None:
+            preferred = [name for name in probe(filepath) if name in loader_names]
+            if preferred:
+                logging.debug(f"文件 {filepath} 优先使用 {preferred}")
+                loader_names = preferred + [name for name in loader_names if name not in preferred]
+        return fmt, loader_names
+
+    @classmethod
+    def _ordered(cls, fmt: str, loader_names: List[str]) -> List[str]:
+        """
+        尝试次数足够时按 成功率 / 平均耗时 从大到小排序（期望总耗时最小），否则保持规则中的顺序；
+        成功率过低的 Loader 移到最后
+        """
+        if len(loader_names) < 2:
+            return loader_names
+        with cls._lock:
+            stats = [dict(cls._stats.get((fmt, name), {'attempts': 0, 'success': 0, 'seconds': 0.0}))
+                     for name in loader_names]
+        sampled = [s['attempts'] >= ADAPT_MIN_ATTEMPTS for s in stats]
+        order = list(range(len(loader_names)))
+        if all(sampled):
+            order.sort(key=lambda i: -stats[i]['success'] / max(stats[i]['seconds'], 1e-3))
+        order.sort(key=lambda i: sampled[i] and stats[i]['success'] / stats[i]['attempts'] < ADAPT_SKIP_RATE)
+        return [loader_names[i] for i in order]
+
+    @classmethod
+    def from_file(cls, filepath: str, attempts: Optional[list] = None, **kwargs) -> BaseLoader:
+        """
+        依次尝试可用的 Loader，返回第一个读取成功的 Loader（已执行 load，结果在 loader.rtn 中）
+
+        Args:
+            filepath: 文件路径
+            attempts: 不为 None 时追加本次的尝试记录 (格式, Loader, 是否成功, 耗时)，用于在其他进程中 record
+        """
+        fmt, loader_names = cls.get_loader_names(filepath)
 
         for loader_name in loader_names:
-            loader = cls._create_loader(loader_name, filepath, **kwargs)
+            started = time.perf_counter()
+            success = False
             try:
+                loader = cls._create_loader(loader_name, filepath, **kwargs)
                 rtn = loader.load()
-                if rtn['load_status']:  # 判断是否有内容
+                success = bool(rtn['load_status'])  # 判断是否有内容
+                if success:
                     logging.debug(f"✅ 使用 {loader_name} 成功读取 {filepath}")
                     return loader
                 else:
                     logging.debug(f"❌ 使用 {loader_name} 读取 {filepath}失败：{rtn['file_content']}")
             except Exception as e:
                 logging.debug(f"⚠️ {loader_name} 读取失败: {e}")
+            finally:
+                attempt = (fmt, loader_name, success, time.perf_counter() - started)
+                cls.record([attempt])
+                if attempts is not None:
+                    attempts.append(attempt)
 
         raise Exception(f"❌ 所有 Loader 均失败")
+
+    # -----------------------------
+    # 尝试统计
+    # -----------------------------
+    @classmethod
+    def record(cls, attempts: List[Tuple[str, str, bool, float]]):
+        """
+        记录 Loader 尝试结果 (格式, Loader, 是否成功, 耗时)
+        """
+        with cls._lock:
+            for fmt, loader_name, success, seconds in attempts:
+                stats = cls._stats.setdefault((fmt, loader_name), {'attempts': 0, 'success': 0, 'seconds': 0.0})
+                stats['attempts'] += 1
+                stats['success'] += 1 if success else 0
+                stats['seconds'] += seconds
+
+    @classmethod
+    def snapshot_stats(cls) -> Dict[Tuple[str, str], Dict[str, float]]:
+        with cls._lock:
+            return {key: dict(stats) for key, stats in cls._stats.items()}
+
+    @classmethod
+    def load_stats(cls, stats: Dict[Tuple[str, str], Dict[str, float]]):
+        """
+        使用其他进程的统计（解析子进程使用主进程汇总的统计排序）
+        """
+        with cls._lock:
+            cls._stats = {key: dict(value) for key, value in stats.items()}
+
+    @classmethod
+    def get_stats(cls) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            [{'format', 'loader', 'attempts', 'success', 'success_rate', 'avg_seconds'}]
+        """
+        return [{'format': fmt, 'loader': loader_name, 'attempts': int(stats['attempts']),
+                 'success': int(stats['success']), 'success_rate': round(stats['success'] / stats['attempts'], 3),
+                 'avg_seconds': round(stats['seconds'] / stats['attempts'], 3)}
+                for (fmt, loader_name), stats in sorted(cls.snapshot_stats().items())]
@@ -1,15 +1,65 @@
-import client_global
+# 文档加载：解析、清理、分片在解析子进程中执行（parse_doc），编码由向量化服务合并多个文档成批推理，写入由调用方完成。
+# 本模块会在解析子进程中导入，模块级不能导入数据库（database.sys_duckdb 导入时即连接数据库并启动写入队列），
+# 用到数据库的 DAO、向量化服务在函数中导入
+from domain.kb_domain.serv.DocLoad.DocLoadImp.BaseLoader import BLOCK_PAGE, BLOCK_SLIDE, BLOCK_TEXT, make_block
 from domain.kb_domain.serv.DocLoad.LoaderFactory import LoaderFactory
+from domain.kb_domain.serv.VectorModel.VectorLoader import get_chunk_tokenizer, load_config
 
+import atexit
+import bisect
+import client_global
+import json
 import logging
+import math
+import multiprocessing
 import numpy as np
-from typing import List
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 import re
 import gc
 import sys
+import zlib
+
+# 入库时立即向量化的分片数，文档加载后即可检索；其余分片由后台任务以低优先级补齐
+INITIAL_CHUNK_CNT = 100
+# 后台补齐时每次向量化的分片数
+BACKFILL_BATCH = 200
+# 解析子进程数上限（加载器中的 OCR、XML 解析占用 CPU 且持有 GIL），0 表示不使用子进程，在调用线程中解析
+PARSE_WORKERS = 4
+# 按 token 数分片时优先切分的位置：段落结尾、句子结尾
+_PARAGRAPH_END = '\n'
+_SENTENCE_END = '.!?。！？;；'
+# 按内容分片（cdc）：候选切分位置之前 CDC_WINDOW 个字符的哈希低位全为 0 时切分（每个候选位置切分的概率为 1/(CDC_MASK+1)），
+# 切分位置只由附近的内容决定，文档中插入或删除内容后，之后的分片边界很快与修改前重新对齐
+CDC_WINDOW = 64
+CDC_MASK = 3
+_PARAGRAPH_RE = re.compile('\n')
+_SENTENCE_RE = re.compile('[' + re.escape(_SENTENCE_END) + ']')
+# 入库前清理：文档至少有 BOILERPLATE_MIN_PAGES 页（加载器返回的页、幻灯片，或内容块中以换页符分隔的页）时，
+# 出现在 BOILERPLATE_PAGE_RATIO 以上页面中的行视为页眉、页脚、页码、免责声明，从内容中删除（比较时忽略空白）；
+# 只有页面首行、末行中不超过 PAGE_NUMBER_MAX_CHARS 个字符的页码行（如“第 3 页”、“- 3 -”）比较时数字视为相同，
+# 其他行必须完全相同且不短于 BOILERPLATE_MIN_CHARS 个字符（表格中的金额、条款编号、日期不会被误删）
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_PAGE_RATIO = 0.5
+BOILERPLATE_MIN_CHARS = 5
+PAGE_NUMBER_MAX_CHARS = 16
+# 分片 3 个字符片段集合的 Jaccard 相似度（MinHash 估计）不低于 MINHASH_THRESHOLD 时视为近似重复，只保留第一个；
+# 短于 MINHASH_MIN_LENGTH 的分片只去除完全相同的
+MINHASH_SIZE = 64
+MINHASH_BAND = 4
+MINHASH_THRESHOLD = 0.8
+MINHASH_MIN_LENGTH = 32
+_SPACES_RE = re.compile('[ \t\u3000\xa0]+')
+_DIGITS_RE = re.compile('[0-9０-９]+')
+# 页码行（已去掉空白）：3、- 3 -、第 3 页、第 3 页 共 10 页、3 / 10、Page 3 of 10
+_PAGE_NUMBER_RE = re.compile(r'[-—–_·|\[(（【<]*(?:第|page|p\.?)?[0-9０-９]{1,4}页?'
+                             r'(?:(?:/|of|共)[0-9０-９]{1,4}页?)?[-—–_·|\])）】>]*', re.IGNORECASE)
 
 # 文件加载并进行切片及向量化
-def load_doc(document, max_chunk_cnt= 100):
+def load_doc(document, max_chunk_cnt=INITIAL_CHUNK_CNT):
     """
     文件加载、分片、向量化处理
 
@@ -17,40 +67,85 @@ def load_doc(document, max_chunk_cnt= 100):
         document: 文档字典对象
 
     Returns:
-        document: 处理后的文档字典对象
+        document: 处理后的文档字典对象，file_content_spans、file_content_positions、file_content_chunks、
+                  file_content_chunks_vector 为分片位置、分片所在的页/幻灯片/工作表/章节、分片及其向量
         :param max_chunk_cnt:
     """
-    try:
-        loader = LoaderFactory.from_file(document['location_path'])
-        if loader.rtn['load_status']:
-            # 读取成功，合成内容
-            content = '\n'.join(loader.rtn['file_content'])
-            document['file_content'] = content
+    document, future = start_load_doc(document, max_chunk_cnt)
+    return finish_load_doc(document, future)
 
-            # 获取文件大小（用于动态调整策略）
-            content_length = len(content)
 
-            # 智能分片
-            file_content_chunks = doc_spliter(content, content_length)
-            logging.debug(f"文件 {document['location_path']} 开始向量化")
-            # 批量向量化分片内容
-            file_content_chunks_vector = client_global.embedding_model.encode(file_content_chunks[0:max_chunk_cnt])
-
-            # 文件名向量化
-            file_name_vector = client_global.embedding_model.encode(
-                document['file_name']
-            )
-            logging.debug(f"✅ 文件 {document['location_path']} 向量化完成")
-            # 写入内容
-            document['file_name_vector'] = file_name_vector
-            document['file_content_chunks'] = file_content_chunks
-            document['file_content_chunks_vector'] = file_content_chunks_vector
-            document['kb_load_state'] = '完成'
+def parse_doc(location_path: str, loader_stats=None) -> Dict[str, Any]:
+    """
+    读取文件并合成内容、分片（不访问数据库，可以在解析子进程中执行）
+
+    Args:
+        location_path: 文件路径
+        loader_stats: 主进程的 Loader 尝试统计（LoaderFactory.snapshot_stats），子进程按它调整 Loader 顺序
 
-            # 清理内存
-            del file_content_chunks_vector
-            gc.collect()
+    Returns:
+        {'load_status': 是否读取成功, 'file_content': 清理后的内容, 'cleanup': 清理统计,
+         'spans': 分片位置, 'positions': 分片所在内容块, 'parse_seconds': 解析耗时,
+         'loader_attempts': Loader 尝试记录，由主进程汇总（所有 Loader 均失败时随异常返回）}
+    """
+    started = time.perf_counter()
+    if loader_stats is not None:
+        LoaderFactory.load_stats(loader_stats)
+    attempts = []
+    try:
+        loader = LoaderFactory.from_file(location_path, attempts=attempts)
+    except Exception as e:
+        e.loader_attempts = attempts
+        raise
+    if not loader.rtn['load_status']:
+        return {'load_status': False, 'parse_seconds': time.perf_counter() - started, 'loader_attempts': attempts}
+    # 读取成功，合成内容：统一空白，删除各页重复的页眉、页脚等
+    content, cleanup, block_ranges = clean_content(loader.rtn['blocks'])
+
+    # 智能分片：分片不跨越内容块（页、幻灯片、工作表、章节）；入库时只保存分片在 file_content 中的位置和所在内容块，
+    # 分片文本只用于编码和建立词项索引；近似重复的分片不编码、不入库
+    spans = doc_spans(content, len(content), blocks=[(start, end) for start, end, _ in block_ranges])
+    spans, duplicate = drop_duplicate_spans(content, spans)
+    cleanup.update(duplicate)
+    return {'load_status': True, 'file_content': content, 'cleanup': cleanup, 'spans': spans,
+            'positions': chunk_positions(spans, block_ranges), 'parse_seconds': time.perf_counter() - started,
+            'loader_attempts': attempts}
+
+
+def start_load_doc(document, max_chunk_cnt=INITIAL_CHUNK_CNT, parsed: Optional[Dict[str, Any]] = None):
+    """
+    文件加载、分片，并向向量化服务提交编码请求（不等待结果），调用方可以继续解析下一个文件
 
+    Args:
+        document: 文档字典对象
+        max_chunk_cnt: 立即向量化的分片数
+        parsed: 解析子进程返回的 parse_doc 结果（submit_parse），为 None 时在当前线程中解析
+
+    Returns:
+        (document, future)：future 为 (分片编码结果, 文件名编码结果)，加载失败时为 None，document['kb_load_state'] 已设置
+    """
+    from domain.kb_domain.serv import EmbeddingServ
+
+    try:
+        if parsed is None:
+            parsed = parse_doc(document['location_path'])
+        if parsed['load_status']:
+            content = parsed['file_content']
+            spans = parsed['spans']
+            document['file_content'] = content
+            _set_cleanup_attrs(document, parsed['cleanup'])
+            logging.debug(f"文件 {document['location_path']} 入库前清理: {parsed['cleanup']}")
+            file_content_chunks = [content[start:end] for start, end in spans]
+            document['file_content_spans'] = spans
+            document['file_content_positions'] = parsed['positions']
+            document['file_content_chunks'] = file_content_chunks
+            logging.debug(f"文件 {document['location_path']} 开始向量化")
+            # 分片内容和文件名一起向量化（按 token 长度分批，文件名不会被补齐到分片长度），单位化后入库，检索时只需计算内积；
+            # 分片向量按内容缓存，文档修改后未变化的分片直接复用；超过 max_chunk_cnt 的分片向量为 NULL，由 backfill_doc_chunks 补齐
+            chunk_cnt = min(len(file_content_chunks), max_chunk_cnt)
+            future = (EmbeddingServ.submit_cached(file_content_chunks[0:chunk_cnt]),
+                      EmbeddingServ.submit(document['file_name'], normalize=True))
+            return document, future
         else:
             document['kb_load_state'] = '加载失败'
 
@@ -58,65 +153,378 @@ def load_doc(document, max_chunk_cnt= 100):
         logging.error(f"向量化错误: {e}", exc_info=True)
         document['kb_load_state'] = '不支持'
 
+    return document, None
+
+
+# -----------------------------
+# 解析子进程池
+# -----------------------------
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_model = None
+_parse_pool_lock = threading.Lock()
+
+
+def submit_parse(location_path: str) -> Future:
+    """
+    在解析子进程中执行 parse_doc，返回 Future；子进程池不可用（PARSE_WORKERS 为 0 或启动失败）时在当前线程中解析，
+    解析异常由 Future.result() 抛出
+    """
+    pool = _get_parse_pool()
+    if pool is not None:
+        try:
+            future = pool.submit(parse_doc, location_path, LoaderFactory.snapshot_stats())
+            future.add_done_callback(_record_loader_attempts)
+            return future
+        except Exception as e:
+            # 子进程异常退出后进程池不可再用，下次重新创建
+            logging.error(f"解析子进程池不可用，在当前线程中解析: {e}")
+            shutdown_parse_pool()
+    future = Future()
+    try:
+        future.set_result(parse_doc(location_path))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def _record_loader_attempts(future: Future):
+    # 子进程中的 Loader 尝试记录汇总到主进程（在当前线程中解析时 from_file 已记录）
+    if future.cancelled():
+        return
+    error = future.exception()
+    attempts = getattr(error, 'loader_attempts', None) if error is not None else future.result().get('loader_attempts')
+    if attempts:
+        LoaderFactory.record(attempts)
+
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def _get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    global _parse_pool, _parse_pool_model
+    if PARSE_WORKERS <= 0:
+        return None
+    with _parse_pool_lock:
+        # 切换向量模型后分片用的分词器不同，重新创建子进程
+        if _parse_pool is not None and _parse_pool_model != client_global.model_name_or_path:
+            _parse_pool.shutdown(wait=True)
+            _parse_pool = None
+        if _parse_pool is None:
+            workers = max(1, min(PARSE_WORKERS, (os.cpu_count() or 1) - 1))
+            try:
+                _parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=_init_parse_worker,
+                                                  initargs=(client_global.model_name_or_path,))
+                _parse_pool_model = client_global.model_name_or_path
+            except Exception as e:
+                logging.error(f"解析子进程池启动失败，在当前线程中解析: {e}")
+                return None
+        return _parse_pool
+
+
+def _init_parse_worker(model_name_or_path):
+    # 子进程中按 token 分片使用与主进程相同的模型分词器
+    client_global.model_name_or_path = model_name_or_path
+
+
+atexit.register(shutdown_parse_pool)
+
+
+def finish_load_doc(document, future):
+    """
+    等待编码结果，写入分片向量和文件名向量
+
+    Returns:
+        document: file_content_spans、file_content_positions、file_content_chunks、file_content_chunks_vector
+                  为分片位置、分片所在内容块、分片及其向量
+    """
+    if future is None:
+        return document
+    try:
+        chunk_future, name_future = future
+        file_content_chunks_vector = chunk_future.result()
+        file_name_vector = name_future.result()[0]
+        logging.debug(f"✅ 文件 {document['location_path']} 向量化完成")
+        # 写入内容，分片及分片向量由调用方写入 document_chunk 表
+        document['file_name_vector'] = file_name_vector.tolist()
+        document['file_content_chunks_vector'] = file_content_chunks_vector
+        if client_global.embedding_model_name:
+            document['embedding_model'] = client_global.embedding_model_name
+        document['kb_load_state'] = '完成'
+
+        # 清理内存
+        gc.collect()
+
+    except Exception as e:
+        logging.error(f"向量化错误: {e}", exc_info=True)
+        document.pop('file_content_chunks', None)
+        document.pop('file_content_spans', None)
+        document.pop('file_content_positions', None)
+        document['kb_load_state'] = '不支持'
+
     return document
 
 
-def batch_vectorize_chunks(chunks: List[str], model, batch_size=32):
+def backfill_doc_chunks(document_id, batch_size=BACKFILL_BATCH):
     """
-    批量向量化文本片段，避免内存溢出
+    为文档补齐一批未向量化的分片（低优先级编码，不影响检索和新文档加载），并更新向量索引
+
+    Returns:
+        {'chunk_cnt': 分片数, 'vector_cnt': 已向量化的分片数}
+    """
+    from domain.kb_domain.dao import DocumentChunkDao
+    from domain.kb_domain.serv import EmbeddingServ, VectorIndexServ
+
+    rows = DocumentChunkDao.get_unvectorized_chunks(document_id, batch_size)
+    if rows:
+        vectors = EmbeddingServ.submit_cached([row['chunk_text'] or '' for row in rows],
+                                              priority=EmbeddingServ.PRIORITY_BACKFILL).result()
+        DocumentChunkDao.update_vectors(document_id, [row['chunk_index'] for row in rows], vectors)
+        VectorIndexServ.on_doc_backfilled(document_id)
+    progress = DocumentChunkDao.get_vector_progress(document_id)
+    logging.debug(f"文档 {document_id} 分片向量补齐 {progress['vector_cnt']}/{progress['chunk_cnt']}")
+    return progress
+
+
+# -----------------------------
+# 入库前清理
+# -----------------------------
+def clean_content(blocks: List[Any]) -> Tuple[str, Dict[str, int], List[Tuple[int, int, Dict[str, Any]]]]:
+    """
+    合成文档内容：每行合并连续空白、去掉行尾空白（保留行首缩进），连续多个空行只保留一个；
+    页数足够时删除在多数页面中重复出现的行（页眉、页脚、页码、免责声明）
 
     Args:
-        chunks: 文本片段列表
-        model: 向量化模型
-        batch_size: 每批处理的数量
+        blocks: 加载器返回的内容块（BaseLoader.make_block，纯文本视为 text 类型的内容块）；
+                页、幻灯片，以及内容块中以换页符分隔的部分参与重复行统计
 
     Returns:
-        向量化结果的numpy数组
+        (清理后的内容, {'original_chars': 原始字符数, 'boilerplate_lines': 删除的重复行数,
+                        'boilerplate_chars': 删除的重复行字符数, 'whitespace_chars': 删除的空白字符数},
+         各内容块在清理后内容中的位置 [(start, end, {'type': 类型, 页码等位置})]，清理后为空的内容块不返回)
+    """
+    blocks = [block if isinstance(block, dict) else make_block(block) for block in blocks]
+    original = '\n'.join(block['text'] for block in blocks)
+    block_pages = [[[_normalize_line(line) for line in page.split('\n')] for page in block['text'].split('\f')]
+                   for block in blocks]
+
+    boilerplate = set()
+    pages = [lines for block, parts in zip(blocks, block_pages)
+             if block['type'] in (BLOCK_PAGE, BLOCK_SLIDE) or len(parts) > 1 for lines in parts]
+    if len(pages) >= BOILERPLATE_MIN_PAGES:
+        page_cnts: Dict[str, int] = {}
+        for lines in pages:
+            for key in set(_line_keys(lines)) - {None}:
+                page_cnts[key] = page_cnts.get(key, 0) + 1
+        threshold = max(BOILERPLATE_MIN_PAGES, math.ceil(len(pages) * BOILERPLATE_PAGE_RATIO))
+        boilerplate = {key for key, cnt in page_cnts.items() if cnt >= threshold}
+
+    kept = []
+    ranges = []
+    pos = 0  # kept 合并后的长度
+    removed_lines = removed_chars = 0
+    for block, parts in zip(blocks, block_pages):
+        block_start = block_end = None
+        for lines in parts:
+            keys = _line_keys(lines) if boilerplate else [None] * len(lines)
+            for line, key in zip(lines, keys):
+                if key is not None and key in boilerplate:
+                    removed_lines += 1
+                    removed_chars += len(line)
+                    continue
+                # 连续空行只保留一个（保留段落分隔）
+                if line or (kept and kept[-1]):
+                    start = pos + 1 if kept else 0
+                    kept.append(line)
+                    pos = start + len(line)
+                    if line:
+                        block_start = start if block_start is None else block_start
+                        block_end = pos
+        if block_start is not None:
+            ranges.append((block_start, block_end, {'type': block['type'], **block['position']}))
+    joined = '\n'.join(kept)
+    content = joined.strip()
+    # 去掉开头的空白（首行缩进）后位置前移
+    lead = len(joined) - len(joined.lstrip())
+    ranges = [(max(0, start - lead), max(0, end - lead), position) for start, end, position in ranges]
+    stats = {'original_chars': len(original), 'boilerplate_lines': removed_lines, 'boilerplate_chars': removed_chars,
+             'whitespace_chars': len(original) - len(content) - removed_chars}
+    return content, stats, ranges
+
+
+def _normalize_line(line: str) -> str:
+    content = line.lstrip(' \t')
+    if not content.strip():
+        return ''
+    return line[:len(line) - len(content)] + _SPACES_RE.sub(' ', content).rstrip()
+
+
+def _line_keys(lines: List[str]) -> List[Optional[str]]:
     """
-    if not chunks:
-        return np.array([])
+    各行比较重复时使用的键（忽略空白）：页面首行、末行中的页码行数字视为相同，
+    其他过短的行不参与比较（键为 None）
+    """
+    filled = [i for i, line in enumerate(lines) if line]
+    edges = {filled[0], filled[-1]} if filled else set()
+    keys = []
+    for i, line in enumerate(lines):
+        key = _SPACES_RE.sub('', line)
+        if i in edges and len(key) <= PAGE_NUMBER_MAX_CHARS and _PAGE_NUMBER_RE.fullmatch(key):
+            keys.append('\0' + _DIGITS_RE.sub('#', key))
+        elif len(key) >= BOILERPLATE_MIN_CHARS:
+            keys.append(key)
+        else:
+            keys.append(None)
+    return keys
 
-    embeddings_list = []
-    total_batches = (len(chunks) + batch_size - 1) // batch_size
 
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i + batch_size]
+def drop_duplicate_spans(text: str, spans: List[Tuple[int, int]]) -> Tuple[List[Tuple[int, int]], Dict[str, int]]:
+    """
+    去掉与前面分片完全相同或近似（MinHash 估计的 Jaccard 相似度不低于 MINHASH_THRESHOLD）的分片。
+    MinHash 的 64 个值每 MINHASH_BAND 个一段建立桶，近似分片至少有一段完全相同的概率很高，只需与同一个桶中的分片比较
 
-        try:
-            # 向量化当前批次
-            batch_embeddings = model.encode(
-                batch,
-                batch_size=min(batch_size, len(batch))
-            )
-            embeddings_list.append(batch_embeddings)
+    Returns:
+        (保留的分片位置, {'duplicate_chunks': 去掉的分片数, 'duplicate_chars': 去掉的分片字符数})
+    """
+    shingles = _shingle_hashes(text)
+    kept = []
+    seen = set()
+    sketches = []
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    removed_cnt = removed_chars = 0
+    for start, end in spans:
+        chunk = text[start:end]
+        duplicate = chunk in seen
+        if not duplicate:
+            seen.add(chunk)
+            if end - start >= MINHASH_MIN_LENGTH:
+                sketch = minhash(shingles[start:end - 2])
+                bands = [(i, sketch[i:i + MINHASH_BAND].tobytes()) for i in range(0, MINHASH_SIZE, MINHASH_BAND)]
+                candidates = {other for band in bands for other in buckets.get(band, ())}
+                duplicate = any(np.count_nonzero(sketches[other] == sketch) >= MINHASH_THRESHOLD * MINHASH_SIZE
+                                for other in candidates)
+                if not duplicate:
+                    for band in bands:
+                        buckets.setdefault(band, []).append(len(sketches))
+                    sketches.append(sketch)
+        if duplicate:
+            removed_cnt += 1
+            removed_chars += end - start
+        else:
+            kept.append((start, end))
+    return kept, {'duplicate_chunks': removed_cnt, 'duplicate_chars': removed_chars}
 
-            # 每处理10个批次清理一次内存
-            if (i // batch_size) % 10 == 0 and i > 0:
-                gc.collect()
 
-        except Exception as e:
-            logging.error(f"批次 {i // batch_size} 向量化失败: {e}")
-            # 失败时用零向量填充
-            batch_embeddings = np.zeros((len(batch), model.get_sentence_embedding_dimension()))
-            embeddings_list.append(batch_embeddings)
+def _shingle_hashes(text: str) -> np.ndarray:
+    # 每 3 个连续字符（第 i 个位置开始）的 64 位哈希（与进程无关）
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    hashes = codes[:-2] * np.uint64(0x9E3779B97F4A7C15) + codes[1:-1] * np.uint64(0xC2B2AE3D27D4EB4F) + codes[2:]
+    # splitmix64 混合
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    return hashes
+
+
+def minhash(shingles: np.ndarray) -> np.ndarray:
+    """
+    单次哈希的 MinHash（one permutation hashing）：按哈希的高 6 位分为 MINHASH_SIZE 个区间，取每个区间的最小值，
+    两个分片相同位置的值相等的比例即 Jaccard 相似度的估计
+    """
+    values = np.sort(shingles)
+    bins = (values >> np.uint64(58)).astype(np.int64)
+    # 排序后每个区间的第一个值即区间最小值
+    first = np.flatnonzero(np.diff(bins, prepend=-1))
+    sketch = np.full(MINHASH_SIZE, np.iinfo(np.uint64).max, dtype=np.uint64)
+    sketch[bins[first]] = values[first]
+    return sketch
 
-    # 合并所有批次的结果
-    return np.vstack(embeddings_list)
 
+def _set_cleanup_attrs(document, cleanup: Dict[str, Any]):
+    # 清理统计保存在 document.extend_attrs 的 cleanup 中
+    try:
+        attrs = json.loads(document.get('extend_attrs') or '{}')
+    except (TypeError, ValueError):
+        attrs = {}
+    attrs['cleanup'] = cleanup
+    document['extend_attrs'] = json.dumps(attrs, ensure_ascii=False)
+
+
+def chunk_positions(spans: List[Tuple[int, int]], block_ranges: List[Tuple[int, int, Dict[str, Any]]]) \
+        -> List[Optional[str]]:
+    """
+    分片所在内容块的位置（JSON，如 {"type": "page", "page": 3}），写入 document_chunk.chunk_position；
+    分片不跨越内容块，按分片开始位置查找；没有结构的纯文本为 None
+    """
+    starts = [start for start, _, _ in block_ranges]
+    positions = []
+    for start, _ in spans:
+        i = bisect.bisect_right(starts, start) - 1
+        position = block_ranges[i][2] if i >= 0 else None
+        if position is None or (position['type'] == BLOCK_TEXT and len(position) == 1):
+            positions.append(None)
+        else:
+            positions.append(json.dumps(position, ensure_ascii=False))
+    return positions
+
+
+def doc_spliter(text: str, text_length: int = None, mode: str = None,
+                blocks: List[Tuple[int, int]] = None) -> List[str]:
+    """
+    智能文档分片，返回分片文本（见 doc_spans）
+    """
+    return [text[start:end] for start, end in doc_spans(text, text_length, mode, blocks)]
 
-def doc_spliter(text: str, text_length: int = None) -> List[str]:
+
+def doc_spans(text: str, text_length: int = None, mode: str = None,
+              blocks: List[Tuple[int, int]] = None) -> List[Tuple[int, int]]:
     """
-    智能文档分片，根据文档大小动态调整策略
+    智能文档分片，根据文档大小动态调整策略。分片以原文中的位置 (start, end) 表示，不复制文本，
+    入库时只保存位置，检索时再从 document.file_content 中截取
 
     Args:
         text: 输入的长文档文本
         text_length: 文本长度（可选，用于优化性能）
+        mode: 分片方式 chars / tokens / cdc，默认使用配置中的 chunk_mode
+        blocks: 内容块在原文中的位置 [(start, end)]（见 clean_content），分片不跨越内容块；
+                按字符数分片时分档仍按整个文档的大小，分片数上限按内容块所占比例分配
 
     Returns:
-        分割后的文本片段列表
+        分片在原文中的位置列表 [(start, end)]
     """
     if text_length is None:
         text_length = len(text)
+    if blocks is None:
+        return _text_spans(text, text_length, text_length, mode, 1.0)
+
+    spans = []
+    for block_start, block_end in blocks:
+        block_spans = _text_spans(text[block_start:block_end], text_length, block_end - block_start, mode,
+                                  (block_end - block_start) / max(text_length, 1))
+        spans.extend((block_start + start, block_start + end) for start, end in block_spans if start < end)
+    return spans
+
+
+def _text_spans(text: str, text_length: int, block_length: int, mode: Optional[str],
+                share: float) -> List[Tuple[int, int]]:
+    # 对一段文本（整个文档或一个内容块）分片，text_length 为整个文档的长度
+    # 按 token 数分片（分词器不可用时仍按字符数分片）
+    config = load_config()
+    mode = mode or config['chunk_mode']
+    if mode == 'tokens':
+        tokenizer = get_chunk_tokenizer()
+        if tokenizer is not None:
+            return token_spans(text, tokenizer, config['chunk_tokens'], config['chunk_overlap_tokens'])
+    # 按内容分片，分片大小不随文档大小变化（否则文档大小跨过分档时全部分片都会改变）
+    if mode == 'cdc':
+        return cdc_spans(text, config['cdc_min_length'], config['cdc_max_length'], config['cdc_overlap'])
 
     # 根据文档大小动态调整参数
     if text_length < 5000:  # 小文档 (<5KB)
@@ -140,246 +548,276 @@ def doc_spliter(text: str, text_length: int = None) -> List[str]:
         overlap = 200
         max_chunks = 800
 
+    max_chunks = max(1, math.ceil(max_chunks * share))
+
     # 如果文本很短，直接返回
-    if text_length <= max_length:
-        return [text]
+    if block_length <= max_length:
+        return [(0, block_length)]
 
     # 按段落优先分片
-    chunks = split_by_paragraphs(text, max_length, overlap)
+    spans = split_by_paragraphs(text, max_length, overlap)
 
     # 如果分片数量过多，进行二次优化
-    if len(chunks) > max_chunks:
-        chunks = optimize_chunks(chunks, max_chunks, max_length * 1.5)
+    if len(spans) > max_chunks:
+        spans = optimize_chunks(spans, max_chunks, max_length * 1.5)
 
-    return chunks
+    return spans
 
 
-def split_by_paragraphs(text: str, max_length: int, overlap: int) -> List[str]:
+def token_spans(text: str, tokenizer, max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
     """
-    基于段落的智能分片
+    按 token 数分片：用向量模型的分词器得到每个 token 在原文中的位置，每个分片不超过 max_tokens 个 token，
+    优先在分片后半段的段落结尾、其次句子结尾处切分，相邻分片重叠 overlap 个 token
 
     Args:
         text: 输入文本
-        max_length: 每个片段的最大长度
-        overlap: 片段之间的重叠长度
+        tokenizer: get_chunk_tokenizer() 返回的分词器
+        max_tokens: 每个分片的 token 数上限（不含 [CLS]、[SEP]）
+        overlap: 重叠的 token 数
 
     Returns:
-        分割后的文本片段列表
+        分片在原文中的位置列表 [(start, end)]
     """
-    # 按段落分割（优先双换行，其次单换行）
-    paragraphs = text.split('\n\n')
-    if len(paragraphs) <= 1:
-        paragraphs = text.split('\n')
-
-    # 过滤空段落
-    paragraphs = [p.strip() for p in paragraphs if p.strip()]
-
-    if not paragraphs:
-        return [text]
-
-    chunks = []
-    current_chunk = ""
-
-    for para in paragraphs:
-        # 如果单个段落就超长，需要切分
-        if len(para) > max_length:
-            # 先保存当前累积的chunk
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-                current_chunk = ""
-
-            # 切分超长段落
-            sub_chunks = split_long_paragraph(para, max_length, overlap)
-            chunks.extend(sub_chunks)
-
-        # 如果加上当前段落会超长
-        elif len(current_chunk) + len(para) + 2 > max_length:  # +2 for \n\n
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = para
-
-        # 否则累积到当前chunk
-        else:
-            if current_chunk:
-                current_chunk += "\n\n" + para
-            else:
-                current_chunk = para
+    offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+    token_cnt = len(offsets)
+    if token_cnt <= max_tokens:
+        return [(0, len(text))]
 
-    # 保存最后一个chunk
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-
-    # 添加重叠
-    if overlap > 0 and len(chunks) > 1:
-        chunks = add_overlap(chunks, overlap)
+    spans = []
+    start = 0
+    while start < token_cnt:
+        end = min(start + max_tokens, token_cnt)
+        if end < token_cnt:
+            end = find_token_boundary(text, offsets, start, end)
+        span = _strip_span(text, offsets[start][0], offsets[end - 1][1])
+        if span[0] < span[1]:
+            spans.append(span)
+        if end >= token_cnt:
+            break
+        start = max(end - overlap, start + 1)
+    return spans
+
+
+def find_token_boundary(text: str, offsets, start: int, end: int) -> int:
+    """
+    在 [start, end) 的后半段从后向前查找段落结尾，找不到时查找句子结尾，都没有时在 end 处切分
 
-    return chunks
+    Returns:
+        分片结束的 token 下标（不含）
+    """
+    lowest = start + (end - start) // 2
+    for is_boundary in (lambda pos: text[pos:pos + 1] == _PARAGRAPH_END,
+                        lambda pos: text[pos - 1] in _SENTENCE_END):
+        for i in range(end, lowest, -1):
+            if is_boundary(offsets[i - 1][1]):
+                return i
+    return end
 
 
-def split_long_paragraph(para: str, max_length: int, overlap: int) -> List[str]:
+def cdc_spans(text: str, min_length: int, max_length: int, overlap: int) -> List[Tuple[int, int]]:
     """
-    切分超长段落（按句子）
+    按内容分片（content-defined chunking）：在分片的 [min_length, max_length] 范围内依次检查段落结尾、句子结尾，
+    取第一个满足 is_cdc_boundary 的位置切分；都不满足时退回到范围内最后一个段落结尾、句子结尾，仍没有时按字符强制切分。
+    切分只看位置之前的内容，修改文档某处后，其后的分片边界会在一两个分片内与修改前重新对齐，未修改部分的分片文本不变
 
     Args:
-        para: 超长段落
-        max_length: 最大长度
-        overlap: 重叠长度
+        text: 输入文本
+        min_length: 分片最短字符数
+        max_length: 分片最长字符数
+        overlap: 分片向前延伸到包含前一个分片末尾的字符数
 
     Returns:
-        切分后的片段列表
-    """
-    # 按句子分割，保留标点
-    sentences = re.split(r'([.!?。！？;；]+)', para)
-
-    # 重组句子和标点
-    sents = []
-    for i in range(0, len(sentences) - 1, 2):
-        sent = sentences[i]
-        if i + 1 < len(sentences):
-            sent += sentences[i + 1]
-        if sent.strip():
-            sents.append(sent.strip())
-
-    # 如果没有明显的句子分隔符，按字符强制切分
-    if len(sents) == 0:
-        return force_split_by_chars(para, max_length, overlap)
-
-    # 按句子组合成chunks
-    chunks = []
-    current = ""
-
-    for sent in sents:
-        # 单个句子就超长，强制切分
-        if len(sent) > max_length:
-            if current:
-                chunks.append(current.strip())
-                current = ""
-            chunks.extend(force_split_by_chars(sent, max_length, overlap))
+        分片在原文中的位置列表 [(start, end)]
+    """
+    text_length = len(text)
+    spans = []
+    pos = 0
+    while pos < text_length:
+        if text[pos].isspace():
+            pos += 1
+            continue
+        if text_length - pos <= max_length:
+            cut = text_length
+        else:
+            cut = find_cdc_boundary(text, pos + min_length, pos + max_length)
+            if cut < 0:
+                cut = pos + max_length
+        start, end = _strip_span(text, pos, cut)
+        if start < end:
+            spans.append((start, end))
+        pos = cut
 
-        # 加上当前句子会超长
-        elif len(current) + len(sent) > max_length:
-            if current:
-                chunks.append(current.strip())
-            current = sent
+    if not spans:
+        return [(0, text_length)]
+    return add_overlap(text, spans, overlap)
 
-        # 累积句子
-        else:
-            current += sent
 
-    if current:
-        chunks.append(current.strip())
+def find_cdc_boundary(text: str, lowest: int, highest: int) -> int:
+    """
+    在 [lowest, highest] 中查找分片结束位置（见 cdc_spans）
+
+    Returns:
+        分片结束位置，找不到段落结尾和句子结尾时返回 -1
+    """
+    fallback = -1
+    for pattern in (_PARAGRAPH_RE, _SENTENCE_RE):
+        last = -1
+        for match in pattern.finditer(text, lowest, highest):
+            last = match.end()
+            if is_cdc_boundary(text, last):
+                return last
+        if fallback < 0:
+            fallback = last
+    return fallback
+
+
+def is_cdc_boundary(text: str, pos: int) -> bool:
+    """
+    pos 之前 CDC_WINDOW 个字符的哈希（CRC32，与进程无关）低位全为 0 时在 pos 处切分
+    """
+    window = text[max(0, pos - CDC_WINDOW):pos]
+    return zlib.crc32(window.encode('utf-8')) & CDC_MASK == 0
 
-    return chunks
 
+def _strip_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    # 去掉首尾空白后的位置（相当于 text[start:end].strip()，不复制文本）
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
 
-def force_split_by_chars(text: str, max_length: int, overlap: int) -> List[str]:
+
+def split_by_paragraphs(text: str, max_length: int, overlap: int) -> List[Tuple[int, int]]:
     """
-    按字符强制切分文本
+    基于段落的智能分片：每个分片尽可能多地包含完整段落（在 max_length 以内最后一个段落分隔处切分），
+    每次直接跳到下一个分片的开头，不逐段落拼接字符串
 
     Args:
         text: 输入文本
-        max_length: 最大长度
-        overlap: 重叠长度
+        max_length: 每个片段的最大长度
+        overlap: 片段之间的重叠长度
 
     Returns:
-        切分后的片段列表
+        分片位置列表 [(start, end)]
     """
-    chunks = []
-    start = 0
-    text_len = len(text)
-
-    while start < text_len:
-        end = min(start + max_length, text_len)
-        chunk = text[start:end]
-
-        if chunk.strip():
-            chunks.append(chunk.strip())
+    # 按段落分割（优先双换行，其次单换行）
+    separator = '\n\n' if '\n\n' in text else '\n'
+    text_length = len(text)
+
+    spans = []
+    pos = 0
+    while pos < text_length:
+        # 跳过空段落
+        if text[pos].isspace():
+            pos += 1
+            continue
+
+        if text_length - pos <= max_length:
+            cut = next_pos = text_length
+        else:
+            cut = text.rfind(separator, pos, pos + max_length + len(separator))
+            # 单个段落就超长，按句子切分
+            if cut < 0:
+                paragraph_end = text.find(separator, pos)
+                if paragraph_end < 0:
+                    paragraph_end = text_length
+                spans.extend(split_long_paragraph(text, pos, paragraph_end, max_length))
+                pos = paragraph_end
+                continue
+            next_pos = cut + len(separator)
+
+        start, end = _strip_span(text, pos, cut)
+        if start < end:
+            spans.append((start, end))
+        pos = next_pos
+
+    if not spans:
+        return [(0, text_length)]
 
-        # 移动起始位置（考虑重叠）
-        start = end - overlap if end < text_len else text_len
+    # 添加重叠
+    if overlap > 0 and len(spans) > 1:
+        spans = add_overlap(text, spans, overlap)
 
-    return chunks
+    return spans
 
 
-def add_overlap(chunks: List[str], overlap: int) -> List[str]:
+def split_long_paragraph(text: str, start: int, end: int, max_length: int) -> List[Tuple[int, int]]:
     """
-    为分片添加重叠部分
+    切分超长段落（按句子）：在 max_length 以内最后一个句末标点之后切分，没有句末标点（单个句子超长）时按字符强制切分
 
     Args:
-        chunks: 原始分片列表
-        overlap: 重叠长度
+        text: 输入文本
+        start: 段落开始位置
+        end: 段落结束位置
+        max_length: 最大长度
 
     Returns:
-        添加重叠后的分片列表
+        分片位置列表 [(start, end)]
     """
-    if overlap <= 0 or len(chunks) <= 1:
-        return chunks
+    spans = []
+    pos = start
+    while pos < end:
+        if text[pos].isspace():
+            pos += 1
+            continue
+        if end - pos <= max_length:
+            cut = end
+        else:
+            cut = max(text.rfind(mark, pos, pos + max_length) for mark in _SENTENCE_END) + 1
+            if cut <= pos:
+                cut = pos + max_length
+        s, e = _strip_span(text, pos, cut)
+        if s < e:
+            spans.append((s, e))
+        pos = cut
+    return spans
 
-    result = [chunks[0]]
 
-    for i in range(1, len(chunks)):
-        # 获取前一个chunk的末尾部分
-        prev_chunk = chunks[i - 1]
-        overlap_text = prev_chunk[-overlap:] if len(prev_chunk) >= overlap else prev_chunk
+def add_overlap(text: str, spans: List[Tuple[int, int]], overlap: int) -> List[Tuple[int, int]]:
+    """
+    为分片添加重叠部分：分片向前延伸到包含前一个分片末尾 overlap 个字符
 
-        # 将重叠部分添加到当前chunk前面
-        new_chunk = overlap_text + " " + chunks[i]
-        result.append(new_chunk)
+    Args:
+        text: 输入文本
+        spans: 原始分片位置列表
+        overlap: 重叠长度
 
+    Returns:
+        添加重叠后的分片位置列表
+    """
+    if overlap <= 0 or len(spans) <= 1:
+        return spans
+
+    result = [spans[0]]
+    for (prev_start, prev_end), (start, end) in zip(spans, spans[1:]):
+        result.append(_strip_span(text, min(start, max(prev_start, prev_end - overlap)), end))
     return result
 
 
-def optimize_chunks(chunks: List[str], max_chunks: int, target_length: float) -> List[str]:
+def optimize_chunks(spans: List[Tuple[int, int]], max_chunks: int, target_length: float) -> List[Tuple[int, int]]:
     """
-    当分片数量过多时，进行优化合并
+    当分片数量过多时，合并相邻的短片段（合并后的分片为原文中连续的一段）
 
     Args:
-        chunks: 原始分片列表
+        spans: 原始分片位置列表
         max_chunks: 最大允许分片数
         target_length: 目标分片长度
 
     Returns:
-        优化后的分片列表
+        优化后的分片位置列表
     """
-    # 策略1: 合并相邻的短片段
     merged = []
-    current = ""
-
-    for chunk in chunks:
-        if len(current) + len(chunk) <= target_length:
-            if current:
-                current += "\n" + chunk
-            else:
-                current = chunk
+    current = None
+    for start, end in spans:
+        if current and end - current[0] <= target_length:
+            current = (current[0], max(current[1], end))
         else:
             if current:
                 merged.append(current)
-            current = chunk
+            current = (start, end)
 
     if current:
         merged.append(current)
 
-    # 如果合并后还是太多，使用抽样策略
-    # if len(merged) > max_chunks:
-    #     logging.warning(f"合并后分片数 {len(merged)} 仍超限，使用抽样策略")
-    #
-    #     # 保留开头、结尾和均匀采样的中间部分
-    #     head_count = max_chunks // 4
-    #     tail_count = max_chunks // 4
-    #     middle_count = max_chunks - head_count - tail_count
-    #
-    #     head = merged[:head_count]
-    #     tail = merged[-tail_count:]
-    #
-    #     # 从中间均匀采样
-    #     middle_indices = np.linspace(
-    #         head_count,
-    #         len(merged) - tail_count - 1,
-    #         middle_count,
-    #         dtype=int
-    #     )
-    #     middle = [merged[i] for i in middle_indices]
-    #
-    #     merged = head + middle + tail
-
-    return merged
\ No newline at end of file
+    return merged
@@ -0,0 +1,158 @@
+# 向量模型登记与切换：embedding_config.json 中的 model 与当前使用的模型不同时，后台任务用新模型限速地重新生成全部向量
+# （写入暂存表，检索仍使用原来的向量），全部完成后在一个事务中替换，再切换查询和文档加载使用的模型并重建向量索引；
+# 进度保存在暂存表中，程序重启后继续
+import logging
+import time
+from typing import Dict, Any, Optional
+
+import client_global
+import frozen_support
+from database.duckdb_config import duckdb_config
+from domain.kb_domain.dao import EmbeddingModelDao
+from domain.kb_domain.serv import EmbeddingServ, SearchCacheServ, VectorIndexServ
+from domain.kb_domain.serv.VectorModel.VectorLoader import EmbeddingLoader, create_embedding_model, load_config
+
+# 每次重新生成向量的文本数
+REEMBED_BATCH = 128
+# 限速：每次编码后暂停编码耗时的倍数（1.0 表示最多占用一半时间），不影响检索和文档加载
+REEMBED_PAUSE_RATIO = 1.0
+
+# 正在切换的新模型 {'model_name', 'pooling', 'dim', 'model'}
+_target: Optional[Dict[str, Any]] = None
+
+
+# -----------------------------
+# 启动时加载当前使用的模型
+# -----------------------------
+def load_active_model():
+    """
+    加载 embedding_model 表中 state 为 active 的模型（而不是配置中的模型，配置的新模型要等向量全部重新生成后才使用）
+    """
+    active = EmbeddingModelDao.get_active()
+    model_name = active['model_name'] if active else load_config()['model']
+    pooling = active['pooling'] if active else None
+    client_global.embedding_model_name = model_name
+    client_global.model_name_or_path = frozen_support.get_vector_model_path(model_name)
+    client_global.embedding_model = create_embedding_model(client_global.model_name_or_path, pooling)
+    return client_global.embedding_model
+
+
+def get_status() -> Dict[str, Any]:
+    """
+    Returns:
+        {'active': 当前模型, 'dim', 'pooling', 'target': 正在切换的新模型, 'chunk_cnt', 'staged_cnt'}
+    """
+    active = EmbeddingModelDao.get_active() or {}
+    status = {'active': active.get('model_name'), 'dim': active.get('dim'), 'pooling': active.get('pooling'),
+              'target': None}
+    migrating = EmbeddingModelDao.get_migrating()
+    if migrating:
+        status['target'] = migrating[-1]['model_name']
+        status.update(EmbeddingModelDao.get_progress(status['target']))
+    return status
+
+
+# -----------------------------
+# 后台重新生成向量
+# -----------------------------
+def reembed(deadline: float, is_running=lambda: True) -> bool:
+    """
+    后台任务调用：用配置的新模型重新生成一批向量，全部完成后切换
+
+    Args:
+        deadline: 本轮最晚结束时间（time.time()）
+        is_running: 返回 False 时提前结束
+
+    Returns:
+        是否还有未完成的切换
+    """
+    config = load_config()
+    target_name = config['model']
+    active = EmbeddingModelDao.get_active()
+    # 配置改为其他模型后，放弃之前未完成的切换
+    for row in EmbeddingModelDao.get_migrating():
+        if row['model_name'] != target_name:
+            logging.info(f"放弃切换向量模型: {row['model_name']}")
+            EmbeddingModelDao.cancel_migration(row['model_name'])
+    if active is None or target_name == active['model_name']:
+        _release_target()
+        return False
+
+    target = _get_target(target_name, config['pooling'])
+    while is_running() and time.time() < deadline:
+        rows = EmbeddingModelDao.get_pending_chunks(target_name, REEMBED_BATCH)
+        if rows:
+            _encode(target, [row['chunk_text'] or '' for row in rows],
+                    lambda vectors: EmbeddingModelDao.stage_chunks(target_name, rows, vectors))
+            continue
+        names = EmbeddingModelDao.get_pending_names(target_name, REEMBED_BATCH)
+        if names:
+            _encode(target, [row['file_name'] or '' for row in names],
+                    lambda vectors: EmbeddingModelDao.stage_names(target_name, names, vectors))
+            continue
+        _cutover(target)
+        return False
+    progress = EmbeddingModelDao.get_progress(target_name)
+    logging.info(f"向量模型 {target_name} 重新生成向量 {progress['staged_cnt']}/{progress['chunk_cnt']}")
+    return True
+
+
+def _get_target(model_name: str, pooling: str) -> Dict[str, Any]:
+    global _target
+    if _target is not None and _target['model_name'] == model_name and _target['pooling'] == pooling:
+        return _target
+    _release_target()
+    logging.info(f"开始切换向量模型: {client_global.embedding_model_name} -> {model_name}")
+    model = EmbeddingLoader(model_name_or_path=frozen_support.get_vector_model_path(model_name), pooling=pooling)
+    dim = int(model.encode(['维度探测']).shape[1])
+    EmbeddingModelDao.register(model_name, dim, pooling)
+    _target = {'model_name': model_name, 'pooling': pooling, 'dim': dim, 'model': model}
+    return _target
+
+
+def _release_target():
+    global _target
+    if _target is not None:
+        _target['model'].unload()
+        _target = None
+
+
+def _encode(target: Dict[str, Any], texts, stage):
+    start = time.perf_counter()
+    stage(target['model'].encode(texts, normalize=True))
+    time.sleep((time.perf_counter() - start) * REEMBED_PAUSE_RATIO)
+
+
+def _cutover(target: Dict[str, Any]):
+    global _target
+    model_name, dim = target['model_name'], target['dim']
+    old_name = client_global.embedding_model_name
+    model_path = frozen_support.get_vector_model_path(model_name)
+    # 查询和文档加载改用的新模型（不使用进程池时就是已加载的新模型），在替换向量之前准备好，缩短新旧向量混用的时间
+    new_model = create_embedding_model(model_path, target['pooling'])
+    # 先停用向量矩阵和 ANN 索引（其中是旧模型的向量），切换期间检索回退到数据库精确扫描
+    VectorIndexServ.take_offline()
+    try:
+        EmbeddingModelDao.cutover(model_name, dim, duckdb_config['vector_dim'], target['model'].model_id)
+    except Exception:
+        # 数据库中仍是旧模型的向量，恢复索引后由下一轮重试
+        VectorIndexServ.rebuild_all()
+        if new_model is not target['model']:
+            new_model.unload()
+        raise
+    duckdb_config['vector_dim'] = dim
+
+    old_model = EmbeddingServ.set_model(new_model)
+    client_global.embedding_model_name = model_name
+    client_global.model_name_or_path = model_path
+    if new_model is not target['model']:
+        target['model'].unload()
+    if old_model is not None and old_model is not new_model:
+        old_model.unload()
+    _target = None
+
+    VectorIndexServ.rebuild_all()
+    # 索引重建完成后再清理缓存，切换期间的查询结果不会留在缓存中
+    SearchCacheServ.clear_query_cache()
+    SearchCacheServ.bump_generation()
+    logging.info(f"向量模型切换完成: {old_name} -> {model_name}（维度 {dim}）")
@@ -0,0 +1,291 @@
+# 向量化服务：单线程独占向量模型，把多个文档的编码请求合并成整批推理；
+# 检索查询走高优先级通道，不用排在文档加载后面。请求返回 Future，文档加载可以边解析边编码；
+# 文档分片按内容哈希缓存向量（embedding_cache 表），文档修改后只编码变化的分片
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+import client_global
+from domain.kb_domain.dao import EmbeddingCacheDao
+from util import TextTokenUtil
+
+# 优先级：检索查询 / 文档加载 / 大文档剩余分片的后台补齐（只在没有文档加载请求时编码）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_INGEST = 1
+PRIORITY_BACKFILL = 2
+# 文档加载请求的合并等待时间（秒）：凑不满一批时最多等待这么久
+COALESCE_WINDOW = 0.02
+# 每次推理最多合并的文本数（大请求拆成多次推理，推理间隙检索查询可以插队）
+MAX_BATCH_TEXTS = 64
+
+_lock = threading.Condition()
+_interactive: "deque[_Request]" = deque()
+_ingest: "deque[_Request]" = deque()
+_backfill: "deque[_Request]" = deque()
+_thread: Optional[threading.Thread] = None
+_model_lock = threading.Lock()
+_stats = {'batches': 0, 'texts': 0, 'interactive_requests': 0, 'ingest_requests': 0, 'backfill_requests': 0,
+          'failed_requests': 0, 'cache_hits': 0, 'cache_misses': 0}
+
+
+class _Request:
+    def __init__(self, texts: List[str], normalize: bool):
+        self.texts = texts
+        self.normalize = normalize
+        self.future = Future()
+        # 已取出编码的文本数，大请求分多次推理
+        self.offset = 0
+        self.vectors: Optional[np.ndarray] = None
+        self.done_cnt = 0
+        self.failed = False
+        self.created_at = time.perf_counter()
+
+
+class _CachedResult:
+    """
+    submit_cached 的结果：缓存命中的向量 + 未命中分片的编码请求
+    """
+
+    def __init__(self, model_id: str, text_hashes: List[int], cached: Dict[int, np.ndarray],
+                 miss_hashes: List[int], future: Optional[Future]):
+        self.model_id = model_id
+        self.text_hashes = text_hashes
+        self.cached = cached
+        self.miss_hashes = miss_hashes
+        self.future = future
+
+    def result(self, timeout: Optional[float] = None) -> np.ndarray:
+        vectors = dict(self.cached)
+        if self.future is not None:
+            miss_vectors = self.future.result(timeout)
+            vectors.update(zip(self.miss_hashes, miss_vectors))
+            # 缓存写入失败不影响本次加载
+            try:
+                EmbeddingCacheDao.put_vectors(self.model_id, self.miss_hashes, miss_vectors)
+            except Exception as e:
+                logging.error(f"向量缓存写入失败: {e}", exc_info=True)
+        if not self.text_hashes:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[h] for h in self.text_hashes]).astype(np.float32)
+
+
+# -----------------------------
+# 提交编码请求
+# -----------------------------
+def submit(texts, normalize: bool = True, priority: int = PRIORITY_INGEST) -> Future:
+    """
+    提交编码请求
+
+    Args:
+        texts: 单个字符串或字符串列表
+        normalize: 是否单位化
+        priority: PRIORITY_INTERACTIVE（检索查询）、PRIORITY_INGEST（文档加载）或 PRIORITY_BACKFILL（后台补齐）
+
+    Returns:
+        Future，结果为 numpy 数组，形状 (len(texts), dim)
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    request = _Request(list(texts), normalize)
+    if not request.texts:
+        request.future.set_result(np.zeros((0, 0), dtype=np.float32))
+        return request.future
+    _ensure_thread()
+    with _lock:
+        if priority == PRIORITY_INTERACTIVE:
+            _interactive.append(request)
+            _stats['interactive_requests'] += 1
+        elif priority == PRIORITY_BACKFILL:
+            _backfill.append(request)
+            _stats['backfill_requests'] += 1
+        else:
+            _ingest.append(request)
+            _stats['ingest_requests'] += 1
+        _lock.notify()
+    return request.future
+
+
+def submit_cached(texts: List[str], priority: int = PRIORITY_INGEST) -> "_CachedResult":
+    """
+    提交文档分片的编码请求（单位化），先按 (模型ID, 分片文本哈希) 查询向量缓存，只编码未命中的分片
+
+    Returns:
+        _CachedResult，result() 返回与 texts 一一对应的向量，并把新编码的向量写入缓存
+    """
+    texts = list(texts)
+    model_id = current_model_id()
+    text_hashes = [TextTokenUtil.text_hash(text) for text in texts]
+    cached = EmbeddingCacheDao.get_vectors(model_id, text_hashes) if texts else {}
+    # 未命中的分片按哈希去重后编码
+    miss = {}
+    for text, text_hash in zip(texts, text_hashes):
+        if text_hash not in cached and text_hash not in miss:
+            miss[text_hash] = text
+    with _lock:
+        _stats['cache_hits'] += sum(1 for h in text_hashes if h in cached)
+        _stats['cache_misses'] += len(miss)
+    future = submit(list(miss.values()), normalize=True, priority=priority) if miss else None
+    return _CachedResult(model_id, text_hashes, cached, list(miss.keys()), future)
+
+
+def encode(texts, normalize: bool = True, priority: int = PRIORITY_INGEST, timeout: Optional[float] = None):
+    """
+    同步编码：提交请求并等待结果
+    """
+    return submit(texts, normalize, priority).result(timeout)
+
+
+def encode_query(query: str) -> np.ndarray:
+    """
+    检索查询编码（高优先级，单位化），返回形状 (1, dim)
+    """
+    return encode([query], normalize=True, priority=PRIORITY_INTERACTIVE)
+
+
+def current_model_id() -> str:
+    """
+    当前向量模型ID（见 EmbeddingLoader.model_id）
+    """
+    return _get_model().model_id
+
+
+def set_model(model):
+    """
+    切换向量模型（后台重新生成全部向量后调用），返回原来的模型；正在编码的批次仍使用原来的模型
+    """
+    with _model_lock:
+        old_model = client_global.embedding_model
+        client_global.embedding_model = model
+    return old_model
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        stats = dict(_stats)
+        stats['interactive_queue'] = len(_interactive)
+        stats['ingest_queue'] = sum(len(r.texts) - r.offset for r in _ingest)
+        stats['backfill_queue'] = sum(len(r.texts) - r.offset for r in _backfill)
+    stats['avg_batch_texts'] = round(stats['texts'] / stats['batches'], 2) if stats['batches'] else 0.0
+    return stats
+
+
+# -----------------------------
+# 编码线程
+# -----------------------------
+def _ensure_thread():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='EmbeddingServ', daemon=True)
+            _thread.start()
+
+
+def _get_model():
+    with _model_lock:
+        if client_global.embedding_model is None:
+            from domain.kb_domain.serv.VectorModel.VectorLoader import create_embedding_model
+            client_global.embedding_model = create_embedding_model(client_global.model_name_or_path)
+        return client_global.embedding_model
+
+
+def _next_batch() -> List[tuple]:
+    """
+    取出下一批待编码的文本：检索查询优先且整批取出；文档加载的文本凑满 MAX_BATCH_TEXTS 或等待超过 COALESCE_WINDOW 后取出；
+    没有文档加载请求时才取后台补齐的文本
+
+    Returns:
+        [(request, start, end)]，表示 request.texts[start:end] 参与本次推理
+    """
+    with _lock:
+        while not _interactive and not _ingest and not _backfill:
+            _lock.wait()
+        if _interactive:
+            return _take_interactive()
+
+        queue = _ingest if _ingest else _backfill
+        deadline = queue[0].created_at + COALESCE_WINDOW
+        while (not _interactive and not (queue is _backfill and _ingest)
+               and sum(len(r.texts) - r.offset for r in queue) < MAX_BATCH_TEXTS):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            _lock.wait(remaining)
+        if _interactive:
+            return _take_interactive()
+        # 等待期间来了文档加载请求时先处理文档加载
+        queue = _ingest if _ingest else _backfill
+
+        parts = []
+        budget = MAX_BATCH_TEXTS
+        while queue and budget > 0:
+            request = queue[0]
+            end = min(len(request.texts), request.offset + budget)
+            parts.append((request, request.offset, end))
+            budget -= end - request.offset
+            request.offset = end
+            if request.offset >= len(request.texts):
+                queue.popleft()
+        return parts
+
+
+def _take_interactive() -> List[tuple]:
+    # 调用方已持有 _lock
+    requests = list(_interactive)
+    _interactive.clear()
+    for request in requests:
+        request.offset = len(request.texts)
+    return [(request, 0, len(request.texts)) for request in requests]
+
+
+def _run():
+    while True:
+        parts = _next_batch()
+        texts = [text for request, start, end in parts for text in request.texts[start:end]]
+        try:
+            vectors = _get_model().encode(texts, normalize=False)
+        except Exception as e:
+            logging.error(f"向量化失败: {e}", exc_info=True)
+            for request, _, _ in parts:
+                _fail(request, e)
+            continue
+        with _lock:
+            _stats['batches'] += 1
+            _stats['texts'] += len(texts)
+        pos = 0
+        for request, start, end in parts:
+            _fill(request, start, end, vectors[pos:pos + end - start])
+            pos += end - start
+
+
+def _fill(request: _Request, start: int, end: int, vectors: np.ndarray):
+    if request.failed:
+        return
+    if request.vectors is None:
+        request.vectors = np.zeros((len(request.texts), vectors.shape[1]), dtype=np.float32)
+    request.vectors[start:end] = vectors
+    request.done_cnt += end - start
+    if request.done_cnt < len(request.texts):
+        return
+    result = request.vectors
+    if request.normalize:
+        norms = np.linalg.norm(result, axis=1, keepdims=True)
+        result = result / np.clip(norms, 1e-12, None)
+    request.future.set_result(result)
+
+
+def _fail(request: _Request, error: Exception):
+    if request.failed:
+        return
+    request.failed = True
+    with _lock:
+        _stats['failed_requests'] += 1
+        # 未取出的剩余文本不再编码
+        for queue in (_ingest, _backfill):
+            if request in queue:
+                queue.remove(request)
+    request.future.set_exception(error)
@@ -7,7 +7,7 @@ from domain.kb_domain.EvaluateJs.DocEvaJs import add_doc
 from domain.kb_domain.EvaluateJs.KBEvaJs import stop_kb_loading_state, start_kb_loading_state, update_kb_state
 from util import IDUtil
 from domain.kb_domain.dao import KnowledgeBaseDao, DocumentDao, ViewKbDocDao
-from domain.kb_domain.serv import DirServ
+from domain.kb_domain.serv import DirServ, VectorIndexServ
 
 
 # kb_change_type: "新增、删除 "ADDED,DELETED
@@ -148,15 +148,14 @@ def update_wait_load_num(num=None):
     KBEvaJs.update_wait_load_doc_cnt(int(num['num']))
 
 
-# 根据知识库id递归移除下面所有的知识库和文档
+# 根据知识库id移除下面所有的知识库和文档（按闭包表整棵子树删除）
 def kb_delete_all(kb_id):
-    doc_delete_list = DocumentDao.get_all({'knowledge_base_id': kb_id})
+    doc_delete_list = DocumentDao.get_all_in_kb_tree(kb_id)
+    DocumentDao.delete_by_kb_tree(kb_id)
+    VectorIndexServ.on_kb_deleted(kb_id)
     for doc in doc_delete_list:
-        DocumentDao.delete(doc['document_id'])
-    kb_delete_list = KnowledgeBaseDao.get_all({'up_id': kb_id})
-    for kb in kb_delete_list:
-        kb_delete_all(kb['knowledge_base_id'])
-    KnowledgeBaseDao.delete(kb_id)
+        VectorIndexServ.on_doc_deleted(doc['document_id'], kb_id)
+    KnowledgeBaseDao.delete_tree(kb_id)
 
 
 
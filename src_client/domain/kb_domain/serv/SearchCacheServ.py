@@ -0,0 +1,144 @@
+# 检索缓存：查询文本 -> 单位化查询向量（LRU），检索结果（LRU，按知识库索引版本失效）
+import copy
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from domain.kb_domain.dao import KnowledgeBaseDao
+
+# 查询向量缓存数量
+QUERY_CACHE_SIZE = 1024
+# 检索结果缓存数量
+RESULT_CACHE_SIZE = 256
+
+_lock = threading.Lock()
+_query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_result_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+_stats = {'query_hits': 0, 'query_misses': 0, 'result_hits': 0, 'result_misses': 0}
+
+# 知识库索引版本：知识库（含下级）中有文档写入或删除时递增，'' 为全部知识库
+_generations: Dict[str, int] = {}
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _normalize_query(query: str) -> str:
+    return _WHITESPACE.sub(' ', query or '').strip()
+
+
+# -----------------------------
+# 查询向量
+# -----------------------------
+def encode_query(query: str) -> np.ndarray:
+    """
+    获取查询文本的单位化向量，相同（忽略首尾及连续空白）的查询不再重复编码
+
+    Returns:
+        二维数组，形状 (1, dim)
+    """
+    key = _normalize_query(query)
+    with _lock:
+        vector = _query_cache.get(key)
+        if vector is not None:
+            _query_cache.move_to_end(key)
+            _stats['query_hits'] += 1
+            return vector
+        _stats['query_misses'] += 1
+
+    # 走向量化服务的高优先级通道，不用等待文档加载的编码
+    from domain.kb_domain.serv import EmbeddingServ
+    vector = np.asarray(EmbeddingServ.encode_query(query), dtype=np.float32)
+    vector.setflags(write=False)
+    with _lock:
+        _query_cache[key] = vector
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return vector
+
+
+def clear_query_cache():
+    """
+    切换向量模型后调用：缓存的查询向量由原来的模型生成，不能再使用
+    """
+    with _lock:
+        _query_cache.clear()
+
+
+# -----------------------------
+# 索引版本
+# -----------------------------
+def generation(knowledge_base_id=None) -> tuple:
+    """
+    检索结果缓存键中的索引版本：(全部知识库版本, 指定知识库版本)
+    """
+    kb_key = '' if knowledge_base_id is None else str(knowledge_base_id)
+    with _lock:
+        return _generations.get('', 0), _generations.get(kb_key, 0)
+
+
+def bump_generation(knowledge_base_id=None):
+    """
+    知识库中有文档写入或删除后调用：该知识库及其所有上级知识库的版本递增，缓存的检索结果随之失效。
+    不指定知识库时所有缓存结果失效。
+    """
+    kb_ids = []
+    if knowledge_base_id is not None and knowledge_base_id != '':
+        kb_ids = KnowledgeBaseDao.get_ancestor_ids(knowledge_base_id)
+    with _lock:
+        _generations[''] = _generations.get('', 0) + 1
+        if not kb_ids:
+            # 无法确定知识库，清空全部结果
+            _result_cache.clear()
+        for kb_id in kb_ids:
+            _generations[kb_id] = _generations.get(kb_id, 0) + 1
+
+
+# -----------------------------
+# 检索结果
+# -----------------------------
+def result_key(query_vector, knowledge_base_id, params: tuple) -> tuple:
+    vector_hash = hashlib.blake2b(np.ascontiguousarray(query_vector, dtype=np.float32).tobytes(),
+                                  digest_size=16).hexdigest()
+    kb_key = '' if knowledge_base_id is None else str(knowledge_base_id)
+    # 未指定知识库的检索跨所有知识库，使用全部知识库版本；指定知识库时只看该子树的版本
+    kb_generation = generation(knowledge_base_id)
+    kb_generation = kb_generation[0] if kb_key == '' else kb_generation[1]
+    return vector_hash, kb_key, kb_generation, params
+
+
+def get_result(key: tuple) -> Optional[Any]:
+    with _lock:
+        result = _result_cache.get(key)
+        if result is None:
+            _stats['result_misses'] += 1
+            return None
+        _result_cache.move_to_end(key)
+        _stats['result_hits'] += 1
+    return copy.deepcopy(result)
+
+
+def put_result(key: tuple, result: Any):
+    with _lock:
+        _result_cache[key] = copy.deepcopy(result)
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+
+# -----------------------------
+# 命中率统计
+# -----------------------------
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        stats = dict(_stats)
+        stats['query_cache_size'] = len(_query_cache)
+        stats['result_cache_size'] = len(_result_cache)
+    for name in ('query', 'result'):
+        total = stats[f'{name}_hits'] + stats[f'{name}_misses']
+        stats[f'{name}_hit_rate'] = round(stats[f'{name}_hits'] / total, 4) if total else 0.0
+    return stats
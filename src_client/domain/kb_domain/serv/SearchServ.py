@@ -0,0 +1,247 @@
+# 知识库检索：向量（分片、文件名）+ 词项检索，按文档聚合排序
+import json
+from collections import defaultdict
+from typing import Dict, List, Any, Optional
+
+from domain.kb_domain.dao import ChunkTermDao, DocumentDao
+from domain.kb_domain.serv import SearchCacheServ, VectorIndexServ
+
+
+def search_docs_by_vector(query, knowledge_base_id,
+                          # 分片权重值
+                          chunk_weight: float = 0.7,
+                          # 文件名权重值
+                          filename_weight: float = 0.3,
+                          # 分数计算方法
+                          # max 取单片最大值,
+                          # mean 同文档从筛选出的分片中取平均值,
+                          # weighted_max 同文档每片加权后计算后取最大值,
+                          # top_k_mean 同文档取最高的几片的平均值
+                          chunk_agg_method: str = 'weighted_max',
+                          # 对应top_k_mean方法的top数量
+                          top_k_chunks: int = 3,
+                          # 最低分，去掉低于改分数的文档
+                          min_score: float = 0.6,
+                          # 词项（BM25）加分权重，0 表示只用向量检索
+                          lexical_weight: float = 0.3
+                          ):
+    # 查询向量有缓存，相同的查询不再重复编码
+    query_vector = SearchCacheServ.encode_query(query)
+    return search_docs_by_query_vector(query_vector, query, knowledge_base_id, chunk_weight, filename_weight,
+                                       chunk_agg_method, top_k_chunks, min_score, lexical_weight)
+
+
+# 使用已编码的查询向量检索（基准测试等不加载向量模型的场景直接调用）
+def search_docs_by_query_vector(query_vector, query, knowledge_base_id,
+                                chunk_weight: float = 0.7,
+                                filename_weight: float = 0.3,
+                                chunk_agg_method: str = 'weighted_max',
+                                top_k_chunks: int = 3,
+                                min_score: float = 0.6,
+                                lexical_weight: float = 0.3,
+                                # 是否使用检索结果缓存
+                                use_cache: bool = True,
+                                # 分片检索数量
+                                top_k: int = 90
+                                ):
+    # 检索结果有缓存，知识库中有文档写入或删除后缓存的结果自动失效
+    cache_key = SearchCacheServ.result_key(query_vector, knowledge_base_id,
+                                           (chunk_weight, filename_weight, chunk_agg_method, top_k_chunks,
+                                            min_score, lexical_weight, top_k, query))  # 查询文本影响词项检索
+    if use_cache:
+        cached = SearchCacheServ.get_result(cache_key)
+        if cached is not None:
+            return cached
+    # 1、一次查询获取切片的余弦值、切片的 BM25 分数、文件名的余弦值及命中分片的文本。
+    # 切片向量优先使用向量矩阵/ANN 索引计算，都未就绪时由数据库从大到小排序取前X个；
+    # 词项检索命中、向量未命中的分片一并返回（条文编号、型号、人名等精确词）
+    # 返回值示例
+    # chunk_cosine_list: [{'document_id': 2510211150409282, 'file_name': '...', 'location_path': '...', 'chunk_index': 0, 'cosine_similarity': 0.766421729917693, 'bm25': 3.2, 'chunk_text': '...'}]
+    # file_name_cosine_list: [{'document_id': 2510211150429293, 'file_name': '昆明市名人故（旧）居保护暂行办法.docx', 'location_path': '...', 'cosine_similarity': 0.6601183583082879}]
+    chunk_hits = VectorIndexServ.search_chunks(query_vector, knowledge_base_id, top_k)
+    query_terms = ChunkTermDao.query_terms(query) if lexical_weight > 0 else None
+    chunk_cosine_list, file_name_cosine_list = DocumentDao.search_docs(query_vector, knowledge_base_id, top_k,
+                                                                       chunk_hits=chunk_hits,
+                                                                       query_terms=query_terms)
+    fuse_lexical_scores(chunk_cosine_list, lexical_weight)
+
+    # 2、设计算法，获取相似度最高的文件。
+    ranked_docs = rank_documents_by_similarity(chunk_cosine_list, file_name_cosine_list, chunk_weight,
+                                               filename_weight, chunk_agg_method, top_k_chunks, min_score)
+
+    # 3、按分片下标拼接文本内容，不再逐个文档回查数据库；chunk_positions 为各分片所在的页、幻灯片、工作表或章节
+    chunk_texts = {(item['document_id'], item['chunk_index']): item['chunk_text'] for item in chunk_cosine_list}
+    chunk_positions = {(item['document_id'], item['chunk_index']): item.get('chunk_position')
+                       for item in chunk_cosine_list}
+    doc_paths = {item['document_id']: item['location_path'] for item in file_name_cosine_list + chunk_cosine_list}
+    for doc in ranked_docs:
+        doc['location_path'] = doc_paths.get(doc['document_id'], '')
+        doc['file_content'] = ''.join(
+            chunk_texts.get((doc['document_id'], idx)) or '' for idx in doc['chunk_index_list'])
+        doc['chunk_positions'] = [json.loads(chunk_positions[(doc['document_id'], idx)])
+                                  if chunk_positions.get((doc['document_id'], idx)) else None
+                                  for idx in doc['chunk_index_list']]
+    if use_cache:
+        SearchCacheServ.put_result(cache_key, ranked_docs)
+    return ranked_docs
+
+
+# 分片位置的说明文字（如 "第3页、第5页"、"工作表 Sheet1"），没有位置时为空字符串
+def describe_positions(positions: Optional[List[Optional[Dict[str, Any]]]]) -> str:
+    names = []
+    for position in positions or []:
+        if not position:
+            continue
+        if 'page' in position:
+            name = f"第{position['page']}页"
+        elif 'slide' in position:
+            name = f"第{position['slide']}张幻灯片"
+        elif 'sheet' in position:
+            name = f"工作表 {position['sheet']}"
+        elif 'heading' in position:
+            name = f"“{position['heading']}”"
+        else:
+            continue
+        if name not in names:
+            names.append(name)
+    return '、'.join(names)
+
+
+# 融合词项分数：BM25 按本次最高分归一化后作为加分，叠加到向量相似度上（上限 1.0），
+# 只有向量分数的分片保持原分数，min_score 等阈值的含义不变
+def fuse_lexical_scores(chunk_cosine_list: List[Dict[str, Any]], lexical_weight: float = 0.3):
+    max_bm25 = max((item.get('bm25') or 0.0 for item in chunk_cosine_list), default=0.0)
+    for item in chunk_cosine_list:
+        item['vector_similarity'] = item['cosine_similarity']
+        if max_bm25 > 0:
+            bonus = lexical_weight * (item.get('bm25') or 0.0) / max_bm25
+            item['cosine_similarity'] = min(1.0, item['cosine_similarity'] + bonus)
+    chunk_cosine_list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
+
+
+def rank_documents_by_similarity(
+        chunk_cosine_list: List[Dict[str, Any]],
+        file_name_cosine_list: List[Dict[str, Any]],
+        chunk_weight: float = 0.7,
+        filename_weight: float = 0.3,
+        chunk_agg_method: str = 'weighted_max',
+        top_k_chunks: int = 3,
+        min_score: float = 0.6
+) -> List[Dict[str, Any]]:
+    if not chunk_cosine_list and not file_name_cosine_list:
+        return []
+
+    # 归一化权重
+    total_weight = chunk_weight + filename_weight
+    if total_weight == 0:
+        cw, fw = 0.5, 0.5
+    else:
+        cw = chunk_weight / total_weight
+        fw = filename_weight / total_weight
+
+    doc_to_file = {}
+    for item in file_name_cosine_list:
+        if 'document_id' in item:
+            doc_to_file[item['document_id']] = item.get('file_name', '')
+    for item in chunk_cosine_list:
+        if 'document_id' in item and item['document_id'] not in doc_to_file:
+            doc_to_file[item['document_id']] = item.get('file_name', '')
+
+    # 按 document_id 聚合：相似度列表 + chunk_index 列表
+    doc_chunks = defaultdict(list)  # 存 similarity
+    doc_chunk_indices = defaultdict(list)  # 存 chunk_index
+
+    for item in chunk_cosine_list:
+        doc_id = item.get('document_id')
+        if doc_id is None:
+            continue
+        sim = float(item.get('cosine_similarity', 0.0))
+        idx = item.get('chunk_index', -1)  # 若无 chunk_index，默认 -1
+
+        doc_chunks[doc_id].append(sim)
+        doc_chunk_indices[doc_id].append(idx)
+
+    # 聚合 chunk 相似度（用于 combined score）
+    doc_chunk_score = {}
+    for doc_id, scores in doc_chunks.items():
+        if not scores:
+            s = 0.0
+        else:
+            sorted_scores = sorted(scores, reverse=True)
+            if chunk_agg_method == 'max':
+                s = max(scores)
+            elif chunk_agg_method == 'mean':
+                s = sum(scores) / len(scores)
+            elif chunk_agg_method == 'sum':
+                s = sum(scores)
+            elif chunk_agg_method == 'weighted_max':
+                top_n = min(len(sorted_scores), top_k_chunks)
+                weights = [0.5, 0.3, 0.2, 0.1, 0.05][:top_n]
+                w_sum = sum(weights)
+                if w_sum > 0:
+                    weights = [w / w_sum for w in weights]
+                s = sum(sc * w for sc, w in zip(sorted_scores[:top_n], weights))
+            elif chunk_agg_method == 'top_k_mean':
+                k = min(len(sorted_scores), top_k_chunks)
+                s = sum(sorted_scores[:k]) / k
+            else:
+                s = max(scores)
+        doc_chunk_score[doc_id] = s
+
+    # 文件名相似度映射
+    doc_filename_score = {
+        item['document_id']: float(item.get('cosine_similarity', 0.0))
+        for item in file_name_cosine_list
+        if 'document_id' in item
+    }
+
+    # 合并所有 document_id
+    all_doc_ids = set(doc_chunk_score.keys()) | set(doc_filename_score.keys())
+
+    # 构建结果并过滤
+    results = []
+    for doc_id in all_doc_ids:
+        chunk_sim = doc_chunk_score.get(doc_id, 0.0)
+        filename_sim = doc_filename_score.get(doc_id, 0.0)
+        combined = cw * chunk_sim + fw * filename_sim
+
+        if combined < min_score:
+            continue
+
+        file_name = doc_to_file.get(doc_id, "unknown")
+        chunk_indices = doc_chunk_indices.get(doc_id, [])
+
+        results.append({
+            'document_id': doc_id,
+            'file_name': file_name,
+            'combined_similarity': round(combined, 6),
+            'chunk_index_list': chunk_indices  # 保留原始顺序的 chunk 索引
+        })
+
+    # 按综合得分降序排序
+    results.sort(key=lambda x: x['combined_similarity'], reverse=True)
+    return filter_documents_simple(results)
+
+# 过滤文件列表，进行缩减
+def filter_documents_simple(
+        ranked_docs: List[Dict[str, Any]],
+        min_docs: int = 5,
+        max_docs: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    """
+    if not ranked_docs:
+        return []
+
+    # 过滤0.75以上的文档
+    filtered = [
+        doc for doc in ranked_docs
+        if doc['combined_similarity'] >= 0.75
+    ]
+
+    # 不足5个,返回所有文档(最多10个)
+    if len(filtered) < min_docs:
+        return ranked_docs[:max_docs]
+
+    # 超过10个,截断
+    return filtered[:max_docs]
\ No newline at end of file
@@ -0,0 +1,350 @@
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class IvfAnnIndex:
+    """
+    IvfAnnIndex - 基于 NumPy 的 IVF（倒排文件）近似最近邻索引
+    与 DuckDB 数据库文件放在同一目录下持久化，支持按文档增量新增、删除，
+    检索时可按知识库过滤。数据量较小或过滤后候选较少时自动退化为精确扫描。
+    """
+
+    # 少于该数量的向量不训练聚类中心，直接精确扫描
+    MIN_TRAIN_SIZE = 4096
+    # 过滤后的候选向量少于该数量时直接精确扫描
+    EXACT_SCAN_LIMIT = 20000
+    # 向量数量超过上次训练规模的倍数时重新训练
+    RETRAIN_FACTOR = 4
+    # 删除比例超过该值时压缩存储
+    COMPACT_RATIO = 0.25
+    # 聚类训练采样的最大向量数
+    MAX_TRAIN_SAMPLE = 65536
+    KMEANS_ITERATIONS = 10
+
+    def __init__(self, index_file: str):
+        """
+        Args:
+            index_file: 索引文件路径（.npz）
+        """
+        self.index_file = index_file
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._reset(dim=0)
+
+    def _reset(self, dim: int):
+        self._dim = dim
+        self._size = 0
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._doc_ids = np.zeros(0, dtype=np.int64)
+        self._chunk_indices = np.zeros(0, dtype=np.int32)
+        self._kb_ids = np.zeros(0, dtype=np.int64)
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._alive_cnt = 0
+        self._centroids = None
+        self._trained_size = 0
+        self._doc_rows: Dict[int, np.ndarray] = {}
+        self._inverted = None
+
+    # -----------------------------
+    # 持久化
+    # -----------------------------
+    def load(self) -> bool:
+        """
+        从索引文件加载，文件不存在或损坏时返回 False
+        """
+        if not os.path.exists(self.index_file):
+            return False
+        try:
+            with np.load(self.index_file) as data:
+                vectors = data['vectors'].astype(np.float32, copy=False)
+                with self._lock:
+                    self._reset(dim=vectors.shape[1])
+                    self._size = vectors.shape[0]
+                    self._vectors = vectors
+                    self._doc_ids = data['doc_ids']
+                    self._chunk_indices = data['chunk_indices']
+                    self._kb_ids = data['kb_ids']
+                    self._lists = data['lists']
+                    self._alive = np.ones(self._size, dtype=bool)
+                    self._alive_cnt = self._size
+                    centroids = data['centroids']
+                    self._centroids = centroids if centroids.size > 0 else None
+                    self._trained_size = int(data['trained_size'])
+                    self._rebuild_doc_rows()
+            logging.debug(f"ANN 索引加载完成: {self.index_file}, 向量数 {self._size}")
+            return True
+        except Exception as e:
+            logging.error(f"ANN 索引文件损坏，将重新构建: {e}")
+            with self._lock:
+                self._reset(dim=0)
+            return False
+
+    def save(self):
+        """
+        压缩已删除的向量后写入索引文件（先写临时文件再替换，避免写一半时损坏）
+        """
+        with self._lock:
+            self._compact()
+            n = self._size
+            tmp_file = self.index_file + '.tmp.npz'
+            np.savez(tmp_file,
+                     vectors=self._vectors[:n],
+                     doc_ids=self._doc_ids[:n],
+                     chunk_indices=self._chunk_indices[:n],
+                     kb_ids=self._kb_ids[:n],
+                     lists=self._lists[:n],
+                     centroids=self._centroids if self._centroids is not None else np.zeros((0, self._dim),
+                                                                                             dtype=np.float32),
+                     trained_size=np.int64(self._trained_size))
+            os.replace(tmp_file, self.index_file)
+            self.dirty = False
+        logging.debug(f"ANN 索引已保存: {self.index_file}, 向量数 {n}")
+
+    # -----------------------------
+    # 增量维护
+    # -----------------------------
+    def doc_ids(self) -> set:
+        with self._lock:
+            return set(self._doc_rows.keys())
+
+    def __len__(self):
+        return self._alive_cnt
+
+    def add(self, document_id, knowledge_base_id, vectors, chunk_indices=None):
+        """
+        新增（或替换）一个文档的全部分片向量
+
+        Args:
+            document_id: 文档ID
+            knowledge_base_id: 文档所在的知识库ID
+            vectors: 分片向量，二维数组
+            chunk_indices: 每行向量对应的分片下标，默认行号即分片下标
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        document_id = int(document_id)
+        with self._lock:
+            self.remove(document_id)
+            if vectors.size == 0:
+                return
+            if self._dim == 0:
+                self._reset(dim=vectors.shape[1])
+            if vectors.shape[1] != self._dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self._dim} 不一致")
+
+            vectors = _normalize(vectors)
+            n = vectors.shape[0]
+            start = self._size
+            self._ensure_capacity(start + n)
+            rows = np.arange(start, start + n)
+            self._vectors[rows] = vectors
+            self._doc_ids[rows] = document_id
+            self._chunk_indices[rows] = np.arange(n) if chunk_indices is None else chunk_indices
+            self._kb_ids[rows] = int(knowledge_base_id)
+            self._lists[rows] = self._assign(vectors)
+            self._alive[rows] = True
+            self._size += n
+            self._alive_cnt += n
+            self._doc_rows[document_id] = rows
+            self._inverted = None
+            self.dirty = True
+
+            if self._need_train():
+                self.train()
+
+    def remove(self, document_id):
+        """
+        删除一个文档的全部分片向量（标记删除，保存时压缩）
+        """
+        document_id = int(document_id)
+        with self._lock:
+            rows = self._doc_rows.pop(document_id, None)
+            if rows is None:
+                return
+            self._alive[rows] = False
+            self._alive_cnt -= len(rows)
+            self.dirty = True
+            if (self._size - self._alive_cnt) / self._size > self.COMPACT_RATIO:
+                self._compact()
+
+    # -----------------------------
+    # 检索
+    # -----------------------------
+    def search(self, query_vector, kb_ids: Optional[Iterable] = None, top_k: int = 90,
+               nprobe: Optional[int] = None) -> List[Dict]:
+        """
+        检索与查询向量最相似的分片
+
+        Args:
+            query_vector: 查询向量
+            kb_ids: 限定的知识库ID集合，None 表示不限定
+            top_k: 返回数量
+            nprobe: 探查的倒排列表数量，默认按列表总数的 10% 取
+
+        Returns:
+            [{'document_id', 'chunk_index', 'cosine_similarity'}]，按相似度降序
+        """
+        q = _normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        with self._lock:
+            n = self._size
+            if self._alive_cnt == 0 or q.shape[0] != self._dim:
+                return []
+            mask = self._alive[:n].copy()
+            if kb_ids is not None:
+                mask &= np.isin(self._kb_ids[:n], np.fromiter((int(x) for x in kb_ids), dtype=np.int64))
+            cand_cnt = int(mask.sum())
+            if cand_cnt == 0:
+                return []
+
+            if self._centroids is None or cand_cnt <= self.EXACT_SCAN_LIMIT:
+                candidates = np.flatnonzero(mask)
+            else:
+                nlist = self._centroids.shape[0]
+                if nprobe is None:
+                    nprobe = max(8, int(np.ceil(nlist * 0.1)))
+                nprobe = min(nprobe, nlist)
+                probe = np.argpartition(-(self._centroids @ q), nprobe - 1)[:nprobe]
+                order, offsets = self._inverted_lists()
+                candidates = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in probe])
+                candidates = candidates[mask[candidates]]
+                if candidates.size == 0:
+                    return []
+
+            scores = self._vectors[candidates] @ q
+            k = min(top_k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = candidates[top]
+            sims = _angular_similarity(scores[top])
+            return [{
+                'document_id': int(self._doc_ids[r]),
+                'chunk_index': int(self._chunk_indices[r]),
+                'cosine_similarity': float(s)
+            } for r, s in zip(rows, sims)]
+
+    # -----------------------------
+    # 聚类训练
+    # -----------------------------
+    def train(self):
+        """
+        使用球面 k-means 训练聚类中心，并重新分配所有向量所属的倒排列表
+        """
+        with self._lock:
+            self._compact()
+            n = self._size
+            if n < self.MIN_TRAIN_SIZE:
+                self._centroids = None
+                self._lists[:n] = 0
+                self._trained_size = 0
+                return
+            nlist = int(min(4096, max(16, 2 * np.sqrt(n))))
+            rng = np.random.default_rng(0)
+            sample_cnt = min(n, max(nlist * 64, self.MAX_TRAIN_SAMPLE))
+            sample = self._vectors[rng.choice(n, sample_cnt, replace=False)]
+            centroids = sample[rng.choice(sample_cnt, nlist, replace=False)].copy()
+            for _ in range(self.KMEANS_ITERATIONS):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                empty = np.bincount(assign, minlength=nlist) == 0
+                # 空簇重新随机取一个样本作为中心
+                sums[empty] = sample[rng.choice(sample_cnt, int(empty.sum()), replace=False)]
+                centroids = _normalize(sums)
+            self._centroids = centroids
+            self._lists[:n] = self._assign(self._vectors[:n])
+            self._trained_size = n
+            self._inverted = None
+            self.dirty = True
+        logging.debug(f"ANN 索引训练完成: 向量数 {n}, 倒排列表数 {nlist}")
+
+    def _need_train(self) -> bool:
+        if self._centroids is None:
+            return self._alive_cnt >= self.MIN_TRAIN_SIZE
+        return self._alive_cnt > self._trained_size * self.RETRAIN_FACTOR
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.zeros(vectors.shape[0], dtype=np.int32)
+        lists = np.empty(vectors.shape[0], dtype=np.int32)
+        batch = 65536
+        for i in range(0, vectors.shape[0], batch):
+            lists[i:i + batch] = np.argmax(vectors[i:i + batch] @ self._centroids.T, axis=1)
+        return lists
+
+    def _inverted_lists(self):
+        if self._inverted is None:
+            n = self._size
+            order = np.argsort(self._lists[:n], kind='stable')
+            offsets = np.searchsorted(self._lists[:n][order], np.arange(self._centroids.shape[0] + 1))
+            self._inverted = (order, offsets)
+        return self._inverted
+
+    # -----------------------------
+    # 存储管理
+    # -----------------------------
+    def _ensure_capacity(self, n: int):
+        capacity = self._vectors.shape[0]
+        if n <= capacity:
+            return
+        new_capacity = max(n, capacity * 2, 1024)
+        self._vectors = _grow(self._vectors, new_capacity)
+        self._doc_ids = _grow(self._doc_ids, new_capacity)
+        self._chunk_indices = _grow(self._chunk_indices, new_capacity)
+        self._kb_ids = _grow(self._kb_ids, new_capacity)
+        self._lists = _grow(self._lists, new_capacity)
+        self._alive = _grow(self._alive, new_capacity)
+
+    def _compact(self):
+        n = self._size
+        if n == 0 or self._alive_cnt == n:
+            return
+        keep = np.flatnonzero(self._alive[:n])
+        self._vectors = self._vectors[keep]
+        self._doc_ids = self._doc_ids[keep]
+        self._chunk_indices = self._chunk_indices[keep]
+        self._kb_ids = self._kb_ids[keep]
+        self._lists = self._lists[keep]
+        self._alive = np.ones(keep.shape[0], dtype=bool)
+        self._size = keep.shape[0]
+        self._alive_cnt = self._size
+        self._rebuild_doc_rows()
+        self._inverted = None
+
+    def _rebuild_doc_rows(self):
+        n = self._size
+        self._doc_rows = {}
+        if n == 0:
+            return
+        doc_ids = self._doc_ids[:n]
+        order = np.argsort(doc_ids, kind='stable')
+        uniq, starts = np.unique(doc_ids[order], return_index=True)
+        ends = np.append(starts[1:], n)
+        for doc_id, s, e in zip(uniq, starts, ends):
+            rows = order[s:e]
+            rows = rows[self._alive[rows]]
+            if rows.size > 0:
+                self._doc_rows[int(doc_id)] = rows
+
+
+def _grow(arr: np.ndarray, capacity: int) -> np.ndarray:
+    new_arr = np.zeros((capacity,) + arr.shape[1:], dtype=arr.dtype)
+    new_arr[:arr.shape[0]] = arr
+    return new_arr
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-8)).astype(np.float32, copy=False)
+
+
+def _angular_similarity(cos_val: np.ndarray) -> np.ndarray:
+    """
+    与数据库中 cosine_similarity 函数一致的角度相似度：1 - arccos(cos) / π
+    """
+    return 1.0 - np.arccos(np.clip(cos_val, -1.0, 1.0)) / np.pi
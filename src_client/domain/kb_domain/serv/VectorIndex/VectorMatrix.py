@@ -0,0 +1,625 @@
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from domain.kb_domain.serv.VectorIndex.AnnIndex import _angular_similarity, _grow, _normalize
+
+
+class MemmapVectorMatrix:
+    """
+    MemmapVectorMatrix - 单个顶级知识库的分片向量矩阵
+    向量以 float32 行优先顺序追加写入数据文件（{name}.{generation}.f32），检索时通过 np.memmap 映射，
+    一次矩阵向量乘法完成精确打分，只有实际访问到的页面常驻内存。
+    每行对应的文档ID、分片下标、知识库ID及删除标记保存在同目录的 id 映射文件（{name}.ids.npz）中。
+    删除文档只做标记，删除比例超过阈值时在后台线程中压缩到新一代数据文件。
+    可选量化编码（int8 标量量化、1 bit 符号编码或 PCA 降维），保存在并列的编码文件中：
+    检索时先在紧凑编码上选出候选，再用全精度向量对候选重新打分。
+    """
+
+    # 量化方式：none 不量化，int8 标量量化（每行一个缩放系数），binary 1 bit 符号编码（汉明距离），
+    # pca 投影到按本矩阵向量拟合的主成分上（PCA_DIM 维 float32）
+    QUANTIZATION_MODES = ('none', 'int8', 'binary', 'pca')
+    # 量化检索时用全精度向量重新打分的候选数量：max(top_k * RESCORE_FACTOR, RESCORE_MIN)
+    # 符号编码的排序误差较大，需要更多候选
+    RESCORE_FACTOR = {'int8': 4, 'binary': 10, 'pca': 8}
+    RESCORE_MIN = 300
+    # 编码打分时每批处理的行数（批量小一些，转换出的临时矩阵可以留在 CPU 缓存中）
+    SCORE_BATCH = 1024
+    # PCA 降维后的维度、拟合时抽样的向量数
+    PCA_DIM = 128
+    PCA_SAMPLE = 20000
+    # 向量数少于该值时不拟合（全精度检索已经足够快），检索直接使用全精度向量
+    PCA_MIN_ROWS = 1000
+    # 向量数增长到拟合时的该倍数后重新拟合（needs_refit）
+    PCA_REFIT_GROWTH = 2.0
+
+    # 删除比例超过该值时后台压缩
+    COMPACT_RATIO = 0.25
+    # 压缩时每批复制的行数
+    COPY_BATCH = 65536
+
+    def __init__(self, matrix_dir: str, name: str, dim: int):
+        """
+        Args:
+            matrix_dir: 矩阵文件所在目录
+            name: 矩阵名称（顶级知识库ID）
+            dim: 向量维度
+        """
+        self.matrix_dir = matrix_dir
+        self.name = name
+        self.dirty = False
+        self._dim = dim
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._reset(generation=0)
+
+    def _reset(self, generation: int):
+        self._generation = generation
+        self._size = 0
+        self._alive_cnt = 0
+        self._doc_ids = np.zeros(0, dtype=np.int64)
+        self._chunk_indices = np.zeros(0, dtype=np.int32)
+        self._kb_ids = np.zeros(0, dtype=np.int64)
+        self._alive = np.zeros(0, dtype=bool)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._doc_rows: Dict[int, np.ndarray] = {}
+        self._mm = None
+        self._code_mm = None
+        self.quantization = 'none'
+        # PCA 降维：均值、主成分 (dim, PCA_DIM)、拟合时的向量数、拟合次数（编码文件名的一部分）
+        self._pca_mean: Optional[np.ndarray] = None
+        self._pca_components: Optional[np.ndarray] = None
+        self._pca_fit_rows = 0
+        self._pca_version = 0
+
+    @property
+    def id_file(self) -> str:
+        return os.path.join(self.matrix_dir, f"{self.name}.ids.npz")
+
+    def _data_file(self, generation: int) -> str:
+        return os.path.join(self.matrix_dir, f"{self.name}.{generation}.f32")
+
+    @property
+    def data_file(self) -> str:
+        return self._data_file(self._generation)
+
+    def _code_file(self, generation: int, quantization: str) -> str:
+        suffix = _CODE_SUFFIX[quantization]
+        if quantization == 'pca':
+            # 重新拟合时写入新文件，检索中仍在映射的旧文件不受影响
+            suffix += str(self._pca_version)
+        return os.path.join(self.matrix_dir, f"{self.name}.{generation}.{suffix}")
+
+    @property
+    def code_file(self) -> Optional[str]:
+        if not self._has_codes():
+            return None
+        return self._code_file(self._generation, self.quantization)
+
+    def _has_codes(self) -> bool:
+        # pca 方式在向量数达到 PCA_MIN_ROWS 并拟合之前没有编码
+        if self.quantization == 'pca':
+            return self._pca_components is not None
+        return self.quantization != 'none'
+
+    @property
+    def _row_bytes(self) -> int:
+        return self._dim * 4
+
+    def _code_shape(self, quantization: str):
+        if quantization == 'int8':
+            return np.int8, self._dim
+        if quantization == 'pca':
+            return np.float32, self._pca_components.shape[1]
+        return np.uint8, (self._dim + 7) // 8
+
+    # -----------------------------
+    # 持久化
+    # -----------------------------
+    def load(self) -> bool:
+        """
+        加载 id 映射并校验数据文件，文件不存在或不一致时返回 False（由调用方从数据库重建）
+        """
+        if not os.path.exists(self.id_file):
+            return False
+        try:
+            with np.load(self.id_file) as data:
+                generation = int(data['generation'])
+                size = int(data['doc_ids'].shape[0])
+                if int(data['dim']) != self._dim:
+                    raise ValueError(f"向量维度 {int(data['dim'])} 与配置维度 {self._dim} 不一致")
+                data_file = self._data_file(generation)
+                file_size = os.path.getsize(data_file) if os.path.exists(data_file) else 0
+                if file_size < size * self._row_bytes:
+                    raise ValueError(f"数据文件不完整: {data_file}")
+                if file_size > size * self._row_bytes:
+                    # 追加写入后未来得及保存 id 映射，丢弃多出的行
+                    with open(data_file, 'r+b') as f:
+                        f.truncate(size * self._row_bytes)
+                with self._lock:
+                    self._reset(generation)
+                    self._size = size
+                    self._doc_ids = data['doc_ids']
+                    self._chunk_indices = data['chunk_indices']
+                    self._kb_ids = data['kb_ids']
+                    self._alive = data['alive'].copy()
+                    self._alive_cnt = int(self._alive.sum())
+                    self._rebuild_doc_rows()
+                    quantization = str(data['quantization']) if 'quantization' in data else 'none'
+                    if quantization == 'pca':
+                        if 'pca_components' not in data or data['pca_components'].size == 0:
+                            quantization = 'none'
+                        else:
+                            self._pca_mean = data['pca_mean'].copy()
+                            self._pca_components = data['pca_components'].copy()
+                            self._pca_fit_rows = int(data['pca_fit_rows'])
+                            self._pca_version = int(data['pca_version'])
+                    code_file = self._code_file(generation, quantization) if quantization != 'none' else None
+                    code_dtype, code_width = self._code_shape(quantization)
+                    code_bytes = size * code_width * np.dtype(code_dtype).itemsize
+                    if code_file is not None and os.path.exists(code_file) and os.path.getsize(code_file) >= code_bytes:
+                        if os.path.getsize(code_file) > code_bytes:
+                            with open(code_file, 'r+b') as f:
+                                f.truncate(code_bytes)
+                        self.quantization = quantization
+                        self._scales = data['scales'].copy() if quantization == 'int8' else self._scales
+                    if self.quantization != 'pca':
+                        self._pca_mean = self._pca_components = None
+            self._remove_stale_files()
+            logging.debug(f"向量矩阵加载完成: {self.data_file}, 向量数 {self._alive_cnt}")
+            return True
+        except Exception as e:
+            logging.error(f"向量矩阵文件损坏，将重新构建: {e}")
+            self.drop()
+            return False
+
+    def save(self):
+        """
+        写入 id 映射（先写临时文件再替换），数据文件在追加时已写入
+        """
+        with self._lock:
+            n = self._size
+            tmp_file = self.id_file + '.tmp.npz'
+            np.savez(tmp_file,
+                     doc_ids=self._doc_ids[:n],
+                     chunk_indices=self._chunk_indices[:n],
+                     kb_ids=self._kb_ids[:n],
+                     alive=self._alive[:n],
+                     scales=self._scales[:n] if self.quantization == 'int8' else np.zeros(0, dtype=np.float32),
+                     quantization=np.str_(self.quantization),
+                     pca_mean=self._pca_mean if self._has_codes() and self.quantization == 'pca'
+                     else np.zeros(0, dtype=np.float32),
+                     pca_components=self._pca_components if self._has_codes() and self.quantization == 'pca'
+                     else np.zeros((0, 0), dtype=np.float32),
+                     pca_fit_rows=np.int64(self._pca_fit_rows),
+                     pca_version=np.int64(self._pca_version),
+                     generation=np.int64(self._generation),
+                     dim=np.int64(self._dim))
+            os.replace(tmp_file, self.id_file)
+            self.dirty = False
+
+    def drop(self):
+        """
+        清空矩阵并删除全部文件
+        """
+        with self._lock:
+            self._reset(generation=0)
+            self.dirty = False
+            for file in glob.glob(os.path.join(self.matrix_dir, f"{self.name}.*")):
+                _try_remove(file)
+
+    def _remove_stale_files(self):
+        keep = {os.path.normpath(self.id_file), os.path.normpath(self.data_file)}
+        if self.code_file is not None:
+            keep.add(os.path.normpath(self.code_file))
+        for file in glob.glob(os.path.join(self.matrix_dir, f"{self.name}.*")):
+            if os.path.normpath(file) not in keep:
+                _try_remove(file)
+
+    # -----------------------------
+    # 增量维护
+    # -----------------------------
+    def doc_ids(self) -> set:
+        with self._lock:
+            return set(self._doc_rows.keys())
+
+    def __len__(self):
+        return self._alive_cnt
+
+    def add(self, document_id, knowledge_base_id, vectors, chunk_indices=None):
+        """
+        追加（或替换）一个文档的全部分片向量
+
+        Args:
+            document_id: 文档ID
+            knowledge_base_id: 文档所在的知识库ID
+            vectors: 分片向量，二维数组
+            chunk_indices: 每行向量对应的分片下标，默认行号即分片下标
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        document_id = int(document_id)
+        with self._lock:
+            self.remove(document_id)
+            if vectors.size == 0:
+                return
+            if vectors.shape[1] != self._dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与矩阵维度 {self._dim} 不一致")
+            vectors = np.ascontiguousarray(_normalize(vectors))
+            n = vectors.shape[0]
+            os.makedirs(self.matrix_dir, exist_ok=True)
+            with open(self.data_file, 'ab') as f:
+                f.write(vectors.tobytes())
+
+            start = self._size
+            self._ensure_capacity(start + n)
+            rows = np.arange(start, start + n)
+            if self._has_codes():
+                codes, scales = self._quantize(vectors, self.quantization)
+                with open(self.code_file, 'ab') as f:
+                    f.write(codes.tobytes())
+                if scales is not None:
+                    self._scales[rows] = scales
+            self._doc_ids[rows] = document_id
+            self._chunk_indices[rows] = np.arange(n) if chunk_indices is None else chunk_indices
+            self._kb_ids[rows] = int(knowledge_base_id)
+            self._alive[rows] = True
+            self._size += n
+            self._alive_cnt += n
+            self._doc_rows[document_id] = rows
+            self._mm = None
+            self._code_mm = None
+            self.dirty = True
+
+    def remove(self, document_id):
+        """
+        删除一个文档的全部分片向量（标记删除，删除比例过高时后台压缩）
+        """
+        document_id = int(document_id)
+        with self._lock:
+            rows = self._doc_rows.pop(document_id, None)
+            if rows is None:
+                return
+            self._alive[rows] = False
+            self._alive_cnt -= len(rows)
+            self.dirty = True
+            if (self._size - self._alive_cnt) / self._size > self.COMPACT_RATIO and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self.compact, name=f"VectorMatrixCompact-{self.name}", daemon=True).start()
+
+    # -----------------------------
+    # 检索
+    # -----------------------------
+    def search(self, query_vector, kb_ids: Optional[Iterable] = None, top_k: int = 90,
+               quantized: bool = True) -> List[Dict]:
+        """
+        检索与查询向量最相似的分片
+
+        Args:
+            query_vector: 查询向量
+            kb_ids: 限定的知识库ID集合，None 表示不限定
+            top_k: 返回数量
+            quantized: 已开启量化时是否先在编码上选候选，False 时对全精度向量精确打分
+
+        Returns:
+            [{'document_id', 'chunk_index', 'cosine_similarity'}]，按相似度降序
+        """
+        q = _normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        with self._lock:
+            n = self._size
+            if self._alive_cnt == 0 or q.shape[0] != self._dim:
+                return []
+            matrix = self._matrix()
+            quantization = self.quantization if quantized and self._has_codes() else 'none'
+            codes = self._codes() if quantization != 'none' else None
+            pca_components = self._pca_components if quantization == 'pca' else None
+            scales = self._scales[:n] if quantization == 'int8' else None
+            mask = self._alive[:n].copy()
+            if kb_ids is not None:
+                mask &= np.isin(self._kb_ids[:n], np.fromiter((int(x) for x in kb_ids), dtype=np.int64))
+            doc_ids = self._doc_ids[:n]
+            chunk_indices = self._chunk_indices[:n]
+
+        cand_cnt = int(mask.sum())
+        k = min(top_k, cand_cnt)
+        if k == 0:
+            return []
+        if quantization == 'none':
+            # 一次矩阵向量乘法（BLAS）对全部行打分，无需持有锁
+            scores = matrix @ q
+            scores[~mask] = -np.inf
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            # 第一阶段：在紧凑编码上选出候选；第二阶段：读取候选的全精度向量重新打分
+            approx = self._score_codes(codes, scales, q if pca_components is None else q @ pca_components,
+                                       quantization)
+            approx[~mask] = -np.inf
+            rescore_cnt = min(cand_cnt, max(top_k * self.RESCORE_FACTOR[quantization], self.RESCORE_MIN))
+            candidates = np.sort(np.argpartition(-approx, rescore_cnt - 1)[:rescore_cnt])
+            scores = np.full(n, -np.inf, dtype=np.float32)
+            scores[candidates] = matrix[candidates] @ q
+            top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        sims = _angular_similarity(scores[top])
+        return [{
+            'document_id': int(doc_ids[r]),
+            'chunk_index': int(chunk_indices[r]),
+            'cosine_similarity': float(s)
+        } for r, s in zip(top, sims)]
+
+    def _score_codes(self, codes: np.ndarray, scales: Optional[np.ndarray], q: np.ndarray,
+                     quantization: str) -> np.ndarray:
+        n = codes.shape[0]
+        scores = np.empty(n, dtype=np.float32)
+        if quantization == 'int8':
+            for i in range(0, n, self.SCORE_BATCH):
+                block = codes[i:i + self.SCORE_BATCH].astype(np.float32)
+                scores[i:i + self.SCORE_BATCH] = (block @ q) * scales[i:i + self.SCORE_BATCH]
+        elif quantization == 'pca':
+            # q 已投影到主成分上；均值项对所有行相同，不影响排序
+            for i in range(0, n, self.COPY_BATCH):
+                scores[i:i + self.COPY_BATCH] = codes[i:i + self.COPY_BATCH] @ q
+        else:
+            q_code = np.packbits(q > 0)
+            for i in range(0, n, self.COPY_BATCH):
+                # 汉明距离越小越相似
+                xor = np.bitwise_xor(codes[i:i + self.COPY_BATCH], q_code)
+                scores[i:i + self.COPY_BATCH] = -_popcount(xor).sum(axis=1, dtype=np.int32)
+        return scores
+
+    def _matrix(self) -> np.ndarray:
+        if self._mm is None or self._mm.shape[0] != self._size:
+            self._mm = np.memmap(self.data_file, dtype=np.float32, mode='r', shape=(self._size, self._dim))
+        return self._mm
+
+    def _codes(self) -> np.ndarray:
+        if self._code_mm is None or self._code_mm.shape[0] != self._size:
+            code_dtype, code_width = self._code_shape(self.quantization)
+            self._code_mm = np.memmap(self.code_file, dtype=code_dtype, mode='r', shape=(self._size, code_width))
+        return self._code_mm
+
+    # -----------------------------
+    # 量化
+    # -----------------------------
+    def set_quantization(self, quantization: str, refit: bool = False):
+        """
+        切换量化方式，按全精度向量重新生成编码文件（持有锁，期间检索等待）
+
+        Args:
+            quantization: 量化方式
+            refit: 已是 pca 方式时按当前向量重新拟合主成分并重新生成编码
+        """
+        if quantization not in self.QUANTIZATION_MODES:
+            raise ValueError(f"不支持的量化方式: {quantization}")
+        # 等待后台压缩完成，压缩过程中编码文件不能替换（压缩只在持有锁时启动）
+        self._lock.acquire()
+        while self._compacting:
+            self._lock.release()
+            time.sleep(0.1)
+            self._lock.acquire()
+        try:
+            if quantization == self.quantization and not (refit and quantization == 'pca'):
+                return
+            old_code_file = self.code_file
+            self._code_mm = None
+            if quantization == 'pca':
+                self._fit_pca()
+            if quantization != 'none' and (quantization != 'pca' or self._pca_components is not None):
+                n = self._size
+                matrix = self._matrix() if n > 0 else None
+                scales = np.zeros(max(n, self._doc_ids.shape[0]), dtype=np.float32)
+                os.makedirs(self.matrix_dir, exist_ok=True)
+                with open(self._code_file(self._generation, quantization), 'wb') as f:
+                    for i in range(0, n, self.COPY_BATCH):
+                        codes, block_scales = self._quantize(np.asarray(matrix[i:i + self.COPY_BATCH]), quantization)
+                        f.write(codes.tobytes())
+                        if block_scales is not None:
+                            scales[i:i + block_scales.shape[0]] = block_scales
+                self._scales = scales
+            self.quantization = quantization
+            if quantization != 'pca':
+                self._pca_mean = self._pca_components = None
+                self._pca_fit_rows = 0
+            self.save()
+        finally:
+            self._lock.release()
+        if old_code_file is not None and old_code_file != self.code_file:
+            _try_remove(old_code_file)
+        logging.info(f"向量矩阵 {self.name} 量化方式切换为 {quantization}")
+
+    def needs_refit(self) -> bool:
+        """
+        pca 方式下向量数达到 PCA_MIN_ROWS 还未拟合，或比拟合时增长了 PCA_REFIT_GROWTH 倍，需要重新拟合
+        """
+        with self._lock:
+            if self.quantization != 'pca' or self._compacting:
+                return False
+            if self._pca_components is None:
+                return self._alive_cnt >= self.PCA_MIN_ROWS
+            return self._alive_cnt >= self._pca_fit_rows * self.PCA_REFIT_GROWTH
+
+    def _fit_pca(self):
+        # 按抽样的向量拟合主成分（协方差矩阵特征值最大的 PCA_DIM 个特征向量），向量数不足时不拟合
+        if self._alive_cnt < self.PCA_MIN_ROWS:
+            self._pca_mean = self._pca_components = None
+            self._pca_fit_rows = 0
+            return
+        sample = self.sample_vectors(self.PCA_SAMPLE, seed=self._pca_version)
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+        eigvals, eigvecs = np.linalg.eigh(centered.T @ centered)
+        k = min(self.PCA_DIM, self._dim)
+        self._pca_mean = mean.astype(np.float32)
+        self._pca_components = np.ascontiguousarray(eigvecs[:, ::-1][:, :k], dtype=np.float32)
+        self._pca_fit_rows = self._alive_cnt
+        self._pca_version += 1
+        explained = float(eigvals[::-1][:k].sum() / max(float(eigvals.sum()), 1e-12))
+        logging.info(f"向量矩阵 {self.name} PCA 拟合完成: {self._dim} -> {k} 维，"
+                     f"抽样 {sample.shape[0]}，保留方差 {explained:.2%}")
+
+    def _quantize(self, vectors: np.ndarray, quantization: str):
+        if quantization == 'pca':
+            return ((vectors - self._pca_mean) @ self._pca_components).astype(np.float32), None
+        return _quantize(vectors, quantization)
+
+    def sample_vectors(self, cnt: int, seed: int = 0) -> np.ndarray:
+        """
+        随机取未删除的全精度向量（用于评估量化召回率）
+        """
+        with self._lock:
+            alive_rows = np.flatnonzero(self._alive[:self._size])
+            if alive_rows.size == 0:
+                return np.zeros((0, self._dim), dtype=np.float32)
+            rng = np.random.default_rng(seed)
+            rows = np.sort(rng.choice(alive_rows, min(cnt, alive_rows.size), replace=False))
+            return np.asarray(self._matrix()[rows])
+
+    def memory_stats(self) -> Dict:
+        """
+        检索时需要扫描的字节数：全精度向量与量化编码对比
+        """
+        with self._lock:
+            n = self._size
+            full_bytes = n * self._row_bytes
+            if not self._has_codes():
+                code_bytes = full_bytes
+            else:
+                code_dtype, code_width = self._code_shape(self.quantization)
+                code_bytes = n * code_width * np.dtype(code_dtype).itemsize
+                if self.quantization == 'int8':
+                    code_bytes += n * 4
+            return {
+                'quantization': self.quantization,
+                'rows': n,
+                'full_bytes': full_bytes,
+                'code_bytes': code_bytes,
+                'saved_bytes': full_bytes - code_bytes,
+                'saved_ratio': round(1 - code_bytes / full_bytes, 4) if full_bytes else 0.0
+            }
+
+    # -----------------------------
+    # 压缩
+    # -----------------------------
+    def compact(self):
+        """
+        将未删除的行复制到新一代数据文件，复制期间仍可检索和追加，
+        完成后在锁内补齐复制期间追加的行并切换到新文件。
+        """
+        try:
+            with self._lock:
+                n0 = self._size
+                keep = np.flatnonzero(self._alive[:n0])
+                old_files = [self.data_file, self.code_file]
+                sources = [(self._matrix, self._data_file)]
+                if self._has_codes():
+                    quantization = self.quantization
+                    sources.append((self._codes, lambda g: self._code_file(g, quantization)))
+                old_arrays = [get_array() for get_array, _ in sources]
+                new_generation = self._generation + 1
+            new_files = [open(get_file(new_generation), 'wb') for _, get_file in sources]
+            try:
+                for f, old_array in zip(new_files, old_arrays):
+                    for i in range(0, keep.shape[0], self.COPY_BATCH):
+                        f.write(np.ascontiguousarray(old_array[keep[i:i + self.COPY_BATCH]]).tobytes())
+
+                with self._lock:
+                    # 压缩期间追加的行原样复制，压缩期间标记删除的行由 alive 带过去
+                    tail = np.arange(n0, self._size)
+                    if tail.size > 0:
+                        for f, (get_array, _) in zip(new_files, sources):
+                            f.write(np.ascontiguousarray(get_array()[tail]).tobytes())
+                    for f in new_files:
+                        f.close()
+                    rows = np.concatenate([keep, tail])
+                    self._doc_ids = self._doc_ids[rows]
+                    self._chunk_indices = self._chunk_indices[rows]
+                    self._kb_ids = self._kb_ids[rows]
+                    self._alive = self._alive[rows]
+                    # 非 int8 时 scales 没有内容，重置后随其他数组一起扩容，长度不能超过压缩后的容量
+                    self._scales = self._scales[rows] if self.quantization == 'int8' else np.zeros(0, dtype=np.float32)
+                    self._size = rows.shape[0]
+                    self._alive_cnt = int(self._alive.sum())
+                    self._generation = new_generation
+                    self._rebuild_doc_rows()
+                    self._mm = None
+                    self._code_mm = None
+                    self.save()
+            finally:
+                for f in new_files:
+                    f.close()
+            # 旧文件可能仍被检索中的映射占用（Windows），删除失败时留待下次加载清理
+            del old_arrays
+            for old_file in old_files:
+                if old_file is not None:
+                    _try_remove(old_file)
+            logging.debug(f"向量矩阵压缩完成: {self.data_file}, 向量数 {self._alive_cnt}")
+        except Exception as e:
+            logging.error(f"向量矩阵压缩失败: {e}", exc_info=True)
+        finally:
+            self._compacting = False
+
+    def _ensure_capacity(self, n: int):
+        capacity = self._doc_ids.shape[0]
+        if n <= capacity:
+            return
+        new_capacity = max(n, capacity * 2, 1024)
+        self._doc_ids = _grow(self._doc_ids, new_capacity)
+        self._chunk_indices = _grow(self._chunk_indices, new_capacity)
+        self._kb_ids = _grow(self._kb_ids, new_capacity)
+        self._alive = _grow(self._alive, new_capacity)
+        self._scales = _grow(self._scales, new_capacity)
+
+    def _rebuild_doc_rows(self):
+        n = self._size
+        self._doc_rows = {}
+        if n == 0:
+            return
+        doc_ids = self._doc_ids[:n]
+        order = np.argsort(doc_ids, kind='stable')
+        uniq, starts = np.unique(doc_ids[order], return_index=True)
+        ends = np.append(starts[1:], n)
+        for doc_id, s, e in zip(uniq, starts, ends):
+            rows = order[s:e]
+            rows = rows[self._alive[rows]]
+            if rows.size > 0:
+                self._doc_rows[int(doc_id)] = rows
+
+
+_CODE_SUFFIX = {'int8': 'i8', 'binary': 'b1', 'pca': 'pca'}
+
+
+def _quantize(vectors: np.ndarray, quantization: str):
+    """
+    计算量化编码
+
+    Returns:
+        codes: int8 编码 (n, dim) 或按位打包的符号编码 (n, dim / 8)
+        scales: int8 编码每行的缩放系数，符号编码为 None
+    """
+    if quantization == 'int8':
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return np.packbits(vectors > 0, axis=1), None
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+        return np.bitwise_count(x)
+    return _POPCOUNT_TABLE[x]
+
+
+def _try_remove(file: str):
+    try:
+        os.remove(file)
+    except OSError:
+        pass
@@ -0,0 +1,430 @@
+# 向量检索服务：维护与数据库文件并列保存的向量矩阵（精确检索）和 IVF 索引（大规模近似检索），
+# 数据库精确扫描作为兜底；IVF 索引另存一份全部向量，只在向量数超过 MATRIX_EXACT_LIMIT 时才构建和加载
+import glob
+import logging
+import os
+import threading
+from typing import List, Dict, Any, Optional
+
+from database.duckdb_config import duckdb_config
+from domain.kb_domain.dao import DocumentDao, DocumentChunkDao, KnowledgeBaseDao
+from domain.kb_domain.serv.VectorIndex.AnnIndex import IvfAnnIndex
+from domain.kb_domain.serv import SearchCacheServ
+from domain.kb_domain.serv.VectorIndex.VectorMatrix import MemmapVectorMatrix
+
+# 是否启用 ANN 索引检索，关闭后直接使用数据库精确扫描
+ANN_ENABLED = True
+# 是否启用向量矩阵精确检索
+MATRIX_ENABLED = True
+# 候选向量超过该数量且 ANN 索引就绪时改用 ANN 近似检索；向量矩阵的向量总数不超过该数量时不构建 ANN 索引
+MATRIX_EXACT_LIMIT = 1000000
+# 顶级知识库 extend_attrs 中保存量化方式及评估结果的键
+QUANTIZATION_ATTR = 'vector_quantization'
+QUANTIZATION_REPORT_ATTR = 'vector_quantization_report'
+# 同步索引时每批读取的文档数
+SYNC_BATCH = 500
+
+_ann_index: Optional[IvfAnnIndex] = None
+_ann_ready = False
+_lock = threading.Lock()
+
+# 顶级知识库ID -> 向量矩阵
+_matrices: Dict[str, MemmapVectorMatrix] = {}
+_matrix_ready = False
+
+
+def get_ann_index() -> IvfAnnIndex:
+    global _ann_index
+    with _lock:
+        if _ann_index is None:
+            _ann_index = IvfAnnIndex(duckdb_config['ann_index_file'])
+            _ann_index.load()
+        return _ann_index
+
+
+def is_ready() -> bool:
+    return ANN_ENABLED and _ann_ready
+
+
+def _loaded_ann_index() -> Optional[IvfAnnIndex]:
+    # 已构建的 ANN 索引，未构建（向量数未超过 MATRIX_EXACT_LIMIT）时为 None，文档变化时不需要更新
+    with _lock:
+        return _ann_index if ANN_ENABLED else None
+
+
+def _ann_needed() -> bool:
+    """
+    是否需要 ANN 索引：向量矩阵可用时只有向量总数超过 MATRIX_EXACT_LIMIT 才会用到（向量矩阵同步后才能判断）
+    """
+    if not ANN_ENABLED:
+        return False
+    if not MATRIX_ENABLED:
+        return True
+    with _lock:
+        return _matrix_ready and sum(len(m) for m in _matrices.values()) > MATRIX_EXACT_LIMIT
+
+
+def _release_ann_index():
+    # 不再需要 ANN 索引时释放内存并删除索引文件，再次超过 MATRIX_EXACT_LIMIT 时从数据库重新构建
+    global _ann_index, _ann_ready
+    with _lock:
+        released = _ann_index is not None
+        _ann_ready = False
+        _ann_index = None
+    if os.path.exists(duckdb_config['ann_index_file']):
+        os.remove(duckdb_config['ann_index_file'])
+    if released:
+        logging.info("向量数未超过 MATRIX_EXACT_LIMIT，释放 ANN 索引")
+
+
+# -----------------------------
+# 与数据库同步索引（启动时在向量矩阵同步之后执行，补齐索引中缺失的文档、剔除已删除的文档）
+# -----------------------------
+def sync_ann_index(force: bool = False):
+    """
+    Args:
+        force: 向量数未超过 MATRIX_EXACT_LIMIT 时也构建（检索基准测试对比 ANN 检索）
+    """
+    global _ann_ready
+    if not ANN_ENABLED:
+        return
+    if not force and not _ann_needed():
+        _release_ann_index()
+        return
+    index = get_ann_index()
+    db_doc_ids = set(DocumentChunkDao.get_vectorized_doc_ids())
+    index_doc_ids = index.doc_ids()
+
+    removed = index_doc_ids - db_doc_ids
+    for document_id in removed:
+        index.remove(document_id)
+
+    added = list(db_doc_ids - index_doc_ids)
+    for i in range(0, len(added), SYNC_BATCH):
+        for document_id, rows in DocumentChunkDao.get_vectors_by_docs(added[i:i + SYNC_BATCH]).items():
+            index.add(document_id, rows[0]['knowledge_base_id'], [row['chunk_vector'] for row in rows],
+                      [row['chunk_index'] for row in rows])
+
+    if index.dirty:
+        index.save()
+    _ann_ready = True
+    logging.info(f"ANN 索引同步完成: 新增文档 {len(added)}，删除文档 {len(removed)}，向量数 {len(index)}")
+
+
+# -----------------------------
+# 切换向量模型后重建全部索引（重建期间检索回退到数据库精确扫描）
+# -----------------------------
+def rebuild_all():
+    take_offline()
+    sync_vector_matrices()
+    sync_ann_index()
+
+
+def take_offline():
+    """
+    停用并删除全部向量矩阵和 ANN 索引，之后检索回退到数据库精确扫描，直到 rebuild_all / 同步完成
+    （切换向量模型时在替换数据库中的向量之前调用，避免新模型的查询向量检索旧模型的矩阵）
+    """
+    global _ann_index, _ann_ready, _matrix_ready
+    with _lock:
+        _ann_ready = False
+        _matrix_ready = False
+        _ann_index = None
+        matrices = list(_matrices.values())
+        _matrices.clear()
+    for matrix in matrices:
+        matrix.drop()
+    if os.path.exists(duckdb_config['ann_index_file']):
+        os.remove(duckdb_config['ann_index_file'])
+    # 未加载的向量矩阵文件也要删除，维度可能已经改变
+    for id_file in glob.glob(os.path.join(duckdb_config['vector_matrix_dir'], '*.ids.npz')):
+        root_id = os.path.basename(id_file).split('.')[0]
+        MemmapVectorMatrix(duckdb_config['vector_matrix_dir'], root_id, duckdb_config['vector_dim']).drop()
+
+
+# -----------------------------
+# 向量矩阵
+# -----------------------------
+def get_matrix(root_id) -> MemmapVectorMatrix:
+    root_id = str(root_id)
+    with _lock:
+        matrix = _matrices.get(root_id)
+        if matrix is None:
+            matrix = MemmapVectorMatrix(duckdb_config['vector_matrix_dir'], root_id, duckdb_config['vector_dim'])
+            matrix.load()
+            quantization = KnowledgeBaseDao.get_extend_attrs(root_id).get(QUANTIZATION_ATTR, 'none')
+            if quantization in MemmapVectorMatrix.QUANTIZATION_MODES and quantization != matrix.quantization:
+                matrix.set_quantization(quantization)
+            _matrices[root_id] = matrix
+        return matrix
+
+
+def sync_vector_matrices():
+    """
+    与数据库同步向量矩阵（启动时执行）：加载已有矩阵、补齐缺失的文档、剔除已删除的文档和知识库
+    """
+    global _matrix_ready
+    if not MATRIX_ENABLED:
+        return
+    matrix_dir = duckdb_config['vector_matrix_dir']
+    os.makedirs(matrix_dir, exist_ok=True)
+
+    db_docs: Dict[str, Dict[int, str]] = {}
+    for row in DocumentChunkDao.get_vectorized_docs():
+        db_docs.setdefault(row['root_id'], {})[int(row['document_id'])] = row['knowledge_base_id']
+
+    file_roots = {os.path.basename(f).split('.')[0] for f in glob.glob(os.path.join(matrix_dir, '*.ids.npz'))}
+    added_cnt, removed_cnt = 0, 0
+    for root_id in file_roots | set(db_docs.keys()):
+        matrix = get_matrix(root_id)
+        docs = db_docs.get(root_id)
+        if not docs:
+            matrix.drop()
+            with _lock:
+                _matrices.pop(root_id, None)
+            continue
+        index_doc_ids = matrix.doc_ids()
+        for document_id in index_doc_ids - docs.keys():
+            matrix.remove(document_id)
+            removed_cnt += 1
+        added = list(docs.keys() - index_doc_ids)
+        for i in range(0, len(added), SYNC_BATCH):
+            for document_id, rows in DocumentChunkDao.get_vectors_by_docs(added[i:i + SYNC_BATCH]).items():
+                matrix.add(document_id, docs[document_id], [row['chunk_vector'] for row in rows],
+                           [row['chunk_index'] for row in rows])
+                added_cnt += 1
+        if matrix.dirty:
+            matrix.save()
+    _matrix_ready = True
+    logging.info(f"向量矩阵同步完成: 新增文档 {added_cnt}，删除文档 {removed_cnt}，"
+                 f"向量数 {sum(len(m) for m in _matrices.values())}")
+
+
+def _search_matrices(query_vector, knowledge_base_id, top_k: int) -> Optional[List[Dict[str, Any]]]:
+    if not (MATRIX_ENABLED and _matrix_ready):
+        return None
+    if knowledge_base_id is not None and knowledge_base_id != '':
+        root_id = KnowledgeBaseDao.get_root_id(knowledge_base_id)
+        with _lock:
+            matrix = _matrices.get(root_id)
+        if matrix is None:
+            return []
+        if len(matrix) > MATRIX_EXACT_LIMIT and is_ready():
+            return None
+        # 查询的是顶级知识库时不需要再按知识库过滤
+        kb_ids = None if root_id == str(knowledge_base_id) else KnowledgeBaseDao.get_subtree_ids(knowledge_base_id)
+        return matrix.search(query_vector[0], kb_ids, top_k)
+
+    with _lock:
+        matrices = list(_matrices.values())
+    if sum(len(m) for m in matrices) > MATRIX_EXACT_LIMIT and is_ready():
+        return None
+    rows = []
+    for matrix in matrices:
+        rows.extend(matrix.search(query_vector[0], None, top_k))
+    rows.sort(key=lambda x: x['cosine_similarity'], reverse=True)
+    return rows[:top_k]
+
+
+# -----------------------------
+# 向量量化（按顶级知识库设置）
+# -----------------------------
+def set_quantization(knowledge_base_id, quantization: str) -> Dict[str, Any]:
+    """
+    设置知识库的向量量化方式（none / int8 / binary / pca），重新生成编码后评估召回率
+
+    Returns:
+        quantization_report 的评估结果
+    """
+    if quantization not in MemmapVectorMatrix.QUANTIZATION_MODES:
+        raise ValueError(f"不支持的量化方式: {quantization}")
+    root_id = KnowledgeBaseDao.get_root_id(knowledge_base_id) or str(knowledge_base_id)
+    KnowledgeBaseDao.update_extend_attrs(root_id, {QUANTIZATION_ATTR: quantization})
+    get_matrix(root_id).set_quantization(quantization)
+    SearchCacheServ.bump_generation(root_id)
+    report = quantization_report(root_id)
+    KnowledgeBaseDao.update_extend_attrs(root_id, {QUANTIZATION_REPORT_ATTR: report})
+    return report
+
+
+def quantization_report(knowledge_base_id, sample_cnt: int = 50, top_k: int = 90) -> Dict[str, Any]:
+    """
+    评估量化检索：编码相对全精度向量节省的字节数，以及以精确检索为基准的 recall@top_k。
+    查询向量取知识库中两个随机分片向量的均值，避免分片与自身完全匹配。
+    """
+    root_id = KnowledgeBaseDao.get_root_id(knowledge_base_id) or str(knowledge_base_id)
+    matrix = get_matrix(root_id)
+    report = matrix.memory_stats()
+    samples = matrix.sample_vectors(sample_cnt * 2)
+    recalls = []
+    for i in range(0, samples.shape[0] - 1, 2):
+        query_vector = [(samples[i] + samples[i + 1]).tolist()]
+        exact = {(r['document_id'], r['chunk_index']) for r in matrix.search(query_vector[0], None, top_k, quantized=False)}
+        approx = {(r['document_id'], r['chunk_index']) for r in matrix.search(query_vector[0], None, top_k)}
+        if exact:
+            recalls.append(len(exact & approx) / len(exact))
+    report['top_k'] = top_k
+    report['query_cnt'] = len(recalls)
+    report['recall'] = round(sum(recalls) / len(recalls), 4) if recalls else 1.0
+    logging.info(f"向量量化评估: 知识库 {root_id}, {report}")
+    return report
+
+
+# -----------------------------
+# 后台维护：pca 方式的向量矩阵随文档增加重新拟合主成分
+# -----------------------------
+def refit_reductions() -> int:
+    """
+    对向量数达到 PCA_MIN_ROWS 还未拟合、或比上次拟合时增长较多的矩阵重新拟合主成分，并更新召回率评估
+
+    Returns:
+        重新拟合的矩阵数
+    """
+    if not (MATRIX_ENABLED and _matrix_ready):
+        return 0
+    with _lock:
+        matrices = list(_matrices.values())
+    refitted = 0
+    for matrix in matrices:
+        if not matrix.needs_refit():
+            continue
+        matrix.set_quantization('pca', refit=True)
+        SearchCacheServ.bump_generation(matrix.name)
+        KnowledgeBaseDao.update_extend_attrs(matrix.name, {QUANTIZATION_REPORT_ATTR: quantization_report(matrix.name)})
+        refitted += 1
+    return refitted
+
+
+# -----------------------------
+# 文档加载完成后更新索引
+# -----------------------------
+def on_doc_loaded(document: Dict[str, Any], vectors):
+    loaded = document.get('kb_load_state') == '完成' and vectors is not None and len(vectors) > 0
+    ann_index = _loaded_ann_index()
+    if ann_index is not None:
+        try:
+            if loaded:
+                ann_index.add(document['document_id'], document['knowledge_base_id'], vectors)
+            else:
+                ann_index.remove(document['document_id'])
+        except Exception as e:
+            logging.error(f"ANN 索引更新失败: {e}", exc_info=True)
+    if MATRIX_ENABLED:
+        try:
+            root_id = KnowledgeBaseDao.get_root_id(document['knowledge_base_id'])
+            if root_id is not None and loaded:
+                get_matrix(root_id).add(document['document_id'], document['knowledge_base_id'], vectors)
+            elif root_id is not None:
+                get_matrix(root_id).remove(document['document_id'])
+        except Exception as e:
+            logging.error(f"向量矩阵更新失败: {e}", exc_info=True)
+    # 索引更新完成后再使检索缓存失效，避免更新期间的查询按旧索引的结果写入新一代缓存
+    SearchCacheServ.bump_generation(document['knowledge_base_id'])
+
+
+# -----------------------------
+# 后台补齐文档的分片向量后更新索引（按数据库中已向量化的分片重建该文档）
+# -----------------------------
+def on_doc_backfilled(document_id):
+    rows = DocumentChunkDao.get_vectors(document_id)
+    if not rows:
+        return
+    knowledge_base_id = rows[0]['knowledge_base_id']
+    vectors = [row['chunk_vector'] for row in rows]
+    chunk_indices = [row['chunk_index'] for row in rows]
+    ann_index = _loaded_ann_index()
+    if ann_index is not None:
+        try:
+            ann_index.add(document_id, knowledge_base_id, vectors, chunk_indices)
+        except Exception as e:
+            logging.error(f"ANN 索引更新失败: {e}", exc_info=True)
+    if MATRIX_ENABLED:
+        try:
+            root_id = KnowledgeBaseDao.get_root_id(knowledge_base_id)
+            if root_id is not None:
+                get_matrix(root_id).add(document_id, knowledge_base_id, vectors, chunk_indices)
+        except Exception as e:
+            logging.error(f"向量矩阵更新失败: {e}", exc_info=True)
+    SearchCacheServ.bump_generation(knowledge_base_id)
+
+
+# -----------------------------
+# 文档删除后更新索引
+# -----------------------------
+def on_doc_deleted(document_id, knowledge_base_id=None):
+    ann_index = _loaded_ann_index()
+    if ann_index is not None:
+        try:
+            ann_index.remove(document_id)
+        except Exception as e:
+            logging.error(f"ANN 索引删除失败: {e}", exc_info=True)
+    if MATRIX_ENABLED:
+        with _lock:
+            matrices = list(_matrices.values())
+        for matrix in matrices:
+            try:
+                matrix.remove(document_id)
+            except Exception as e:
+                logging.error(f"向量矩阵删除失败: {e}", exc_info=True)
+    SearchCacheServ.bump_generation(knowledge_base_id)
+
+
+# -----------------------------
+# 知识库删除后删除对应的向量矩阵（仅顶级知识库有独立的矩阵）
+# -----------------------------
+def on_kb_deleted(knowledge_base_id):
+    with _lock:
+        matrix = _matrices.pop(str(knowledge_base_id), None)
+    if matrix is not None:
+        matrix.drop()
+    SearchCacheServ.bump_generation(knowledge_base_id)
+
+
+# -----------------------------
+# 将索引的修改写入文件；向量总数超过 MATRIX_EXACT_LIMIT 时构建 ANN 索引，降到以下时释放
+# -----------------------------
+def flush():
+    ann_index = _loaded_ann_index()
+    if ANN_ENABLED and _matrix_ready and _ann_needed() != (ann_index is not None):
+        sync_ann_index()
+    elif ann_index is not None and ann_index.dirty:
+        ann_index.save()
+    with _lock:
+        matrices = list(_matrices.values())
+    for matrix in matrices:
+        if matrix.dirty:
+            matrix.save()
+
+
+# -----------------------------
+# 获取切片的余弦值 [{'document_id', 'chunk_index', 'cosine_similarity'}]
+# 优先使用向量矩阵精确检索，候选向量过多时使用 ANN 索引近似检索
+# 文件名、分片文本由 DocumentDao.search_docs 一次查询补齐
+# 都未就绪时返回 None，由调用方回退到数据库精确扫描
+# -----------------------------
+def search_chunks(query_vector, knowledge_base_id=None, top_k: int = 90) -> Optional[List[Dict[str, Any]]]:
+    rows = _search_matrices(query_vector, knowledge_base_id, top_k)
+    if rows is not None:
+        return rows
+    return search_ann(query_vector, knowledge_base_id, top_k)
+
+
+def search_ann(query_vector, knowledge_base_id=None, top_k: int = 90) -> Optional[List[Dict[str, Any]]]:
+    if not is_ready():
+        return None
+    kb_ids = None
+    if knowledge_base_id is not None and knowledge_base_id != '':
+        kb_ids = KnowledgeBaseDao.get_subtree_ids(knowledge_base_id)
+    return get_ann_index().search(query_vector[0], kb_ids, top_k)
+
+
+# -----------------------------
+# 以数据库精确扫描为基准，计算 ANN 检索的召回率
+# -----------------------------
+def check_recall(query_vector, knowledge_base_id=None, top_k: int = 90) -> Dict[str, Any]:
+    ann_rows = search_ann(query_vector, knowledge_base_id, top_k) or []
+    exact_rows = DocumentDao.get_chunk_cosine(query_vector, knowledge_base_id, top_k=top_k)
+    ann_set = {(r['document_id'], r['chunk_index']) for r in ann_rows}
+    exact_set = {(r['document_id'], r['chunk_index']) for r in exact_rows}
+    recall = len(ann_set & exact_set) / len(exact_set) if exact_set else 1.0
+    return {'recall': recall, 'ann_cnt': len(ann_set), 'exact_cnt': len(exact_set)}
@@ -0,0 +1,220 @@
+# 向量模型进程池：模型推理放到子进程中，不与主进程的 Tornado、pywebview 回调和文档解析争抢 GIL；
+# 每个子进程各自加载模型，向量结果写入共享内存返回（不经过 pickle），接口与 EmbeddingLoader 相同
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 子进程数上限
+MAX_WORKERS = 4
+# 每个子进程至少使用的推理线程数
+MIN_THREADS_PER_WORKER = 2
+# 每个子进程预计占用的内存（模型 + 推理中间结果）
+WORKER_MEMORY = {'torch': 800 * 1024 * 1024, 'onnx': 400 * 1024 * 1024}
+# 每个子进程共享内存可容纳的向量数，超过时分多次推理
+SHM_TEXTS = 256
+# 子进程加载模型的超时时间（秒），首次使用 ONNX 时包括导出和量化
+START_TIMEOUT = 600
+
+
+def default_workers(backend: str = 'torch') -> int:
+    """
+    按 CPU 核数和可用内存决定子进程数：主进程保留一个核，每个子进程至少 MIN_THREADS_PER_WORKER 个线程
+    """
+    cores = os.cpu_count() or 1
+    by_cpu = max(1, (cores - 1) // MIN_THREADS_PER_WORKER)
+    try:
+        import psutil
+        by_memory = max(1, psutil.virtual_memory().available // WORKER_MEMORY.get(backend, WORKER_MEMORY['torch']))
+    except Exception:
+        by_memory = 1
+    return int(min(by_cpu, by_memory, MAX_WORKERS))
+
+
+class EmbeddingProcessPool:
+    """
+    EmbeddingProcessPool - 多进程 Embedding 模型池
+    encode 把文本按长度交错分给各子进程并行推理，子进程把向量写入各自的共享内存，主进程只复制结果
+    """
+
+    def __init__(self, model_name_or_path=None, workers=0, pooling=None):
+        """
+        Args:
+            model_name_or_path: 预训练模型的名称或路径
+            workers: 子进程数，0 表示按 CPU 核数和可用内存决定
+            pooling: 池化方式（mean / cls），默认使用配置中的 pooling
+        """
+        from domain.kb_domain.serv.VectorModel.VectorLoader import load_config
+
+        self.model_name_or_path = model_name_or_path
+        self.pooling = pooling
+        self.workers = workers or default_workers(load_config()['backend'])
+        self.num_threads = max(1, ((os.cpu_count() or 1) - 1) // self.workers)
+        self.model_id = None
+        self._ctx = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._workers = [None] * self.workers
+        for i in range(self.workers):
+            self._workers[i] = self._start_worker()
+        atexit.register(self.close)
+        logging.debug(f"向量模型进程池启动完成: {self.workers} 个子进程，每个 {self.num_threads} 线程，模型 {self.model_id}")
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, name='EmbeddingWorker', daemon=True,
+                                    args=(child_conn, self.model_name_or_path, self.num_threads, self.pooling))
+        process.start()
+        child_conn.close()
+        if not parent_conn.poll(START_TIMEOUT):
+            process.terminate()
+            raise RuntimeError("向量模型子进程启动超时")
+        status, *payload = parent_conn.recv()
+        if status != 'ready':
+            process.join()
+            raise RuntimeError(f"向量模型子进程启动失败: {payload[0]}")
+        dim, model_id = payload
+        # 各子进程加载的是同一个模型，以第一个子进程报告的模型ID为准
+        if self.model_id is None:
+            self.model_id = model_id
+        shm = shared_memory.SharedMemory(create=True, size=SHM_TEXTS * dim * 4)
+        parent_conn.send(('attach', shm.name))
+        return {'process': process, 'conn': parent_conn, 'shm': shm, 'dim': dim}
+
+    def encode(self, texts, normalize=False):
+        """
+        将文本编码为向量（与 EmbeddingLoader.encode 相同）
+
+        Returns:
+            编码后的向量，numpy数组格式
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        with self._lock:
+            # 从长到短交错分配，各子进程的 token 总量接近
+            order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+            parts = [order[i::self.workers] for i in range(self.workers)]
+            embeddings = None
+            offset = 0
+            while any(offset < len(part) for part in parts):
+                sent = []
+                for worker_index, part in enumerate(parts):
+                    indexes = part[offset:offset + SHM_TEXTS]
+                    if indexes:
+                        worker = self._get_worker(worker_index)
+                        worker['conn'].send(('encode', [texts[i] for i in indexes]))
+                        sent.append((worker_index, indexes))
+                # 先收齐所有子进程的回复再报告错误，保证每个子进程的请求和回复一一对应
+                error = None
+                for worker_index, indexes in sent:
+                    try:
+                        vectors = self._receive(worker_index, len(indexes))
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if embeddings is None:
+                        embeddings = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+                    embeddings[indexes] = vectors
+                if error is not None:
+                    raise error
+                offset += SHM_TEXTS
+
+        if normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings
+
+    def _get_worker(self, worker_index):
+        # 子进程异常退出后重新启动
+        worker = self._workers[worker_index]
+        if not worker['process'].is_alive():
+            logging.error(f"向量模型子进程 {worker['process'].pid} 已退出（exitcode={worker['process'].exitcode}），重新启动")
+            self._release(worker)
+            worker = self._workers[worker_index] = self._start_worker()
+        return worker
+
+    def _receive(self, worker_index, n):
+        worker = self._workers[worker_index]
+        try:
+            status, *payload = worker['conn'].recv()
+        except EOFError:
+            raise RuntimeError("向量模型子进程意外退出")
+        if status != 'ok':
+            raise RuntimeError(f"向量模型子进程推理失败: {payload[0]}")
+        dim = payload[0]
+        return np.ndarray((n, dim), dtype=np.float32, buffer=worker['shm'].buf).copy()
+
+    def close(self):
+        """
+        结束全部子进程并释放共享内存
+        """
+        with self._lock:
+            for worker in self._workers:
+                if worker is not None:
+                    try:
+                        worker['conn'].send(('exit',))
+                    except Exception:
+                        pass
+                    worker['process'].join(5)
+                    self._release(worker)
+            self._workers = [None] * self.workers
+
+    def unload(self):
+        """
+        释放模型（与 EmbeddingLoader.unload 相同，切换模型后调用）
+        """
+        self.close()
+
+    @staticmethod
+    def _release(worker):
+        if worker['process'].is_alive():
+            worker['process'].terminate()
+        worker['conn'].close()
+        worker['shm'].close()
+        worker['shm'].unlink()
+
+
+# -----------------------------
+# 子进程
+# -----------------------------
+def _worker_main(conn, model_name_or_path, num_threads, pooling=None):
+    """
+    子进程入口：加载模型后循环处理编码请求，向量写入主进程分配的共享内存
+    """
+    # 限制 torch / onnxruntime 之外的数学库线程数，避免多个子进程超额占用 CPU
+    os.environ.setdefault('OMP_NUM_THREADS', str(num_threads))
+    try:
+        from domain.kb_domain.serv.VectorModel.VectorLoader import EmbeddingLoader
+        model = EmbeddingLoader(model_name_or_path=model_name_or_path, num_threads=num_threads, pooling=pooling)
+        dim = model.encode(['维度探测'])[0].shape[0]
+        conn.send(('ready', dim, model.model_id))
+    except Exception as e:
+        conn.send(('error', str(e)))
+        return
+
+    _, shm_name = conn.recv()
+    # 共享内存由主进程创建和释放，子进程只映射
+    shm = shared_memory.SharedMemory(name=shm_name)
+    output = np.ndarray((SHM_TEXTS, dim), dtype=np.float32, buffer=shm.buf)
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == 'exit':
+                break
+            try:
+                vectors = model.encode(message[1], normalize=False)
+                output[:len(vectors)] = vectors
+                conn.send(('ok', dim))
+            except Exception as e:
+                conn.send(('error', str(e)))
+    except EOFError:
+        pass
+    finally:
+        del output
+        shm.close()
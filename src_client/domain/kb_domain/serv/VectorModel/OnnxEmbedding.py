@@ -0,0 +1,181 @@
+import logging
+import os
+
+import numpy as np
+
+# 导出的 ONNX 模型保存在模型目录下的 onnx 子目录
+ONNX_DIR = 'onnx'
+ONNX_FILE = 'model.onnx'
+ONNX_INT8_FILE = 'model_int8.onnx'
+# 导出时使用的 opset 版本
+ONNX_OPSET = 17
+MAX_LENGTH = 512
+
+
+class OnnxEmbeddingModel:
+    """
+    OnnxEmbeddingModel - 使用 ONNX Runtime 推理的 Embedding 模型
+    首次使用时由 PyTorch 模型导出（可选动态 int8 量化），之后只依赖 onnxruntime 和 tokenizers，不再导入 torch
+    """
+
+    def __init__(self, model_name_or_path, quantize=True, intra_op_num_threads=0, pooling='mean'):
+        """
+        Args:
+            model_name_or_path: 预训练模型目录（含 tokenizer.json）
+            quantize: 是否使用动态 int8 量化后的模型
+            intra_op_num_threads: 推理线程数，0 表示由 onnxruntime 决定
+            pooling: 池化方式，mean（均值池化）或 cls（取 [CLS] 位置的向量）
+        """
+        self.model_name_or_path = model_name_or_path
+        self.quantize = quantize
+        self.pooling = pooling
+        self.intra_op_num_threads = intra_op_num_threads
+        self.onnx_file = None
+        self.session = None
+        self.tokenizer = None
+        self.pad_token_id = 0
+        self._input_names = set()
+
+    def load_model(self):
+        """
+        加载 ONNX 模型和分词器，模型文件不存在时先导出
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.onnx_file = ensure_onnx_model(self.model_name_or_path, self.quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.intra_op_num_threads:
+            options.intra_op_num_threads = self.intra_op_num_threads
+        self.session = ort.InferenceSession(self.onnx_file, sess_options=options,
+                                            providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        # 与 AutoTokenizer（fast）使用同一个 tokenizer.json，分词结果一致；补齐由调用方按批处理
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_name_or_path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=MAX_LENGTH)
+        self.tokenizer.no_padding()
+        self.pad_token_id = self.tokenizer.token_to_id('[PAD]')
+        logging.debug(f"ONNX 模型加载完成: {self.onnx_file}")
+
+    def tokenize(self, texts):
+        """
+        分词（截断到 MAX_LENGTH，不补齐）
+
+        Returns:
+            每条文本的 token id 列表
+        """
+        return [e.ids for e in self.tokenizer.encode_batch(texts)]
+
+    def run(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """
+        对已补齐的一批输入推理，返回池化后的向量（未单位化）
+        """
+        feeds = {'input_ids': input_ids.astype(np.int64), 'attention_mask': attention_mask.astype(np.int64)}
+        if 'token_type_ids' in self._input_names:
+            feeds['token_type_ids'] = np.zeros_like(feeds['input_ids'])
+        token_embeddings = self.session.run(['last_hidden_state'], feeds)[0]
+        if self.pooling == 'cls':
+            return token_embeddings[:, 0].astype(np.float32)
+        return mean_pooling(token_embeddings, attention_mask)
+
+    def encode(self, texts):
+        """
+        编码文本（整批补齐到最长），返回池化后的向量（未单位化），与 EmbeddingLoader 的结果一致
+
+        Returns:
+            numpy 数组，形状 (len(texts), dim)
+        """
+        ids = self.tokenize(texts)
+        max_len = max(len(x) for x in ids)
+        input_ids = np.full((len(ids), max_len), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(ids), max_len), dtype=np.int64)
+        for i, x in enumerate(ids):
+            input_ids[i, :len(x)] = x
+            attention_mask[i, :len(x)] = 1
+        return self.run(input_ids, attention_mask)
+
+
+def mean_pooling(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """
+    使用 attention mask 进行均值池化（numpy 版本）
+    """
+    mask = attention_mask[:, :, None].astype(np.float32)
+    sum_embeddings = (token_embeddings * mask).sum(axis=1)
+    sum_mask = np.clip(mask.sum(axis=1), 1e-9, None)
+    return (sum_embeddings / sum_mask).astype(np.float32)
+
+
+# -----------------------------
+# 导出与量化
+# -----------------------------
+def ensure_onnx_model(model_name_or_path, quantize=True) -> str:
+    """
+    返回 ONNX 模型文件路径，不存在时由 PyTorch 模型导出；需要量化时再生成动态 int8 量化模型
+    """
+    onnx_dir = os.path.join(model_name_or_path, ONNX_DIR)
+    onnx_file = os.path.join(onnx_dir, ONNX_FILE)
+    if not os.path.exists(onnx_file):
+        export_onnx(model_name_or_path, onnx_file)
+    if not quantize:
+        return onnx_file
+    int8_file = os.path.join(onnx_dir, ONNX_INT8_FILE)
+    if not os.path.exists(int8_file):
+        quantize_onnx(onnx_file, int8_file)
+    return int8_file
+
+
+def export_onnx(model_name_or_path, onnx_file):
+    """
+    导出 ONNX 模型（输出 last_hidden_state，batch、序列长度均为动态维度），先写临时文件再改名
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    logging.info(f"正在导出 ONNX 模型: {onnx_file}")
+    tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+    model = AutoModel.from_pretrained(model_name_or_path)
+    model.eval()
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, bert):
+            super().__init__()
+            self.bert = bert
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.bert(input_ids=input_ids, attention_mask=attention_mask,
+                             token_type_ids=token_type_ids).last_hidden_state
+
+    sample = tokenizer(['导出示例', '用于确定输入格式的示例文本'], padding=True, return_tensors='pt')
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    os.makedirs(os.path.dirname(onnx_file), exist_ok=True)
+    tmp_file = onnx_file + '.tmp'
+    with torch.no_grad():
+        torch.onnx.export(_LastHiddenState(model),
+                          tuple(sample[name] for name in input_names),
+                          tmp_file,
+                          input_names=input_names,
+                          output_names=['last_hidden_state'],
+                          dynamic_axes=dynamic_axes,
+                          opset_version=ONNX_OPSET,
+                          do_constant_folding=True,
+                          dynamo=False)
+    os.replace(tmp_file, onnx_file)
+    logging.info(f"ONNX 模型导出完成: {onnx_file}")
+
+
+def quantize_onnx(onnx_file, int8_file):
+    """
+    动态 int8 量化：权重离线量化为 int8，激活值在推理时按批量化（需要 onnx 包）
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logging.info(f"正在量化 ONNX 模型: {int8_file}")
+    tmp_file = int8_file + '.tmp'
+    quantize_dynamic(onnx_file, tmp_file, weight_type=QuantType.QInt8)
+    os.replace(tmp_file, int8_file)
+    logging.info(f"ONNX 模型量化完成: {int8_file}")
@@ -1,45 +1,164 @@
+import json
 import logging
+import os
 
-import torch
-from transformers import AutoTokenizer, AutoModel
 import numpy as np
 
+import client_global
 import frozen_support
 
+# 向量模型配置：backend 为 torch 或 onnx；onnx_quantize 为是否使用动态 int8 量化模型；
+# 默认 torch，onnx、int8 需手动开启：切换 backend / onnx_quantize 不会重新生成已入库的向量（只按 model 判断是否切换模型），
+# 开启前应确认与已入库向量的相似度一致；首次使用 onnx 时需要 torch 导出模型，并写入模型目录
+# intra_op_num_threads 为 ONNX 推理线程数（0 表示默认）；
+# token_budget 为每批补齐后的 token 总数上限，max_batch_size 为每批最多文本数；
+# process_pool 为是否在独立的子进程中推理（见 EmbeddingPool），process_workers 为子进程数（0 表示按 CPU 核数和可用内存决定）；
+# model 为使用的模型（lib/model 下的目录或绝对路径），pooling 为池化方式（mean / cls），
+# 修改 model 后由后台任务用新模型重新生成全部向量，完成后才切换（见 EmbeddingModelServ）；
+# chunk_mode 为分片方式：chars 按文档大小分档的字符数，tokens 按模型分词器的 token 数（分片不会在编码时被截断），
+# cdc 按内容确定分片边界（修改文档后未修改部分的分片不变，只需重新编码和写入修改的分片）；
+# chunk_tokens 为 tokens 方式每个分片的 token 数上限（不含 [CLS]、[SEP]），chunk_overlap_tokens 为相邻分片重叠的 token 数；
+# cdc_min_length、cdc_max_length 为 cdc 方式分片的最短、最长字符数，cdc_overlap 为相邻分片重叠的字符数
+DEFAULT_CONFIG = {
+    'model': 'BAAI/bge-small-zh-v1.5',
+    'pooling': 'mean',
+    'backend': 'torch',
+    'onnx_quantize': False,
+    'intra_op_num_threads': 0,
+    'token_budget': 8192,
+    'max_batch_size': 64,
+    'process_pool': False,
+    'process_workers': 0,
+    'chunk_mode': 'chars',
+    'chunk_tokens': 500,
+    'chunk_overlap_tokens': 50,
+    'cdc_min_length': 150,
+    'cdc_max_length': 450,
+    'cdc_overlap': 50,
+}
+MAX_LENGTH = 512
+
+# 模型路径 -> 分片用的分词器（加载失败时为 None）
+_chunk_tokenizers = {}
+
+
+def load_config():
+    """
+    读取 config/embedding_config.json，缺少的配置项使用默认值
+    """
+    config = dict(DEFAULT_CONFIG)
+    config_path = frozen_support.get_resource_path("../config/embedding_config.json")
+    if os.path.exists(config_path):
+        try:
+            with open(config_path, 'r', encoding='utf-8') as config_file:
+                config.update(json.load(config_file))
+        except Exception as e:
+            logging.error(f"向量模型配置读取失败，使用默认配置: {e}")
+    return config
+
+
+def create_embedding_model(model_name_or_path=None, pooling=None):
+    """
+    按配置创建向量模型：进程池（process_pool）或当前进程内的 EmbeddingLoader，两者接口相同（encode、model_id）
+    """
+    config = load_config()
+    if config['process_pool']:
+        try:
+            from domain.kb_domain.serv.VectorModel.EmbeddingPool import EmbeddingProcessPool
+            return EmbeddingProcessPool(model_name_or_path, config['process_workers'], pooling)
+        except Exception as e:
+            logging.error(f"向量模型进程池启动失败，改为在当前进程内推理: {e}", exc_info=True)
+    return EmbeddingLoader(model_name_or_path=model_name_or_path, pooling=pooling)
+
+
+def get_chunk_tokenizer(model_name_or_path=None):
+    """
+    分片用的快速分词器：与当前模型使用同一个 tokenizer.json，不截断，编码结果带每个 token 在原文中的字符位置（offsets）。
+    只依赖 tokenizers，模型在子进程中推理时主进程也可以使用；tokenizers 未安装或没有 tokenizer.json 时返回 None
+    """
+    model_name_or_path = model_name_or_path or client_global.model_name_or_path or frozen_support.get_vector_model_path()
+    if model_name_or_path not in _chunk_tokenizers:
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(os.path.join(model_name_or_path, 'tokenizer.json'))
+            tokenizer.no_truncation()
+            tokenizer.no_padding()
+        except Exception as e:
+            logging.error(f"分片分词器加载失败，按字符数分片: {e}")
+            tokenizer = None
+        _chunk_tokenizers[model_name_or_path] = tokenizer
+    return _chunk_tokenizers[model_name_or_path]
+
+
+def make_length_batches(lengths, token_budget, max_batch_size):
+    """
+    按 token 长度从长到短排序后分批：每批补齐到批内最长文本，补齐后的 token 总数不超过 token_budget
+    （单条超过预算的文本独占一批），避免短文本被长文本补齐到 512
+
+    Args:
+        lengths: 每条文本的 token 数
+        token_budget: 每批 token 总数上限（批内文本数 × 批内最长长度）
+        max_batch_size: 每批最多文本数
+
+    Returns:
+        每批文本在原列表中的下标
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch = []
+    for i in order:
+        # 从长到短排列，批内最长的是第一条
+        if batch and ((len(batch) + 1) * lengths[batch[0]] > token_budget or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
 
 class EmbeddingLoader:
     """
     EmbeddingLoader - 单例模式的Embedding模型加载器
-    确保多次调用只加载一次模型
+    确保多次调用只加载一次模型（按模型路径，切换模型时新旧模型可以同时存在）
     """
 
-    _instance = None
+    _instances = {}
     _initialized = False
 
-    def __new__(cls, model_name_or_path="sentence-transformers/all-MiniLM-L6-v2"):
+    def __new__(cls, model_name_or_path=None, num_threads=0, pooling=None):
         """
         实现单例模式
         """
-        if cls._instance is None:
-            cls._instance = super(EmbeddingLoader, cls).__new__(cls)
-        return cls._instance
+        if model_name_or_path not in cls._instances:
+            cls._instances[model_name_or_path] = super(EmbeddingLoader, cls).__new__(cls)
+        return cls._instances[model_name_or_path]
 
-    def __init__(self, model_name_or_path=None):
+    def __init__(self, model_name_or_path=None, num_threads=0, pooling=None):
         """
         初始化Embedding加载器
 
         Args:
             model_name_or_path: 预训练模型的名称或路径
+            num_threads: 推理线程数，0 表示默认（进程池的子进程按子进程数分配 CPU 核）
+            pooling: 池化方式（mean / cls），默认使用配置中的 pooling
         """
         # 防止重复初始化
         if self._initialized:
             return
+        self._instance_key = model_name_or_path
         if not model_name_or_path:
             model_name_or_path = frozen_support.get_resource_path('domain/kb_domain/serv/VectorModel/BAAI/bge-small-zh-v1.5')
         self.model_name_or_path = model_name_or_path
+        self.config = load_config()
+        self.backend = self.config['backend']
+        self.num_threads = num_threads
+        self.pooling = pooling or self.config['pooling']
+        if num_threads:
+            self.config['intra_op_num_threads'] = num_threads
         self.tokenizer = None
         self.model = None
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = None
         self._initialized = True
         self.load_model()
 
@@ -51,19 +170,58 @@ class EmbeddingLoader:
             logging.debug(f"模型 {self.model_name_or_path} 已经加载，无需重复加载")
             return
 
-        logging.debug(f"正在加载模型: {self.model_name_or_path}")
+        logging.debug(f"正在加载模型: {self.model_name_or_path}，后端: {self.backend}")
+        if self.backend == 'onnx':
+            try:
+                from domain.kb_domain.serv.VectorModel.OnnxEmbedding import OnnxEmbeddingModel
+                model = OnnxEmbeddingModel(self.model_name_or_path, self.config['onnx_quantize'],
+                                           self.config['intra_op_num_threads'], self.pooling)
+                model.load_model()
+                self.model = model
+                self.tokenizer = model.tokenizer
+                return
+            except Exception as e:
+                logging.error(f"ONNX 模型加载失败，改用 PyTorch: {e}", exc_info=True)
+                self.backend = 'torch'
+
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name_or_path)
         self.model = AutoModel.from_pretrained(self.model_name_or_path)
         self.model.to(self.device)
         self.model.eval()  # 设置为评估模式
         logging.debug(f"模型加载完成，设备: {self.device}")
 
-    def encode(self, texts):
+    @property
+    def model_id(self):
+        """
+        模型ID：模型目录名 + 推理后端（含量化方式）+ 池化方式，用作向量缓存的键，不同模型或量化方式的向量不混用
+        """
+        backend = self.backend
+        if backend == 'onnx' and self.config['onnx_quantize']:
+            backend = 'onnx-int8'
+        if self.pooling != 'mean':
+            backend = f"{backend}-{self.pooling}"
+        return f"{os.path.basename(os.path.normpath(self.model_name_or_path))}:{backend}"
+
+    def unload(self):
+        """
+        释放模型（切换模型后释放旧模型），之后再用同一路径创建时重新加载
+        """
+        EmbeddingLoader._instances.pop(self._instance_key, None)
+        self.model = None
+        self.tokenizer = None
+
+    def encode(self, texts, normalize=False):
         """
         将文本编码为向量
 
         Args:
             texts: 输入文本，可以是单个字符串或字符串列表
+            normalize: 是否将向量单位化（入库和检索的向量均需单位化）
 
         Returns:
             编码后的向量，numpy数组格式
@@ -74,33 +232,70 @@ class EmbeddingLoader:
         # 确保输入是列表格式
         if isinstance(texts, str):
             texts = [texts]
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
 
-        # 对文本进行tokenization
-        encoded_input = self.tokenizer(
-            texts,
-            padding=True,
-            truncation=True,
-            return_tensors='pt',
-            max_length=512
-        ).to(self.device)
+        # 分词后按长度分批推理，结果按原顺序写回
+        token_ids = self._tokenize(texts)
+        embeddings = None
+        for batch in make_length_batches([len(ids) for ids in token_ids], self.config['token_budget'],
+                                         self.config['max_batch_size']):
+            batch_embeddings = self._run_batch([token_ids[i] for i in batch])
+            if embeddings is None:
+                embeddings = np.zeros((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch] = batch_embeddings
+
+        if normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings
 
+    def _tokenize(self, texts):
+        """
+        分词（截断到 MAX_LENGTH，不补齐），返回每条文本的 token id 列表
+        """
+        if self.backend == 'onnx':
+            return self.model.tokenize(texts)
+        return self.tokenizer(texts, truncation=True, max_length=MAX_LENGTH)['input_ids']
+
+    def _run_batch(self, token_ids):
+        """
+        补齐到批内最长后推理，返回均值池化后的向量
+        """
+        max_len = max(len(ids) for ids in token_ids)
+        pad_token_id = self.model.pad_token_id if self.backend == 'onnx' else self.tokenizer.pad_token_id
+        input_ids = np.full((len(token_ids), max_len), pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(token_ids), max_len), dtype=np.int64)
+        for i, ids in enumerate(token_ids):
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+
+        if self.backend == 'onnx':
+            return self.model.run(input_ids, attention_mask)
+
+        import torch
+        encoded_input = {
+            'input_ids': torch.from_numpy(input_ids).to(self.device),
+            'attention_mask': torch.from_numpy(attention_mask).to(self.device),
+            'token_type_ids': torch.zeros((len(token_ids), max_len), dtype=torch.long, device=self.device),
+        }
         # 获取模型输出
         with torch.no_grad():
             model_output = self.model(**encoded_input)
-
             # 使用池化操作获取句子向量
-            # 这里使用均值池化，也可以使用其他池化方式
-            sentence_embeddings = self._mean_pooling(model_output, encoded_input['attention_mask'])
+            if self.pooling == 'cls':
+                sentence_embeddings = model_output.last_hidden_state[:, 0]
+            else:
+                sentence_embeddings = self._mean_pooling(model_output, encoded_input['attention_mask'])
 
         # 转换为numpy数组并移动到CPU
-        embeddings = sentence_embeddings.cpu().numpy()
-
-        return embeddings
+        return sentence_embeddings.cpu().numpy().astype(np.float32)
 
     def _mean_pooling(self, model_output, attention_mask):
         """
         使用attention mask进行均值池化
         """
+        import torch
         token_embeddings = model_output.last_hidden_state
         input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
 
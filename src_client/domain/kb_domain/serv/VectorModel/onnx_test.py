@@ -0,0 +1,89 @@
+# ONNX 向量模型测试：与 PyTorch 模型的余弦一致性，以及编码吞吐量对比
+# 运行（在 src_client 目录下）：python -m domain.kb_domain.serv.VectorModel.onnx_test
+import json
+import time
+
+import numpy as np
+
+import frozen_support
+
+TEXTS = [
+    '民法典继承人所得遗产实际价值是什么',
+    '昆明市名人故（旧）居保护暂行办法',
+    '写起诉书需要的信息',
+    '建筑设计防火规范 GB 50016-2014 第 5.5.17 条规定了安全疏散距离',
+    '合同当事人一方不履行合同义务或者履行合同义务不符合约定的，应当承担继续履行、采取补救措施或者赔偿损失等违约责任。',
+    'The quick brown fox jumps over the lazy dog.',
+    '劳动者在同一用人单位连续工作满十年以上，当事人双方同意续延劳动合同的，如果劳动者提出订立无固定期限的劳动合同，应当订立无固定期限的劳动合同。' * 4,
+    '会议纪要：一、项目进度；二、预算调整；三、下阶段工作安排。',
+]
+BATCH_SIZES = (1, 8, 32)
+REPEAT = 5
+
+
+def _torch_encoder(model_path):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from domain.kb_domain.serv.VectorModel.VectorLoader import EmbeddingLoader
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path)
+    model.eval()
+
+    def encode(texts):
+        encoded_input = tokenizer(texts, padding=True, truncation=True, return_tensors='pt', max_length=512)
+        with torch.no_grad():
+            output = model(**encoded_input)
+            return EmbeddingLoader._mean_pooling(None, output, encoded_input['attention_mask']).numpy()
+    return encode
+
+
+def _cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def _throughput(encode, texts):
+    result = {}
+    for batch_size in BATCH_SIZES:
+        batch = (texts * (batch_size // len(texts) + 1))[:batch_size]
+        encode(batch)
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            encode(batch)
+        result[f'batch_{batch_size}'] = round(batch_size * REPEAT / (time.perf_counter() - start), 1)
+    return result
+
+
+if __name__ == '__main__':
+    from domain.kb_domain.serv.VectorModel.OnnxEmbedding import OnnxEmbeddingModel
+
+    model_path = frozen_support.get_vector_model_path()
+    torch_encode = _torch_encoder(model_path)
+    reference = torch_encode(TEXTS)
+    report = {'torch': {'texts_per_second': _throughput(torch_encode, TEXTS)}}
+
+    for quantize in (False, True):
+        model = OnnxEmbeddingModel(model_path, quantize=quantize)
+        model.load_model()
+        onnx_vectors = model.encode(TEXTS)
+        cos = _cosine(reference, onnx_vectors)
+        # 检索一致性：以每条文本为查询，在全部文本中的最近邻排序是否与 PyTorch 一致
+        ref_unit = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+        onnx_unit = onnx_vectors / np.linalg.norm(onnx_vectors, axis=1, keepdims=True)
+        rank_agree = float(np.mean(np.argsort(-ref_unit @ ref_unit.T, axis=1)[:, 1]
+                                   == np.argsort(-onnx_unit @ onnx_unit.T, axis=1)[:, 1]))
+        report['onnx_int8' if quantize else 'onnx_fp32'] = {
+            'cosine_min': round(float(cos.min()), 6),
+            'cosine_mean': round(float(cos.mean()), 6),
+            'nearest_neighbor_agreement': rank_agree,
+            'texts_per_second': _throughput(model.encode, TEXTS),
+        }
+    for name in ('onnx_fp32', 'onnx_int8'):
+        report[name]['speedup'] = {k: round(v / report['torch']['texts_per_second'][k], 2)
+                                   for k, v in report[name]['texts_per_second'].items()}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    # fp32 应与 PyTorch 基本一致，int8 量化允许少量误差
+    assert report['onnx_fp32']['cosine_min'] > 0.9999, report['onnx_fp32']
+    assert report['onnx_int8']['cosine_min'] > 0.98, report['onnx_int8']
@@ -0,0 +1,55 @@
+# 向量模型切换测试：在临时数据库中分别切换到维度相同、维度不同的模型，检查向量列、向量缓存和模型状态
+import os
+import tempfile
+
+import numpy as np
+
+
+def _unit_vectors(n, dim):
+    vectors = np.random.default_rng(0).random((n, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def check_cutover(model_name, dim):
+    from database.duckdb_config import duckdb_config
+    from database.sys_duckdb import exesql
+    from domain.kb_domain.dao import EmbeddingModelDao
+
+    EmbeddingModelDao.register(model_name, dim, 'mean')
+    chunks = EmbeddingModelDao.get_pending_chunks(model_name, 100)
+    EmbeddingModelDao.stage_chunks(model_name, chunks, _unit_vectors(len(chunks), dim))
+    names = EmbeddingModelDao.get_pending_names(model_name, 100)
+    EmbeddingModelDao.stage_names(model_name, names, _unit_vectors(len(names), dim))
+    EmbeddingModelDao.cutover(model_name, dim, duckdb_config['vector_dim'], f'{model_name}:torch')
+    duckdb_config['vector_dim'] = dim
+
+    assert EmbeddingModelDao.get_active()['model_name'] == model_name
+    chunk_dims = {row['l'] for row in exesql("SELECT len(chunk_vector) AS l FROM document_chunk")}
+    name_dims = {row['l'] for row in exesql("SELECT len(file_name_vector) AS l FROM document")}
+    cache = exesql("SELECT DISTINCT model_id, len(vector) AS l FROM embedding_cache")
+    assert chunk_dims == {dim} and name_dims == {dim}, (chunk_dims, name_dims)
+    assert cache == [{'model_id': f'{model_name}:torch', 'l': dim}], cache
+    assert not exesql("SELECT * FROM reembed_chunk") and not exesql("SELECT * FROM reembed_document")
+    print(f"切换到 {model_name}（维度 {dim}）: 分片 {len(chunks)}，文件名 {len(names)}，缓存 {cache}")
+
+
+if __name__ == '__main__':
+    from domain.kb_domain.serv import search_benchmark
+
+    search_benchmark.prepare_database(tempfile.mkdtemp())
+    from database.duckdb_config import duckdb_config
+    from database.sys_duckdb import exesql, matrix_param
+    from domain.kb_domain.dao import DocumentChunkDao, EmbeddingModelDao
+
+    dim = duckdb_config['vector_dim']
+    exesql("INSERT INTO document (document_id, knowledge_base_id, file_name, file_content, file_name_vector) "
+           f"VALUES (1, 1, 'a.md', '甲乙丙', CAST(? AS FLOAT[{dim}]))", (matrix_param(_unit_vectors(1, dim))[1:-1],))
+    DocumentChunkDao.replace(1, ['甲', '乙', '丙'], _unit_vectors(3, dim))
+    exesql("INSERT INTO embedding_model (model_name, dim, pooling, state) VALUES ('old', ?, 'mean', ?)",
+           (dim, EmbeddingModelDao.STATE_ACTIVE))
+    exesql(f"INSERT INTO embedding_cache (model_id, text_hash, vector) VALUES ('old:torch', 1, CAST(? AS FLOAT[{dim}]))",
+           (matrix_param(_unit_vectors(1, dim))[1:-1],))
+
+    check_cutover('same_dim', dim)
+    check_cutover('new_dim', 8)
+    os._exit(0)
@@ -0,0 +1,550 @@
+# 检索基准测试：在临时 DuckDB 中生成合成语料，对比各检索引擎的延迟、召回率及文档聚合方式
+# 运行（在 src_client 目录下）：
+#   python -m domain.kb_domain.serv.search_benchmark --sizes 1000,10000,100000 --output search_benchmark.json
+# 结果以 JSON 输出，可在版本之间对比是否有性能回退
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import duckdb
+import numpy as np
+
+import frozen_support
+from database.duckdb_config import duckdb_config
+
+# 每个主题的词表大小
+TOPIC_VOCAB_SIZE = 40
+# 每个分片的词数
+CHUNK_WORDS = 24
+# 每篇文档的分片数：对数正态分布（中位数约 8 片，长尾到 MAX_CHUNKS）
+CHUNK_LOG_MEAN = 2.0
+CHUNK_LOG_SIGMA = 0.9
+MAX_CHUNKS = 100
+# 文档中心相对主题中心、分片相对文档中心的噪声（单位向量各维标准差的倍数）
+DOC_NOISE = 0.8
+CHUNK_NOISE = 1.2
+QUERY_NOISE = 1.0
+# 每批写入的文档数
+INSERT_BATCH = 2000
+# 对比的文档聚合方式
+AGG_METHODS = ('max', 'mean', 'weighted_max', 'top_k_mean')
+# 对比的检索引擎
+ENGINES = ('duckdb', 'matrix', 'matrix_int8', 'matrix_binary', 'matrix_pca', 'ann')
+# 分片检查的合成长文档字符数（覆盖 doc_spliter 的各个大小分档）
+CHUNK_CHECK_SIZES = (4000, 40000, 150000, 600000, 1500000)
+# 子知识库数量，文档轮流放入，检索范围为顶级知识库
+SUB_KB_CNT = 4
+ROOT_KB_ID = 1
+
+
+# -----------------------------
+# 临时数据库
+# -----------------------------
+def prepare_database(work_dir: str):
+    """
+    按 sql/duckdb_schema.sql 建立空数据库，必须在导入 database.sys_duckdb 之前调用（导入时会启动写入队列并执行迁移）
+    """
+    database = os.path.join(work_dir, 'bench.duck')
+    schema_file = os.path.join(frozen_support.get_base_path(), 'sql', 'duckdb_schema.sql')
+    with open(schema_file, encoding='utf-8') as f:
+        schema_sql = f.read()
+    conn = duckdb.connect(database=database)
+    try:
+        conn.execute(schema_sql)
+    finally:
+        conn.close()
+    duckdb_config['database'] = database
+    duckdb_config['ann_index_file'] = os.path.join(work_dir, 'bench.ann.npz')
+    duckdb_config['vector_matrix_dir'] = os.path.join(work_dir, 'bench.vectors')
+
+
+def _cjk_words(rng: np.random.Generator, n: int) -> List[str]:
+    chars = rng.integers(0x4e00, 0x9fa5, size=(n, 2))
+    return [chr(a) + chr(b) for a, b in chars]
+
+
+# -----------------------------
+# 合成语料
+# -----------------------------
+def build_corpus(doc_cnt: int, work_dir: str, seed: int) -> Dict[str, Any]:
+    """
+    生成合成语料并批量写入 document、document_chunk、chunk_term：
+    文档分属若干主题，文档向量围绕主题中心、分片向量围绕文档向量分布，分片文本取自主题词表。
+    全部分片向量另存一份 float32 文件，作为暴力检索的基准。
+
+    Returns:
+        语料信息：主题中心、文档主题、文档向量、分片向量文件等
+    """
+    from domain.kb_domain.dao import KnowledgeBaseDao
+    from util import TextTokenUtil
+
+    rng = np.random.default_rng(seed)
+    dim = duckdb_config['vector_dim']
+    topic_cnt = max(10, doc_cnt // 50)
+    topic_centers = _unit(rng.standard_normal((topic_cnt, dim)).astype(np.float32))
+    topic_vocab = [_cjk_words(rng, TOPIC_VOCAB_SIZE) for _ in range(topic_cnt)]
+
+    KnowledgeBaseDao.insert({'knowledge_base_id': ROOT_KB_ID, 'up_id': '0', 'knowledge_base_name': 'benchmark',
+                             'location_path': work_dir, 'kb_load_state': '完成'})
+    sub_kb_ids = [ROOT_KB_ID + 1 + i for i in range(SUB_KB_CNT)]
+    for kb_id in sub_kb_ids:
+        KnowledgeBaseDao.insert({'knowledge_base_id': kb_id, 'up_id': str(ROOT_KB_ID),
+                                 'knowledge_base_name': f'sub{kb_id}', 'location_path': work_dir,
+                                 'kb_load_state': '完成'})
+
+    doc_ids = np.arange(1, doc_cnt + 1, dtype=np.int64) + 1000000
+    doc_topics = rng.integers(0, topic_cnt, size=doc_cnt)
+    doc_vectors = _unit(topic_centers[doc_topics]
+                        + DOC_NOISE / np.sqrt(dim) * rng.standard_normal((doc_cnt, dim)).astype(np.float32))
+    chunk_cnts = np.clip(np.round(rng.lognormal(CHUNK_LOG_MEAN, CHUNK_LOG_SIGMA, size=doc_cnt)), 1, MAX_CHUNKS)
+    chunk_cnts = chunk_cnts.astype(np.int64)
+    total_chunks = int(chunk_cnts.sum())
+
+    vector_file = os.path.join(work_dir, 'chunks.f32')
+    all_vectors = np.memmap(vector_file, dtype=np.float32, mode='w+', shape=(total_chunks, dim))
+    chunk_doc_ids = np.repeat(doc_ids, chunk_cnts)
+    chunk_indices = np.concatenate([np.arange(c) for c in chunk_cnts])
+
+    conn = duckdb.connect(database=duckdb_config['database'])
+    try:
+        row = 0
+        for start in range(0, doc_cnt, INSERT_BATCH):
+            end = min(start + INSERT_BATCH, doc_cnt)
+            batch_rows = int(chunk_cnts[start:end].sum())
+            batch_doc_ids = doc_ids[start:end]
+            batch_kb_ids = [str(sub_kb_ids[i % SUB_KB_CNT]) for i in range(start, end)]
+            file_names = [f'{topic_vocab[doc_topics[i]][i % TOPIC_VOCAB_SIZE]}{i}.docx' for i in range(start, end)]
+            name_vectors = _unit(doc_vectors[start:end]
+                                 + CHUNK_NOISE / np.sqrt(dim) * rng.standard_normal((end - start, dim))
+                                 .astype(np.float32))
+
+            chunk_vectors = _unit(np.repeat(doc_vectors[start:end], chunk_cnts[start:end], axis=0)
+                                  + CHUNK_NOISE / np.sqrt(dim) * rng.standard_normal((batch_rows, dim))
+                                  .astype(np.float32))
+            all_vectors[row:row + batch_rows] = chunk_vectors
+
+            texts, term_rows = [], {'term_id': [], 'document_id': [], 'chunk_index': [], 'tf': []}
+            term_cnts = []
+            for i in range(start, end):
+                vocab = topic_vocab[doc_topics[i]]
+                words = rng.integers(0, TOPIC_VOCAB_SIZE, size=(chunk_cnts[i], CHUNK_WORDS))
+                chunks = [''.join(vocab[w] for w in ws) + f' doc{doc_ids[i]}' for ws in words]
+                texts.extend(chunks)
+                rows, cnts = TextTokenUtil.build_term_rows(int(doc_ids[i]), chunks)
+                for key in term_rows:
+                    term_rows[key].extend(rows[key])
+                term_cnts.extend(cnts)
+
+            _insert_documents(conn, batch_doc_ids, batch_kb_ids, file_names, work_dir, name_vectors)
+            _insert_chunks(conn, chunk_doc_ids[row:row + batch_rows], chunk_indices[row:row + batch_rows],
+                           texts, np.asarray(term_cnts, dtype=np.int32), chunk_vectors)
+            _insert_terms(conn, term_rows)
+            row += batch_rows
+        conn.execute("CHECKPOINT")
+    finally:
+        conn.close()
+    all_vectors.flush()
+
+    return {
+        'doc_ids': doc_ids,
+        'doc_topics': doc_topics,
+        'doc_vectors': doc_vectors,
+        'topic_vocab': topic_vocab,
+        'chunk_doc_ids': chunk_doc_ids,
+        'chunk_indices': chunk_indices,
+        'vector_file': vector_file,
+        'chunk_cnt': total_chunks,
+        'topic_cnt': topic_cnt,
+    }
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms < 1e-12] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def _register_vectors(conn, name: str, vectors: np.ndarray):
+    # 按行号、维度下标展开后注册，由 list(... ORDER BY) 还原为 FLOAT[dim]，避免转换为 Python 列表
+    n, dim = vectors.shape
+    conn.register(name, {'row_no': np.repeat(np.arange(n), dim), 'pos': np.tile(np.arange(dim), n),
+                         'x': np.ascontiguousarray(vectors).ravel()})
+
+
+def _insert_documents(conn, doc_ids, kb_ids, file_names, location, name_vectors):
+    dim = name_vectors.shape[1]
+    _register_vectors(conn, 'bench_name_vectors', name_vectors)
+    conn.register('bench_docs', {'row_no': np.arange(len(doc_ids)), 'document_id': doc_ids,
+                                 'knowledge_base_id': np.array(kb_ids), 'file_name': np.array(file_names)})
+    conn.execute(f"""
+        INSERT INTO document (document_id, knowledge_base_id, file_name, location_path, file_type,
+                              kb_load_state, file_name_vector)
+        SELECT d.document_id, d.knowledge_base_id, d.file_name, ? || '/' || d.file_name, 'docx', '完成', v.vec
+        FROM bench_docs d
+        JOIN (SELECT row_no, CAST(list(x ORDER BY pos) AS FLOAT[{dim}]) AS vec
+              FROM bench_name_vectors GROUP BY row_no) v ON v.row_no = d.row_no
+    """, (location,))
+    conn.unregister('bench_name_vectors')
+    conn.unregister('bench_docs')
+
+
+def _insert_chunks(conn, doc_ids, chunk_indices, texts, term_cnts, vectors):
+    dim = vectors.shape[1]
+    _register_vectors(conn, 'bench_chunk_vectors', vectors)
+    conn.register('bench_chunks', {'row_no': np.arange(len(doc_ids)), 'document_id': doc_ids,
+                                   'chunk_index': chunk_indices.astype(np.int32), 'chunk_text': np.array(texts),
+                                   'term_cnt': term_cnts})
+    conn.execute(f"""
+        INSERT INTO document_chunk (document_id, chunk_index, chunk_text, chunk_vector, term_cnt)
+        SELECT c.document_id, c.chunk_index, c.chunk_text, v.vec, c.term_cnt
+        FROM bench_chunks c
+        JOIN (SELECT row_no, CAST(list(x ORDER BY pos) AS FLOAT[{dim}]) AS vec
+              FROM bench_chunk_vectors GROUP BY row_no) v ON v.row_no = c.row_no
+    """)
+    conn.unregister('bench_chunk_vectors')
+    conn.unregister('bench_chunks')
+
+
+def _insert_terms(conn, term_rows):
+    conn.register('bench_terms', {key: np.asarray(values, dtype=np.int64) for key, values in term_rows.items()})
+    conn.execute("INSERT INTO chunk_term (term_id, document_id, chunk_index, tf) "
+                 "SELECT term_id, document_id, chunk_index, tf FROM bench_terms")
+    conn.unregister('bench_terms')
+
+
+# -----------------------------
+# 固定查询集
+# -----------------------------
+def build_queries(corpus: Dict[str, Any], query_cnt: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    每个查询对应一篇目标文档：查询向量为目标文档向量加噪声，查询文本取自目标文档的主题词表，
+    四分之一的查询带目标文档的编号（模拟条文编号、型号等精确词）
+    """
+    rng = np.random.default_rng(seed + 1)
+    dim = corpus['doc_vectors'].shape[1]
+    targets = rng.choice(len(corpus['doc_ids']), size=min(query_cnt, len(corpus['doc_ids'])), replace=False)
+    vectors = _unit(corpus['doc_vectors'][targets]
+                    + QUERY_NOISE / np.sqrt(dim) * rng.standard_normal((len(targets), dim)).astype(np.float32))
+    queries = []
+    for i, target in enumerate(targets):
+        vocab = corpus['topic_vocab'][corpus['doc_topics'][target]]
+        words = [vocab[w] for w in rng.integers(0, TOPIC_VOCAB_SIZE, size=3)]
+        text = ''.join(words)
+        if i % 4 == 0:
+            text += f" doc{corpus['doc_ids'][target]}"
+        queries.append({'vector': vectors[i:i + 1], 'text': text, 'document_id': int(corpus['doc_ids'][target]),
+                        'topic': int(corpus['doc_topics'][target])})
+    return queries
+
+
+def brute_force(corpus: Dict[str, Any], queries: List[Dict[str, Any]], top_k: int) -> List[List[tuple]]:
+    """
+    暴力检索基准：分块读取全部分片向量计算内积，取每个查询的前 top_k 个分片
+
+    Returns:
+        每个查询按分数从高到低排列的 (document_id, chunk_index)
+    """
+    dim = corpus['doc_vectors'].shape[1]
+    vectors = np.memmap(corpus['vector_file'], dtype=np.float32, mode='r', shape=(corpus['chunk_cnt'], dim))
+    query_matrix = np.vstack([q['vector'] for q in queries])
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    block = 65536
+    for start in range(0, corpus['chunk_cnt'], block):
+        scores = query_matrix @ np.asarray(vectors[start:start + block]).T
+        rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        best_scores = np.hstack([best_scores, scores])
+        best_rows = np.hstack([best_rows, rows])
+        if best_scores.shape[1] > top_k:
+            keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    return [[(int(corpus['chunk_doc_ids'][r]), int(corpus['chunk_indices'][r])) for r in rows] for rows in best_rows]
+
+
+# -----------------------------
+# 分片检查：编码时是否有分片被截断
+# -----------------------------
+def _synthetic_document(rng: np.random.Generator, size: int) -> str:
+    # 中文词组成句子，夹杂英文数字词，句子组成长度不一的段落
+    words = _cjk_words(rng, 2000) + [f'GB/T{i}-20{i % 30:02d}' for i in range(200)]
+    paragraphs, length = [], 0
+    while length < size:
+        sentences = []
+        for _ in range(int(rng.integers(1, 8))):
+            picked = rng.integers(0, len(words), size=int(rng.integers(5, 40)))
+            sentences.append(''.join(words[w] for w in picked) + '。')
+        paragraph = ''.join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 1
+    return '\n'.join(paragraphs)[:size]
+
+
+def check_chunking(seed: int) -> Dict[str, Any]:
+    """
+    对合成长文档分别按字符数（chars）、token 数（tokens）和内容（cdc）分片，统计超过模型最大长度、编码时被截断的分片及丢失的 token 数；
+    并在文档前部插入一行后重新分片，统计与修改前相同、可以复用的分片数（reused_ratio）
+
+    Returns:
+        {'chars': {...}, 'tokens': {...}, 'cdc': {...}}，分词器不可用时为 {'error': ...}
+    """
+    from domain.kb_domain.serv.DocLoadServ import doc_spliter
+    from domain.kb_domain.serv.VectorModel.VectorLoader import MAX_LENGTH, get_chunk_tokenizer
+    tokenizer = get_chunk_tokenizer()
+    if tokenizer is None:
+        return {'error': '分词器不可用（需要 tokenizers 及模型目录中的 tokenizer.json）'}
+    rng = np.random.default_rng(seed + 2)
+    documents = [_synthetic_document(rng, size) for size in CHUNK_CHECK_SIZES]
+    report = {}
+    edited_documents = []
+    for text in documents:
+        pos = text.find('\n', len(text) // 10) + 1
+        edited_documents.append(text[:pos] + '修改文档时插入的一行。\n' + text[pos:])
+    for mode in ('chars', 'tokens', 'cdc'):
+        stats = {'chunk_cnt': 0, 'truncated_cnt': 0, 'max_tokens': 0, 'total_tokens': 0, 'lost_tokens': 0,
+                 'edited_chunk_cnt': 0, 'reused_cnt': 0}
+        for text, edited in zip(documents, edited_documents):
+            chunks = doc_spliter(text, mode=mode)
+            edited_chunks = doc_spliter(edited, mode=mode)
+            original = set(chunks)
+            stats['edited_chunk_cnt'] += len(edited_chunks)
+            stats['reused_cnt'] += sum(chunk in original for chunk in edited_chunks)
+            # 加上 [CLS]、[SEP]
+            lengths = [len(e.ids) + 2 for e in tokenizer.encode_batch(chunks, add_special_tokens=False)]
+            stats['chunk_cnt'] += len(chunks)
+            stats['truncated_cnt'] += sum(n > MAX_LENGTH for n in lengths)
+            stats['max_tokens'] = max(stats['max_tokens'], max(lengths))
+            stats['total_tokens'] += sum(lengths)
+            stats['lost_tokens'] += sum(max(0, n - MAX_LENGTH) for n in lengths)
+        stats['lost_ratio'] = round(stats['lost_tokens'] / max(1, stats['total_tokens']), 4)
+        stats['reused_ratio'] = round(stats['reused_cnt'] / max(1, stats['edited_chunk_cnt']), 4)
+        report[mode] = stats
+    logging.info(f"分片检查: {report}")
+    return report
+
+
+# -----------------------------
+# 检索引擎
+# -----------------------------
+def use_engine(engine: str):
+    """
+    切换检索引擎：duckdb 为数据库精确扫描，matrix* 为向量矩阵（全精度 / int8 / 二值量化 / PCA 降维初筛），ann 为 IVF 索引
+    """
+    from domain.kb_domain.serv import VectorIndexServ
+    VectorIndexServ.MATRIX_ENABLED = engine.startswith('matrix')
+    VectorIndexServ.ANN_ENABLED = engine == 'ann'
+    if engine.startswith('matrix'):
+        quantization = engine.split('_')[1] if '_' in engine else 'none'
+        VectorIndexServ.set_quantization(ROOT_KB_ID, quantization)
+
+
+def engine_chunk_hits(query_vector, top_k: int):
+    from domain.kb_domain.dao import DocumentDao
+    from domain.kb_domain.serv import VectorIndexServ
+    hits = VectorIndexServ.search_chunks(query_vector, ROOT_KB_ID, top_k)
+    if hits is None:
+        hits, _ = DocumentDao.search_docs(query_vector, ROOT_KB_ID, top_k)
+    return hits
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    arr = np.asarray(values) * 1000
+    return {'p50_ms': round(float(np.percentile(arr, 50)), 3), 'p95_ms': round(float(np.percentile(arr, 95)), 3),
+            'p99_ms': round(float(np.percentile(arr, 99)), 3), 'mean_ms': round(float(arr.mean()), 3)}
+
+
+def peak_rss_mb():
+    """
+    进程峰值常驻内存（MB），取不到时返回 None
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def run_engine(engine: str, queries: List[Dict[str, Any]], truth: List[set], top_k: int,
+               recall_ks: List[int]) -> Dict[str, Any]:
+    from domain.kb_domain.dao import ChunkTermDao, DocumentDao
+    from domain.kb_domain.serv.SearchServ import (search_docs_by_query_vector, fuse_lexical_scores,
+                                                  rank_documents_by_similarity)
+    use_engine(engine)
+    # 预热：加载矩阵、建立数据库连接
+    search_docs_by_query_vector(queries[0]['vector'], queries[0]['text'], ROOT_KB_ID, use_cache=False)
+
+    latencies, chunk_latencies = [], []
+    recalls = {k: [] for k in recall_ks}
+    agg = {method: {'hit@1': 0, 'hit@5': 0, 'mrr': 0.0} for method in AGG_METHODS}
+    for query, exact in zip(queries, truth):
+        start = time.perf_counter()
+        search_docs_by_query_vector(query['vector'], query['text'], ROOT_KB_ID, use_cache=False, top_k=top_k)
+        latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        hits = engine_chunk_hits(query['vector'], top_k)
+        chunk_latencies.append(time.perf_counter() - start)
+        ranked = [(int(h['document_id']), int(h['chunk_index'])) for h in
+                  sorted(hits, key=lambda x: x['cosine_similarity'], reverse=True)]
+        for k in recall_ks:
+            recalls[k].append(len(set(ranked[:k]) & exact[k]) / max(1, len(exact[k])))
+
+        # 同一份检索结果按不同聚合方式排序文档（不设最低分），以目标文档的名次评估
+        chunk_hits = None if engine == 'duckdb' else hits
+        chunk_list, name_list = DocumentDao.search_docs(query['vector'], ROOT_KB_ID, top_k, chunk_hits=chunk_hits,
+                                                        query_terms=ChunkTermDao.query_terms(query['text']))
+        fuse_lexical_scores(chunk_list)
+        for method in AGG_METHODS:
+            docs = rank_documents_by_similarity([dict(c) for c in chunk_list], name_list,
+                                                chunk_agg_method=method, min_score=0.0)
+            doc_ids = [d['document_id'] for d in docs]
+            if query['document_id'] in doc_ids:
+                rank = doc_ids.index(query['document_id']) + 1
+                agg[method]['hit@1'] += rank == 1
+                agg[method]['hit@5'] += rank <= 5
+                agg[method]['mrr'] += 1.0 / rank
+
+    query_cnt = len(queries)
+    return {
+        'search_latency': _percentiles(latencies),
+        'chunk_latency': _percentiles(chunk_latencies),
+        'recall': {f'recall@{k}': round(float(np.mean(v)), 4) for k, v in recalls.items()},
+        'aggregation': {method: {key: round(value / query_cnt, 4) for key, value in stats.items()}
+                        for method, stats in agg.items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+# -----------------------------
+# 单个语料规模
+# -----------------------------
+def run_size(doc_cnt: int, engines: List[str], query_cnt: int, top_k: int, seed: int) -> Dict[str, Any]:
+    """
+    每个规模在独立的子进程中运行（数据库配置在导入时确定，峰值内存也按规模分别统计）
+    """
+    import subprocess
+    work_dir = tempfile.mkdtemp(prefix=f'search_bench_{doc_cnt}_')
+    try:
+        output_file = os.path.join(work_dir, 'result.json')
+        cmd = [sys.executable, '-m', 'domain.kb_domain.serv.search_benchmark', '--worker',
+               '--sizes', str(doc_cnt), '--engines', ','.join(engines), '--queries', str(query_cnt),
+               '--top-k', str(top_k), '--seed', str(seed), '--work-dir', work_dir, '--output', output_file]
+        subprocess.run(cmd, check=True, cwd=os.path.dirname(os.path.abspath(frozen_support.__file__)))
+        with open(output_file, encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_worker(doc_cnt: int, engines: List[str], query_cnt: int, top_k: int, seed: int,
+               work_dir: str) -> Dict[str, Any]:
+    prepare_database(work_dir)
+    from domain.kb_domain.serv import VectorIndexServ
+
+    start = time.perf_counter()
+    corpus = build_corpus(doc_cnt, work_dir, seed)
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    VectorIndexServ.sync_vector_matrices()
+    matrix_s = time.perf_counter() - start
+    start = time.perf_counter()
+    VectorIndexServ.sync_ann_index(force=True)
+    ann_s = time.perf_counter() - start
+
+    queries = build_queries(corpus, query_cnt, seed)
+    recall_ks = sorted({10, top_k})
+    # 各 k 的基准取暴力检索结果中分数最高的 k 个
+    truth = [{k: set(keys[:k]) for k in recall_ks} for keys in brute_force(corpus, queries, top_k)]
+
+    result = {
+        'doc_cnt': doc_cnt,
+        'chunk_cnt': corpus['chunk_cnt'],
+        'topic_cnt': corpus['topic_cnt'],
+        'query_cnt': len(queries),
+        'top_k': top_k,
+        'load_s': round(load_s, 2),
+        'matrix_sync_s': round(matrix_s, 2),
+        'ann_sync_s': round(ann_s, 2),
+        'engines': {},
+    }
+    for engine in engines:
+        logging.info(f"检索基准: {doc_cnt} 篇文档, 引擎 {engine}")
+        result['engines'][engine] = run_engine(engine, queries, truth, top_k, recall_ks)
+    compare_with_full_precision(result['engines'])
+    result['chunking'] = check_chunking(seed)
+    return result
+
+
+def compare_with_full_precision(engines: Dict[str, Any]):
+    """
+    量化 / 降维的向量矩阵与全精度矩阵对比：分片检索节省的延迟、损失的召回率，写入各引擎的 vs_matrix
+    """
+    base = engines.get('matrix')
+    if base is None:
+        return
+    for engine, stats in engines.items():
+        if not engine.startswith('matrix_'):
+            continue
+        stats['vs_matrix'] = {
+            'chunk_p50_ms_saved': round(base['chunk_latency']['p50_ms'] - stats['chunk_latency']['p50_ms'], 3),
+            'chunk_p95_ms_saved': round(base['chunk_latency']['p95_ms'] - stats['chunk_latency']['p95_ms'], 3),
+            **{f'{key}_lost': round(base['recall'][key] - value, 4) for key, value in stats['recall'].items()},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='知识库检索基准测试')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='文档数量，逗号分隔')
+    parser.add_argument('--engines', default=','.join(ENGINES), help='检索引擎，逗号分隔')
+    parser.add_argument('--queries', type=int, default=200, help='查询数量')
+    parser.add_argument('--top-k', type=int, default=90, help='分片检索数量')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='', help='结果 JSON 文件')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    engines = [e for e in args.engines.split(',') if e]
+    if args.worker:
+        result = run_worker(sizes[0], engines, args.queries, args.top_k, args.seed, args.work_dir)
+    else:
+        result = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'duckdb': duckdb.__version__,
+            'platform': platform.platform(),
+            'results': [run_size(size, engines, args.queries, args.top_k, args.seed) for size in sizes],
+        }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    if not args.worker:
+        print(text)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
+    # 写入队列为后台线程，直接退出
+    os._exit(0)
@@ -1,16 +1,33 @@
 # 关联目录时停止，关联完目录后运行
 import logging
 import os
+import queue
 import threading
+from collections import deque
 from datetime import datetime
 
 from domain.kb_domain.serv import KBServ
 import time
 
-from domain.kb_domain.dao import KnowledgeBaseDao, DocumentDao, ViewKbDocDao
+from database.sys_duckdb import transaction
+from domain.kb_domain.dao import KnowledgeBaseDao, DocumentDao, DocumentChunkDao, ViewKbDocDao, EmbeddingCacheDao
 from domain.kb_domain.serv import KBServ
+from domain.kb_domain.serv import VectorIndexServ, EmbeddingModelServ
+from domain.kb_domain.serv.DocLoad.LoaderFactory import LoaderFactory
 from domain.kb_domain.EvaluateJs import DocEvaJs
 
+# 加载流水线：解析子进程 -> 向量化服务（合并多个文档成批推理）-> 写入线程，各阶段之间的队列有上限，内存占用不随待加载文档数增长
+# 同时提交解析的文档数（解析子进程中排队和正在解析的）
+MAX_PARSING_DOCS = 8
+# 写入队列长度：已提交编码、等待写入的文档数（向量化服务把这些文档的分片合并成整批推理）
+MAX_PENDING_DOCS = 8
+# 写入线程每组最多处理的文档数：一组在一个事务中写入，提交后统一刷新待加载数量和知识库状态
+WRITE_GROUP_DOCS = 16
+# 每轮后台补齐大文档分片向量的最长时间（秒），之后回到扫描，新增、修改的文档优先加载
+BACKFILL_SECONDS = 30
+# 每轮用新模型重新生成向量的最长时间（秒），切换向量模型时使用
+REEMBED_SECONDS = 30
+
 
 class TaskScanAndLoad:
     """
@@ -26,6 +43,8 @@ class TaskScanAndLoad:
         self._task_duration_seconds = task_duration_seconds
         self._thread = None
         self._loading_doc_state = 'STOPPED'
+        # 最近一轮加载流水线各阶段的统计（get_pipeline_stats）
+        self._pipeline_stats = {}
 
     def _start_thread(self):
         """创建并启动新线程"""
@@ -52,13 +71,43 @@ class TaskScanAndLoad:
     def get_loading_doc_state(self):
         return self._loading_doc_state
 
+    def get_pipeline_stats(self):
+        """
+        最近一轮加载的统计：各阶段的耗时和吞吐量（文档/秒）
+
+        Returns:
+            {'docs': 文档数, 'elapsed_seconds': 总耗时, 'parse_seconds': 子进程解析耗时合计,
+             'parse_wait_seconds': 等待解析结果的时间, 'embed_wait_seconds': 写入线程等待编码结果的时间,
+             'write_seconds': 写入耗时, 'write_groups': 写入组数, 'docs_per_second', 'parse_docs_per_second',
+             'write_docs_per_second', 'loaders': 启动以来各格式各 Loader 的成功率（LoaderFactory.get_stats）}
+        """
+        stats = dict(self._pipeline_stats)
+        docs = stats.get('docs', 0)
+        for key, seconds in (('docs_per_second', 'elapsed_seconds'), ('parse_docs_per_second', 'parse_seconds'),
+                             ('write_docs_per_second', 'write_seconds')):
+            stats[key] = round(docs / stats[seconds], 2) if stats.get(seconds) else 0.0
+        stats['loaders'] = LoaderFactory.get_stats()
+        return stats
+
     def _run(self):
         """线程主循环"""
+        # 先同步向量矩阵，按向量数决定是否需要 ANN 索引
+        try:
+            VectorIndexServ.sync_vector_matrices()
+        except Exception as e:
+            logging.error(f"向量矩阵同步失败: {e}", exc_info=True)
+        try:
+            VectorIndexServ.sync_ann_index()
+        except Exception as e:
+            logging.error(f"ANN 索引同步失败: {e}", exc_info=True)
         while True:
             if self._state == 'RUNNING':
                 try:
                     KBServ.get_all_kb_change()
-                    self.load_kb_docs() #todo 后续考虑改成并发执行，整个加载结束后再继续执行
+                    self.load_kb_docs()
+                    self.backfill_chunks()
+                    self.reembed_models()
+                    VectorIndexServ.refit_reductions()
                 except Exception as e:
                     logging.debug(e)
             elif self._state == 'SCAN_ONLY':
@@ -69,45 +118,276 @@ class TaskScanAndLoad:
             time.sleep(self._task_duration_seconds)
 
     def load_kb_docs(self):
+        """
+        加载待修改列表：文件在解析子进程中并行解析，解析完成后按顺序提交编码，由写入线程等待编码结果并分组写入。
+        知识库和删除操作也交给写入线程，与文档写入保持原来的顺序；停止时尚未开始解析的文档留到下次加载
+        """
+        from domain.kb_domain.serv.DocLoadServ import start_load_doc, submit_parse
         # 获取待修改列表
         wait_load_list = ViewKbDocDao.get_wait_load_list()
-        for _tmp in wait_load_list:
-            if self._state != "RUNNING":
-                break
-            if _tmp['knowledge_base_id'] is not None:  # 判断是否是知识库，如为True则为知识库
-                # 知识库
-                if _tmp['kb_load_state'] == '已删除':
-                    KnowledgeBaseDao.delete(_tmp['knowledge_base_id'])
-                    # 修改前端知识库状态
-                    KBServ.refresh_up_kb_state(_tmp['up_id'])
-                else:
-                    KBServ.refresh_up_kb_state(_tmp['knowledge_base_id'])
-            else:
-                # 文件
-                if _tmp['kb_load_state'] == '已删除':
-                    DocumentDao.delete(_tmp['document_id'])
+        stats = {'docs': 0, 'elapsed_seconds': 0.0, 'parse_seconds': 0.0, 'parse_wait_seconds': 0.0,
+                 'embed_wait_seconds': 0.0, 'write_seconds': 0.0, 'write_groups': 0}
+        started = time.perf_counter()
+        # 已提交解析的文档 (doc, 解析 Future)，按提交顺序提交编码
+        parsing = deque()
+        writer = _DocWriter(stats)
+        changed = False
+
+        def start_embedding(doc, parse_future):
+            wait_start = time.perf_counter()
+            try:
+                parsed = parse_future.result()
+                stats['parse_seconds'] += parsed['parse_seconds']
+            except Exception as e:
+                logging.error(f"文件 {doc['location_path']} 解析失败: {e}", exc_info=True)
+                parsed = None
+                doc['kb_load_state'] = '不支持'
+            stats['parse_wait_seconds'] += time.perf_counter() - wait_start
+            future = start_load_doc(doc, parsed=parsed)[1] if parsed is not None else None
+            stats['docs'] += 1
+            # 写入队列满时在这里等待，等待编码结果的文档数不超过 MAX_PENDING_DOCS
+            writer.put(_WriteItem(prepare=lambda: self._wait_loaded_doc(doc, future, stats),
+                                  write=self._write_loaded_doc, finish=self._index_loaded_doc))
+
+        def submit_action(item):
+            # 知识库、删除操作之前的文档先全部提交，写入线程按顺序执行
+            while parsing:
+                start_embedding(*parsing.popleft())
+            writer.put(item)
+
+        try:
+            for _tmp in wait_load_list:
+                if self._state != "RUNNING":
+                    break
+                if _tmp['knowledge_base_id'] is not None:  # 判断是否是知识库，如为True则为知识库
+                    # 知识库
+                    if _tmp['kb_load_state'] == '已删除':
+                        changed = True
+                        # 删除后修改前端上级知识库状态
+                        submit_action(_WriteItem(write=lambda _, _tmp=_tmp: KnowledgeBaseDao.delete(_tmp['knowledge_base_id']),
+                                                 finish=lambda _, _tmp=_tmp: _tmp['up_id']))
+                    else:
+                        submit_action(_WriteItem(finish=lambda _, _tmp=_tmp: _tmp['knowledge_base_id']))
+                elif _tmp['kb_load_state'] == '已删除':
+                    # 文件
+                    changed = True
+                    submit_action(self._delete_doc_item(_tmp['document_id'], _tmp['up_id'], _tmp))
                 else:
                     doc = DocumentDao.get_by_id(_tmp['document_id'])
+                    changed = True
                     # 本地文件信息local_doc 先看是否删除
                     if not os.path.exists(doc['location_path']):
-                        DocumentDao.delete(doc['document_id'])
+                        _tmp['kb_load_state'] = '已删除'
+                        submit_action(self._delete_doc_item(doc['document_id'], doc['knowledge_base_id'], _tmp))
+                        continue
                     # 获取本地文件大小和修改时间
                     file_stat = os.stat(doc['location_path'])
                     local_size = file_stat.st_size
                     local_timestamp = file_stat.st_mtime
                     doc['file_size'] = int(local_size)
                     doc['file_timestamp'] = int(local_timestamp)
-                    from domain.kb_domain.serv.DocLoadServ import load_doc
                     self._loading_doc_state = 'RUNNING'
-                    _tmp = load_doc(doc)
-                    self._loading_doc_state = 'STOPPED'
-                    DocumentDao.update(_tmp['document_id'], _tmp)
-                # 修改前端文件状态
-                DocEvaJs.update_doc_state(_tmp['document_id'], _tmp['kb_load_state'])
-                # 修改待加载数量
-                KBServ.update_wait_load_num()
-                # 修改前端知识库状态
-                KBServ.refresh_up_kb_state(_tmp['knowledge_base_id'])
+                    parsing.append((doc, submit_parse(doc['location_path'])))
+                    while len(parsing) > MAX_PARSING_DOCS:
+                        start_embedding(*parsing.popleft())
+        finally:
+            try:
+                while parsing:
+                    doc, parse_future = parsing.popleft()
+                    # 停止时还没有开始解析的文档不再加载，保持待加载状态
+                    if self._state != "RUNNING" and parse_future.cancel():
+                        continue
+                    start_embedding(doc, parse_future)
+            finally:
+                writer.close()
+                stats['elapsed_seconds'] = time.perf_counter() - started
+                self._pipeline_stats = stats
+                self._loading_doc_state = 'STOPPED'
+        if stats['docs']:
+            pipeline = self.get_pipeline_stats()
+            logging.info(f"文档加载 {pipeline['docs']} 个，耗时 {pipeline['elapsed_seconds']:.1f}s（{pipeline['docs_per_second']} 个/秒）；"
+                         f"解析 {pipeline['parse_docs_per_second']} 个/秒，等待解析 {pipeline['parse_wait_seconds']:.1f}s，"
+                         f"等待编码 {pipeline['embed_wait_seconds']:.1f}s，写入 {pipeline['write_docs_per_second']} 个/秒"
+                         f"（{pipeline['write_groups']} 组）")
+        # 本轮加载结束，索引修改写入文件
+        VectorIndexServ.flush()
+        # 清理不再被任何分片引用的向量缓存（修改前的旧分片、已删除文档的分片）
+        if changed:
+            try:
+                removed = EmbeddingCacheDao.gc()
+                if removed:
+                    logging.debug(f"清理向量缓存 {removed} 条")
+            except Exception as e:
+                logging.error(f"向量缓存清理失败: {e}", exc_info=True)
+
+    def _wait_loaded_doc(self, doc, future, pipeline_stats):
+        """等待文档编码完成（写入线程在事务外调用）"""
+        from domain.kb_domain.serv.DocLoadServ import finish_load_doc
+        wait_start = time.perf_counter()
+        _tmp = finish_load_doc(doc, future)
+        pipeline_stats['embed_wait_seconds'] += time.perf_counter() - wait_start
+        return {'doc': _tmp,
+                'chunks': _tmp.pop('file_content_chunks', None),
+                'spans': _tmp.pop('file_content_spans', None),
+                'positions': _tmp.pop('file_content_positions', None),
+                'chunk_vectors': _tmp.pop('file_content_chunks_vector', None)}
+
+    def _write_loaded_doc(self, loaded):
+        """写入文档及其分片、向量（只写数据库，组事务回滚后可以重新执行）"""
+        _tmp = loaded['doc']
+        DocumentDao.update(_tmp['document_id'], _tmp)
+        loaded['stats'] = DocumentChunkDao.replace(_tmp['document_id'], loaded['chunks'], loaded['chunk_vectors'],
+                                                   loaded['spans'], loaded['positions'])
+        return loaded
+
+    def _index_loaded_doc(self, loaded):
+        """写入提交后更新索引和前端文件状态，返回需要刷新状态的知识库ID"""
+        _tmp, chunks, chunk_vectors, stats = loaded['doc'], loaded['chunks'], loaded['chunk_vectors'], loaded['stats']
+        if chunks:
+            logging.info(f"文档 {_tmp['location_path']} 分片入库: {stats['reused_cnt']} of {stats['chunk_cnt']} chunks reused")
+        if stats['vector_cnt'] > len(chunk_vectors if chunk_vectors is not None else []):
+            # 复用的分片带有之前补齐的向量，按数据库中的向量更新索引
+            VectorIndexServ.on_doc_backfilled(_tmp['document_id'])
+        else:
+            VectorIndexServ.on_doc_loaded(_tmp, chunk_vectors)
+        # 修改前端文件状态
+        DocEvaJs.update_doc_state(_tmp['document_id'], _tmp['kb_load_state'])
+        # 只向量化了前面的分片时，前端显示后台补齐进度
+        if _tmp['kb_load_state'] == '完成' and chunks and stats['vector_cnt'] < len(chunks):
+            DocEvaJs.update_doc_index_progress(_tmp['document_id'], stats['vector_cnt'], len(chunks))
+        return _tmp['knowledge_base_id']
+
+    def _delete_doc_item(self, document_id, knowledge_base_id, _tmp):
+        def finish(_):
+            VectorIndexServ.on_doc_deleted(document_id, knowledge_base_id)
+            # 修改前端文件状态
+            DocEvaJs.update_doc_state(_tmp['document_id'], _tmp['kb_load_state'])
+            return knowledge_base_id
+        return _WriteItem(write=lambda _: DocumentDao.delete(document_id), finish=finish)
+
+    def backfill_chunks(self):
+        """为只向量化了前面分片的大文档补齐剩余分片（低优先级），每轮最多运行 BACKFILL_SECONDS 秒"""
+        from domain.kb_domain.serv.DocLoadServ import backfill_doc_chunks
+        deadline = time.time() + BACKFILL_SECONDS
+        try:
+            for document_id in DocumentChunkDao.get_backfill_doc_ids():
+                while self._state == 'RUNNING' and time.time() < deadline:
+                    try:
+                        progress = backfill_doc_chunks(document_id)
+                    except Exception as e:
+                        logging.error(f"文档 {document_id} 分片向量补齐失败: {e}", exc_info=True)
+                        break
+                    DocEvaJs.update_doc_index_progress(document_id, progress['vector_cnt'], progress['chunk_cnt'])
+                    if progress['vector_cnt'] >= progress['chunk_cnt']:
+                        break
+                else:
+                    break
+        finally:
+            VectorIndexServ.flush()
+
+    def reembed_models(self):
+        """配置的向量模型与当前使用的模型不同时，用新模型重新生成一批向量，全部完成后切换，每轮最多运行 REEMBED_SECONDS 秒"""
+        try:
+            EmbeddingModelServ.reembed(time.time() + REEMBED_SECONDS, lambda: self._state == 'RUNNING')
+        except Exception as e:
+            logging.error(f"向量模型切换失败: {e}", exc_info=True)
+
+
+class _WriteItem:
+    """
+    写入线程处理的一项：prepare() 在事务外执行（等待编码结果），write(prepare 的结果) 只写数据库，
+    finish(write 的结果) 在写入提交后更新索引和前端文件状态，返回需要刷新状态的知识库ID（可以为 None）
+    """
+
+    def __init__(self, write=None, finish=None, prepare=None):
+        self.prepare = prepare or (lambda: None)
+        self.write = write or (lambda value: value)
+        self.finish = finish or (lambda value: None)
+
+
+class _DocWriter:
+    """
+    加载流水线的写入阶段：单独的线程按提交顺序处理 _WriteItem，每次取出队列中已有的项（最多 WRITE_GROUP_DOCS 个）作为一组，
+    一组的数据库写入在一个事务中提交（任一项失败时整组回滚，再逐项单独写入，出错的项不影响其他项），
+    提交后逐项更新索引和前端文件状态，最后统一刷新待加载数量和涉及的知识库状态
+    """
+
+    def __init__(self, stats):
+        self._stats = stats
+        self._queue = queue.Queue(maxsize=MAX_PENDING_DOCS)
+        self._thread = threading.Thread(target=self._run, name='DocWriter', daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        """
+        提交写入项，队列满时等待
+        """
+        self._queue.put(item)
+
+    def close(self):
+        """
+        等待已提交的项全部写完后结束线程
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            group = [self._queue.get()]
+            while group[-1] is not None and len(group) < WRITE_GROUP_DOCS:
+                try:
+                    group.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if group[-1] is None:
+                closed = True
+                group.pop()
+            if group:
+                self._write_group(group)
+
+    def _write_group(self, group):
+        prepared = []
+        for item in group:
+            try:
+                prepared.append((item, item.prepare()))
+            except Exception as e:
+                logging.error(f"文档写入准备失败: {e}", exc_info=True)
+
+        start = time.perf_counter()
+        written = []
+        try:
+            with transaction():
+                for item, value in prepared:
+                    written.append((item, item.write(value)))
+        except Exception as e:
+            logging.error(f"文档分组写入失败，逐个重新写入: {e}", exc_info=True)
+            written = []
+            for item, value in prepared:
+                try:
+                    written.append((item, item.write(value)))
+                except Exception as e:
+                    logging.error(f"文档写入失败: {e}", exc_info=True)
+
+        kb_ids = []
+        for item, value in written:
+            try:
+                kb_id = item.finish(value)
+            except Exception as e:
+                logging.error(f"文档索引更新失败: {e}", exc_info=True)
+                continue
+            if kb_id is not None and kb_id not in kb_ids:
+                kb_ids.append(kb_id)
+        try:
+            # 修改待加载数量
+            KBServ.update_wait_load_num()
+            # 修改前端知识库状态
+            for kb_id in kb_ids:
+                KBServ.refresh_up_kb_state(kb_id)
+        except Exception as e:
+            logging.error(f"知识库状态刷新失败: {e}", exc_info=True)
+        self._stats['write_groups'] += 1
+        self._stats['write_seconds'] += time.perf_counter() - start
 
 
 # if __name__ == '__main__':
@@ -59,12 +59,15 @@ def get_updater_path():
     else:
         return os.path.normpath(get_base_path() + '/tmp/indexdoc_win/_internal/updater.exe')
 
-def get_vector_model_path():
+def get_vector_model_path(model_name='BAAI/bge-small-zh-v1.5'):
+    # model_name 为 lib/model 下的模型目录（如 BAAI/bge-small-zh-v1.5），也可以是模型目录的绝对路径
+    if os.path.isabs(model_name):
+        return os.path.normpath(model_name)
     if is_frozen():
         # 打包后：资源在 sys._MEIPASS 中（PyInstaller 创建的临时文件夹）
-        return os.path.normpath(f'{get_base_path()}/lib/model/BAAI/bge-small-zh-v1.5')
+        return os.path.normpath(f'{get_base_path()}/lib/model/{model_name}')
     else:
-        return os.path.normpath(f'{get_base_path()}/lib/model/BAAI/bge-small-zh-v1.5')
+        return os.path.normpath(f'{get_base_path()}/lib/model/{model_name}')
 
 def get_antiword_path():
     if is_frozen():
@@ -0,0 +1,88 @@
+import hashlib
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# 中文（含扩展A、兼容汉字）连续片段
+_CJK_RUN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+# 英文、数字词，保留内部的 - _ . / 连接，如 GB/T 50016-2014、v1.5
+_ASCII_TOKEN = re.compile(r'[0-9a-z]+(?:[-_./][0-9a-z]+)*')
+_ASCII_SPLIT = re.compile(r'[-_./]')
+
+
+def tokenize(text: str) -> Counter:
+    """
+    面向中文的分词：中文按字二元组（单字片段保留单字），英文数字按词（小写），
+    带连接符的词同时保留整体和拆分后的各部分，便于精确匹配条文编号、型号等。
+
+    Returns:
+        词项 -> 出现次数
+    """
+    terms = Counter()
+    if not text:
+        return terms
+    text = text.lower()
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms[run] += 1
+        else:
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    for token in _ASCII_TOKEN.findall(text):
+        terms[token] += 1
+        parts = _ASCII_SPLIT.split(token)
+        if len(parts) > 1:
+            terms.update(p for p in parts if p)
+    return terms
+
+
+def term_id(term: str) -> int:
+    """
+    词项的 64 位哈希（有符号，对应 BIGINT），倒排索引中以整数代替字符串比较
+    """
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def text_hash(text: str) -> int:
+    """
+    文本内容的 64 位哈希（有符号，对应 BIGINT），用于按内容复用分片向量
+    """
+    return int.from_bytes(hashlib.blake2b((text or '').encode('utf-8'), digest_size=8, person=b'chunk').digest(),
+                          'little', signed=True)
+
+
+def term_counts(text: str) -> Dict[int, int]:
+    """
+    词项ID -> 出现次数
+    """
+    counts: Dict[int, int] = {}
+    for term, tf in tokenize(text).items():
+        _id = term_id(term)
+        counts[_id] = counts.get(_id, 0) + tf
+    return counts
+
+
+def build_term_rows(document_id, chunks: List[str], chunk_indices: Optional[List[int]] = None) -> Tuple[Dict[str, list], List[int]]:
+    """
+    生成文档分片的倒排索引行
+
+    Args:
+        document_id: 文档ID
+        chunks: 分片文本列表
+        chunk_indices: 分片下标，默认为 0..len(chunks)-1（只写入部分分片时给出）
+
+    Returns:
+        rows: {'term_id': [...], 'document_id': [...], 'chunk_index': [...], 'tf': [...]}，按列组织便于 UNNEST 批量写入
+        term_cnts: 每个分片的词项总数（BM25 的文档长度）
+    """
+    rows = {'term_id': [], 'document_id': [], 'chunk_index': [], 'tf': []}
+    term_cnts = []
+    if chunk_indices is None:
+        chunk_indices = range(len(chunks))
+    for chunk_index, chunk in zip(chunk_indices, chunks):
+        counts = term_counts(chunk)
+        rows['term_id'].extend(counts.keys())
+        rows['tf'].extend(counts.values())
+        rows['document_id'].extend([document_id] * len(counts))
+        rows['chunk_index'].extend([chunk_index] * len(counts))
+        term_cnts.append(sum(counts.values()))
+    return rows, term_cnts